@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import *
+from .utils.orders import delete_orders
 
 # Register your models with their admin classes
 
@@ -24,6 +25,13 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ("id", "user_type", "user_name", "selected_day",
         "week_number",  "status", "total_price")
 
+    # Leave tombstones so the apps' order sync drops deleted orders
+    def delete_model(self, request, obj):
+        delete_orders(Order.objects.filter(id=obj.id))
+
+    def delete_queryset(self, request, queryset):
+        delete_orders(queryset)
+
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ("id", "menu_name", "quantity", "order", "order_id") # <-- Added 'order_id' here
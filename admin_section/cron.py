@@ -20,3 +20,36 @@ def deactivate_menu_cycles():
     This function is called by the cron job defined in settings.py
     """
     call_command('deactivate_menu_cycles')
+
+
+def reconcile_checkout_payments():
+    """
+    Settle card checkouts left in 'awaiting_payment' (request died between
+    the Stripe call and the confirming transaction).
+    This function is called by the cron job defined in settings.py
+    """
+    call_command('reconcile_checkout_payments')
+
+
+def purge_idempotency_keys():
+    """
+    Delete expired Idempotency-Key records and order tombstones.
+    This function is called by the cron job defined in settings.py
+    """
+    call_command('purge_idempotency_keys')
+
+
+def snapshot_credit_balances():
+    """
+    Fold new credit ledger entries into per-account balance snapshots.
+    This function is called by the cron job defined in settings.py
+    """
+    call_command('snapshot_credit_balances')
+
+
+def process_promotion_evaluations():
+    """
+    Run promotion evaluations that were queued but never picked up.
+    This function is called by the cron job defined in settings.py
+    """
+    call_command('process_promotion_evaluations')
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import datetime, time
 from admin_section.models import Order
+from admin_section.utils.checkout import UNPLACED_STATUSES
 
 
 class Command(BaseCommand):
@@ -26,13 +27,14 @@ class Command(BaseCommand):
         self.stdout.write(f"Today's date: {today}")
 
         # Filter orders that should be marked as collected:
-        # - order_date is today or earlier (order_date__date__lte=today)
+        # - delivered today or earlier (delivery_date__lte=today)
         # - not yet delivered (is_delivered=False)
-        # - status is not already 'collected' or 'cancelled'
+        # - status is not already 'collected', 'cancelled' or still awaiting payment
+        #   (reconcile_checkout_payments settles those)
         orders_to_update = Order.objects.filter(
-            order_date__date__lte=today,
+            delivery_date__lte=today,
             is_delivered=False
-        ).exclude(status__in=['collected', 'cancelled'])
+        ).exclude(status__in=['collected', *UNPLACED_STATUSES])
 
         count = orders_to_update.count()
 
@@ -51,7 +53,8 @@ class Command(BaseCommand):
         else:
             updated_count = orders_to_update.update(
                 is_delivered=True,
-                status="collected"
+                status="collected",
+                updated_at=now
             )
             self.stdout.write(self.style.SUCCESS(
                 f"[CRON] {updated_count} past orders (up to {today}) marked as collected"
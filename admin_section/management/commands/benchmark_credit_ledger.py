@@ -0,0 +1,99 @@
+"""
+Management command to hammer one credit account from many threads.
+Each thread alternates €1.00 top-ups and €0.50 debits through the ledger; at
+the end the `credits` column, the ledger and the Transaction rows must all
+agree with the expected balance. A lost update shows up as a mismatch.
+"""
+import copy
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+
+from admin_section.models import CreditLedgerEntry, SecondaryStudent, Transaction
+from admin_section.utils.ledger import credit_account, debit_account, ledger_balance, to_cents
+
+
+TOP_UP = Decimal('1.00')
+DEBIT = Decimal('0.50')
+
+
+class Command(BaseCommand):
+    help = "Concurrency benchmark for the credit ledger (creates and removes a throwaway student)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent workers (default: 16)')
+        parser.add_argument('--operations', type=int, default=100, help='Operations per worker (default: 100)')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark account and its ledger rows')
+
+    def handle(self, *args, **options):
+        threads, operations = options['threads'], options['operations']
+        student = SecondaryStudent.objects.create(
+            username='ledger-bench', email=f'ledger-bench-{uuid.uuid4().hex}@example.com'
+        )
+        retries = [0]
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            user = copy.copy(student)
+            try:
+                for i in range(operations):
+                    while True:
+                        try:
+                            if i % 2 == 0:
+                                credit_account(user, 'student', TOP_UP, kind='adjustment', description='Ledger benchmark top-up')
+                            else:
+                                debit_account(user, 'student', DEBIT, kind='adjustment', description='Ledger benchmark debit')
+                            break
+                        except OperationalError:
+                            # SQLite allows one writer at a time; PostgreSQL never gets here
+                            with lock:
+                                retries[0] += 1
+                            time.sleep(0.001)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        top_ups = threads * ((operations + 1) // 2)
+        debits = threads * (operations // 2)
+        expected = to_cents(TOP_UP * top_ups - DEBIT * debits)
+
+        student.refresh_from_db()
+        column = to_cents(student.credits)
+        ledger = ledger_balance('student', student.pk)
+        transactions = to_cents(sum(Transaction.objects.filter(
+            user_type='student', user_id=student.pk
+        ).values_list('amount', flat=True)))
+
+        total = threads * operations
+        self.stdout.write(
+            f"{total} operations on one account from {threads} threads in {elapsed:.2f}s "
+            f"({total / elapsed:.0f} ops/s, {retries[0]} lock retries)"
+        )
+        self.stdout.write(
+            f"expected={expected}c credits={column}c ledger={ledger}c transactions={transactions}c"
+        )
+
+        if not options['keep']:
+            CreditLedgerEntry.objects.filter(user_type='student', user_id=student.pk).delete()
+            Transaction.objects.filter(user_type='student', user_id=student.pk).delete()
+            student.delete()
+
+        if errors:
+            raise CommandError(f"{len(errors)} worker(s) failed: {errors[0]!r}")
+        if not expected == column == ledger == transactions:
+            raise CommandError("Balances disagree: updates were lost")
+        self.stdout.write(self.style.SUCCESS("Balances agree"))
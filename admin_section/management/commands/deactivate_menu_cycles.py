@@ -2,9 +2,16 @@
 Management command to deactivate all active menu cycles
 This is scheduled to run every Friday at 9 AM via cron job
 """
-from django.core.management.base import BaseCommand
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import CharField, Count, Value
 from django.utils import timezone
-from admin_section.models import Menu
+from admin_section.models import Menu, MenuDeactivationRun
+from admin_section.utils.menus import (
+    _school_links, deactivate_unlinked_menus, invalidate_active_menus, invalidate_school_menus
+)
 
 
 class Command(BaseCommand):
@@ -16,36 +23,54 @@ class Command(BaseCommand):
             action='store_true',
             help='Show what would be deactivated without actually deactivating',
         )
+        parser.add_argument('--cycle', help='Only deactivate this cycle')
+        parser.add_argument('--school-id', type=int, help='Only deactivate menus for this school (needs --school-type)')
+        parser.add_argument('--school-type', choices=['primary', 'secondary'], help='Type of --school-id')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Menus (or school links) changed per transaction (default: 500)',
+        )
 
     def handle(self, *args, **options):
         dry_run = options.get('dry_run', False)
+        cycle_name = options.get('cycle')
+        school_id, school_type = options.get('school_id'), options.get('school_type')
+        batch_size = options['batch_size']
 
-        # Get all active menus
-        active_menus = Menu.objects.filter(is_active=True, is_deleted=False)
+        if (school_id is None) != (school_type is None):
+            raise CommandError("--school-id and --school-type must be given together.")
+
+        started = time.monotonic()
+        run = MenuDeactivationRun(scope=self._scope(cycle_name, school_type, school_id), dry_run=dry_run)
 
-        count = active_menus.count()
+        # Active menus in scope
+        active_menus = Menu.objects.filter(is_active=True, is_deleted=False)
+        if cycle_name:
+            active_menus = active_menus.filter(cycle_name=cycle_name)
+        if school_id is not None:
+            links, school_column = _school_links(school_type)
+            school_links = links.objects.filter(**{school_column: school_id}, menu__in=active_menus)
+            active_menus = active_menus.filter(id__in=school_links.values('menu_id'))
+
+        # Summary: menus per cycle, then the schools of every cycle, one grouped query each
+        menu_counts = dict(
+            active_menus.order_by().values('cycle_name').annotate(menus=Count('id')).values_list('cycle_name', 'menus')
+        )
+        count = sum(menu_counts.values())
 
         if count == 0:
             self.stdout.write(self.style.WARNING("No active menu cycles found."))
+            self._finish(run, started)
             return
 
-        # Group by cycle for better logging
-        cycles = {}
-        for menu in active_menus:
-            cycle_name = menu.cycle_name or "No Cycle Name"
-            if cycle_name not in cycles:
-                cycles[cycle_name] = {
-                    'menus': [],
-                    'primary_schools': set(),
-                    'secondary_schools': set()
-                }
-            cycles[cycle_name]['menus'].append(menu)
-
-            # Track schools
-            for school in menu.primary_schools.all():
-                cycles[cycle_name]['primary_schools'].add(school.school_name)
-            for school in menu.secondary_schools.all():
-                cycles[cycle_name]['secondary_schools'].add(school.secondary_school_name)
+        cycles = {
+            cycle or "No Cycle Name": {'menus': menus, 'primary_schools': set(), 'secondary_schools': set()}
+            for cycle, menus in menu_counts.items()
+        }
+        for cycle, school_name, kind in self._cycle_schools(active_menus, school_type, school_id):
+            cycles[cycle or "No Cycle Name"][f'{kind}_schools'].add(school_name)
 
         # Count total affected schools
         total_primary_schools = sum(len(data['primary_schools']) for data in cycles.values())
@@ -57,7 +82,7 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS(f"Menu Cycle Deactivation - {timezone.now().strftime('%d %b %Y, %I:%M %p')}"))
         self.stdout.write(self.style.SUCCESS(f"{'='*70}\n"))
 
-        self.stdout.write(self.style.WARNING(f"📊 SUMMARY:"))
+        self.stdout.write(self.style.WARNING(f"📊 SUMMARY ({run.scope}):"))
         self.stdout.write(f"  • Active Menu Cycles: {len(cycles)}")
         self.stdout.write(f"  • Total Menu Items: {count}")
         self.stdout.write(f"  • Affected Primary Schools: {total_primary_schools}")
@@ -65,9 +90,9 @@ class Command(BaseCommand):
         self.stdout.write(f"  • Total Affected Schools: {total_schools}")
         self.stdout.write("")
 
-        for cycle_name, data in cycles.items():
-            self.stdout.write(self.style.WARNING(f"📋 Cycle: {cycle_name}"))
-            self.stdout.write(f"  - Menu items: {len(data['menus'])}")
+        for name, data in cycles.items():
+            self.stdout.write(self.style.WARNING(f"📋 Cycle: {name}"))
+            self.stdout.write(f"  - Menu items: {data['menus']}")
 
             if data['primary_schools']:
                 self.stdout.write(f"  - Primary Schools ({len(data['primary_schools'])}): {', '.join(sorted(data['primary_schools']))}")
@@ -83,14 +108,77 @@ class Command(BaseCommand):
             ))
             self.stdout.write("Run without --dry-run to actually deactivate.")
         else:
-            # Deactivate all active menus
-            active_menus.update(is_active=False)
+            if school_id is None:
+                # Deactivate the menus in scope, a batch per transaction
+                def deactivate(ids):
+                    invalidate_active_menus(ids)
+                    return Menu.objects.filter(id__in=ids, is_active=True).update(is_active=False)
+
+                run.menus_deactivated = self._in_batches(active_menus, batch_size, deactivate)
+            else:
+                # Unlink the school; menus no other school uses are deactivated
+                def unlink(ids):
+                    menu_ids = set(links.objects.filter(id__in=ids).values_list('menu_id', flat=True))
+                    removed, _ = links.objects.filter(id__in=ids).delete()
+                    run.menus_deactivated += deactivate_unlinked_menus(menu_ids)
+                    return removed
+
+                run.links_removed = self._in_batches(school_links, batch_size, unlink)
+                # Menus left without a school were deactivated, so no other school's menu changed
+                invalidate_school_menus([(school_type, school_id)])
 
             self.stdout.write(self.style.SUCCESS(
-                f"\n✓ Successfully deactivated {count} menu items across {len(cycles)} cycle(s)!"
-            ))
-            self.stdout.write(self.style.SUCCESS(
-                "All schools now have inactive menus. Admins need to activate new cycles."
+                f"\n✓ Successfully deactivated {run.menus_deactivated} menu items across {len(cycles)} cycle(s)!"
             ))
+            if school_id is None and not cycle_name:
+                self.stdout.write(self.style.SUCCESS(
+                    "All schools now have inactive menus. Admins need to activate new cycles."
+                ))
 
         self.stdout.write(self.style.SUCCESS(f"\n{'='*70}\n"))
+        self._finish(run, started)
+
+    @staticmethod
+    def _scope(cycle_name, school_type, school_id):
+        parts = []
+        if cycle_name:
+            parts.append(f"cycle={cycle_name}")
+        if school_id is not None:
+            parts.append(f"{school_type}_school={school_id}")
+        return ', '.join(parts) or 'all'
+
+    @staticmethod
+    def _cycle_schools(active_menus, school_type, school_id):
+        """(cycle_name, school name, 'primary'|'secondary') for every school linked to the menus, one UNION query"""
+        per_type = []
+        for kind, name_field in (('primary', 'primaryschool__school_name'), ('secondary', 'secondaryschool__secondary_school_name')):
+            if school_type and kind != school_type:
+                continue
+            links, school_column = _school_links(kind)
+            rows = links.objects.filter(menu__in=active_menus)
+            if school_id is not None:
+                rows = rows.filter(**{school_column: school_id})
+            per_type.append(rows.values_list('menu__cycle_name', name_field, Value(kind, output_field=CharField())))
+        return per_type[0].union(*per_type[1:])
+
+    @staticmethod
+    def _in_batches(queryset, batch_size, apply):
+        """Apply `apply(ids)` to `queryset` a batch at a time until it is empty; returns the total it reports"""
+        total = 0
+        while True:
+            ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return total
+            with transaction.atomic():
+                changed = apply(ids)
+            if not changed:
+                return total
+            total += changed
+
+    def _finish(self, run, started):
+        run.duration_ms = int((time.monotonic() - started) * 1000)
+        run.save()
+        self.stdout.write(
+            f"[CRON] {run.scope}: {run.menus_deactivated} menu(s) deactivated, "
+            f"{run.links_removed} school link(s) removed in {run.duration_ms} ms"
+        )
@@ -4,6 +4,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 
 from admin_section.models import Order
+from admin_section.utils.orders import delete_orders
 
 
 class Command(BaseCommand):
@@ -60,7 +61,7 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING("Aborted. No orders were deleted."))
             return
 
-        deleted, _ = old_orders.delete()
+        deleted = delete_orders(old_orders)
         self.stdout.write(self.style.SUCCESS(
             f"Successfully deleted {deleted} order(s) older than {weeks} weeks."
         ))
@@ -0,0 +1,46 @@
+"""
+Management command to export orders as NDJSON or CSV.
+Orders are streamed chunk by chunk, so memory stays flat for any date range.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from admin_section.utils.order_export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_filters, export_lines
+
+
+class Command(BaseCommand):
+    help = "Export orders (with their items) as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson', help='Output format (default: ndjson)')
+        parser.add_argument('--from', dest='date_from', help='First delivery date to export (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', help='Last delivery date to export (YYYY-MM-DD)')
+        parser.add_argument('--school-id', type=int, help='Only export orders of this school (needs --school-type)')
+        parser.add_argument('--school-type', choices=['primary', 'secondary'], help='Type of --school-id')
+        parser.add_argument('--output', help='File to write (default: standard output)')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help=f'Orders read per round trip (default: {EXPORT_CHUNK_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            filters = export_filters(options)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        lines = export_lines(filters, options['format'], chunk_size=options['chunk_size'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        written = 0
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for line in lines:
+                output.write(line)
+                written += 1
+        if options['format'] == 'csv':
+            written -= 1  # header
+        self.stdout.write(self.style.SUCCESS(f"Exported {written} {options['format']} row(s) to {options['output']}"))
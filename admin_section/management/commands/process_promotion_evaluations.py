@@ -0,0 +1,48 @@
+"""
+Management command to run promotion evaluations the worker pool never picked up.
+Checkout queues a PromotionEvaluation and runs it after commit on a thread
+pool; if the process restarts first, the row stays pending and is handled here.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from admin_section.models import PromotionEvaluation
+from admin_section.utils.promotions import run_promotion_evaluation
+
+
+class Command(BaseCommand):
+    help = "Run promotion evaluations left pending"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than',
+            type=int,
+            default=2,
+            help='Only run evaluations queued more than this many minutes ago (default: 2).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show how many evaluations are pending without running them',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['older_than'])
+        pending_ids = list(
+            PromotionEvaluation.objects.filter(status='pending', created_at__lt=cutoff)
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f"[DRY RUN] {len(pending_ids)} pending promotion evaluation(s) found"
+            ))
+            return
+
+        done = sum(1 for evaluation_id in pending_ids if run_promotion_evaluation(evaluation_id))
+        self.stdout.write(self.style.SUCCESS(
+            f"[CRON] {done} of {len(pending_ids)} pending promotion evaluation(s) completed"
+        ))
@@ -0,0 +1,40 @@
+"""
+Management command to evict expired Idempotency-Key records and order tombstones.
+Expired keys are already ignored by the request path, and sync tokens older than
+ORDER_TOMBSTONE_RETENTION get a full resync; this keeps both tables small.
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from admin_section.models import IdempotencyKey
+from admin_section.utils.orders import expired_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete Idempotency-Key records past their expiry and order tombstones past their retention"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show how many records would be deleted without deleting them',
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = IdempotencyKey.objects.filter(expires_at__lte=now)
+        tombstones = expired_tombstones(now)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f"[DRY RUN] {expired.count()} expired idempotency key(s) would be deleted"
+            ))
+            self.stdout.write(self.style.WARNING(
+                f"[DRY RUN] {tombstones.count()} expired order tombstone(s) would be deleted"
+            ))
+            return
+
+        deleted, _ = expired.delete()
+        self.stdout.write(self.style.SUCCESS(f"[CRON] {deleted} expired idempotency key(s) deleted"))
+        deleted, _ = tombstones.delete()
+        self.stdout.write(self.style.SUCCESS(f"[CRON] {deleted} expired order tombstone(s) deleted"))
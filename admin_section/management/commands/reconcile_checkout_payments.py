@@ -0,0 +1,94 @@
+"""
+Management command to settle card checkouts interrupted between phases.
+Orders are committed as 'awaiting_payment' before Stripe is called; if the
+request dies before the second phase, this command looks up the checkout's
+PaymentIntent and either confirms the orders or removes them.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from admin_section.models import Order, ParentRegisteration, SecondaryStudent, StaffRegisteration
+from admin_section.utils.checkout import AWAITING_PAYMENT, confirm_checkout_payment, rollback_checkout
+from admin_section.utils.stripe_gateway import get_stripe
+
+
+# Intent states in which the customer has paid or can still complete payment
+PAID_INTENT_STATUSES = {'succeeded', 'processing', 'requires_capture', 'requires_action'}
+
+USER_MODELS = {
+    'parent': ParentRegisteration,
+    'staff': StaffRegisteration,
+    'student': SecondaryStudent,
+}
+
+
+class Command(BaseCommand):
+    help = "Confirm or roll back card checkouts left in 'awaiting_payment'"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than',
+            type=int,
+            default=15,
+            help='Only settle checkouts older than this many minutes (default: 15).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would be settled without changing anything',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        cutoff = timezone.now() - timedelta(minutes=options['older_than'])
+        gateway = get_stripe()
+
+        checkout_refs = list(
+            Order.objects.filter(status=AWAITING_PAYMENT, created_at__lt=cutoff)
+            .values_list('payment_id', flat=True)
+            .distinct()
+        )
+        if not checkout_refs:
+            self.stdout.write(self.style.SUCCESS("No interrupted checkouts found."))
+            return
+
+        confirmed = rolled_back = 0
+        for checkout_ref in checkout_refs:
+            intents = gateway.PaymentIntent.search(query=f"metadata['checkout_ref']:'{checkout_ref}'").data
+            intent = next((i for i in intents if i.status in PAID_INTENT_STATUSES), None)
+
+            if intent is None:
+                self.stdout.write(f"  - {checkout_ref}: no payment, rolling back")
+                if not dry_run and rollback_checkout(checkout_ref):
+                    rolled_back += 1
+                continue
+
+            self.stdout.write(f"  - {checkout_ref}: paid by {intent.id} ({intent.status}), confirming")
+            if dry_run:
+                continue
+
+            with transaction.atomic():
+                orders = list(Order.objects.select_for_update().filter(
+                    payment_id=checkout_ref, status=AWAITING_PAYMENT
+                ))
+                if not orders:
+                    continue
+                user_model = USER_MODELS.get(orders[0].user_type)
+                user = user_model.objects.filter(id=orders[0].user_id).first() if user_model else None
+                if user is None:
+                    self.stdout.write(self.style.ERROR(f"    user for {checkout_ref} no longer exists, skipped"))
+                    continue
+                if confirm_checkout_payment(user, orders[0].user_type, orders, intent.id):
+                    confirmed += 1
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(
+                f"[DRY RUN] {len(checkout_refs)} interrupted checkout(s) found, nothing changed"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"[CRON] {confirmed} checkout(s) confirmed, {rolled_back} rolled back"
+            ))
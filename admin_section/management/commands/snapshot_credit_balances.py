@@ -0,0 +1,29 @@
+"""
+Management command to fold new credit ledger entries into balance snapshots.
+Keeps ledger_balance() reading only the entries written since the last run.
+"""
+from django.core.management.base import BaseCommand
+
+from admin_section.utils.ledger import pending_snapshot_accounts, take_balance_snapshots
+
+
+class Command(BaseCommand):
+    help = "Snapshot credit balances from the ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show how many accounts have entries to fold without writing snapshots',
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            pending = pending_snapshot_accounts().count()
+            self.stdout.write(self.style.WARNING(
+                f"[DRY RUN] {pending} account(s) with ledger entries written since their last snapshot"
+            ))
+            return
+
+        accounts = take_balance_snapshots()
+        self.stdout.write(self.style.SUCCESS(f"[CRON] {accounts} account snapshot(s) updated"))
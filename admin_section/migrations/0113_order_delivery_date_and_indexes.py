@@ -0,0 +1,79 @@
+# Generated by Django 5.1.4 on 2026-10-18 07:35
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_delivery_date(apps, schema_editor):
+    """Store the local date of every existing order_date"""
+    Order = apps.get_model('admin_section', 'Order')
+
+    if schema_editor.connection.vendor == 'postgresql':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE admin_section_order "
+                "SET delivery_date = (order_date AT TIME ZONE %s)::date "
+                "WHERE order_date IS NOT NULL",
+                [settings.TIME_ZONE],
+            )
+        return
+
+    batch = []
+    for order in Order.objects.only('id', 'order_date').iterator(chunk_size=2000):
+        if order.order_date is None:
+            continue
+        order_date = order.order_date
+        if timezone.is_aware(order_date):
+            order_date = timezone.localtime(order_date)
+        order.delivery_date = order_date.date()
+        batch.append(order)
+        if len(batch) >= 2000:
+            Order.objects.bulk_update(batch, ['delivery_date'])
+            batch = []
+    if batch:
+        Order.objects.bulk_update(batch, ['delivery_date'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0112_managerorder_custom_school_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='delivery_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_delivery_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['primary_school', 'year', 'week_number', 'selected_day'], name='order_primary_week_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['secondary_school', 'year', 'week_number', 'selected_day'], name='order_secondary_week_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['child_id', 'year', 'week_number'], name='order_child_week_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user_id', 'user_type', '-order_date'], name='order_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['primary_school', 'delivery_date'], name='order_primary_delivery_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['secondary_school', 'delivery_date'], name='order_secondary_delivery_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('is_delivered', False)), fields=['delivery_date'], name='order_undelivered_date_idx'),
+        ),
+    ]
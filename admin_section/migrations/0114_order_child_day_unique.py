@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 07:37
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_no_duplicate_child_orders(apps, schema_editor):
+    """Fail with a readable list instead of a raw constraint error"""
+    Order = apps.get_model('admin_section', 'Order')
+    duplicates = list(
+        Order.objects.filter(child_id__isnull=False, primary_school__isnull=False)
+        .exclude(status='cancelled')
+        .values('child_id', 'year', 'week_number', day=Lower('selected_day'))
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)[:20]
+    )
+    if duplicates:
+        raise RuntimeError(
+            "Cannot add order_child_day_unique: cancel the duplicate child orders first "
+            f"(child_id/year/week_number/day): {duplicates}"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0113_order_delivery_date_and_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_no_duplicate_child_orders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(models.F('child_id'), models.F('year'), models.F('week_number'), django.db.models.functions.text.Lower('selected_day'), condition=models.Q(('child_id__isnull', False), ('primary_school__isnull', False), models.Q(('status', 'cancelled'), _negated=True)), name='order_child_day_unique'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.1.4 on 2026-10-18 07:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+
+
+def record_opening_balances(apps, schema_editor):
+    """One 'opening' ledger entry per account holding credits today"""
+    CreditLedgerEntry = apps.get_model('admin_section', 'CreditLedgerEntry')
+    accounts = [
+        ('parent', apps.get_model('admin_section', 'ParentRegisteration')),
+        ('staff', apps.get_model('admin_section', 'StaffRegisteration')),
+        ('student', apps.get_model('admin_section', 'SecondaryStudent')),
+    ]
+    for user_type, model in accounts:
+        batch = []
+        for user_id, credits in model.objects.exclude(credits=0).values_list('id', 'credits').iterator(chunk_size=2000):
+            batch.append(CreditLedgerEntry(
+                user_id=user_id,
+                user_type=user_type,
+                amount_cents=int((Decimal(str(credits)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP)),
+                kind='opening',
+                description='Opening balance',
+            ))
+            if len(batch) >= 2000:
+                CreditLedgerEntry.objects.bulk_create(batch)
+                batch = []
+        CreditLedgerEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0115_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreditBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('user_type', models.CharField(max_length=50)),
+                ('balance_cents', models.BigIntegerField(default=0)),
+                ('last_entry_id', models.BigIntegerField(default=0)),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'unique_together': {('user_type', 'user_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CreditLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('user_type', models.CharField(max_length=50)),
+                ('amount_cents', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('opening', 'Opening balance'), ('top_up', 'Top-up'), ('order_payment', 'Order payment'), ('refund', 'Refund'), ('promotion', 'Promotion reward'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='admin_section.order')),
+                ('transaction', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entry', to='admin_section.transaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_type', 'user_id', 'id'], name='ledger_account_idx')],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-18 07:50
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_existing_redemptions(apps, schema_editor):
+    Promotion = apps.get_model('admin_section', 'Promotion')
+    UserPromotion = apps.get_model('admin_section', 'UserPromotion')
+
+    redemptions = (
+        UserPromotion.objects.filter(promotion=OuterRef('pk'))
+        .order_by()
+        .values('promotion')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    Promotion.objects.update(
+        redeemed_count=Coalesce(Subquery(redemptions, output_field=IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0116_credit_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='promotion',
+            name='redeemed_count',
+            field=models.PositiveIntegerField(default=0, help_text='UserPromotion rows for this promotion, maintained by redeem_promotion()'),
+        ),
+        migrations.RunPython(count_existing_redemptions, migrations.RunPython.noop),
+    ]
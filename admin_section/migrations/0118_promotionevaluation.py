@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-18 07:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0117_promotion_redeemed_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromotionEvaluation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('user_type', models.CharField(max_length=20)),
+                ('school_id', models.IntegerField(blank=True, null=True)),
+                ('school_type', models.CharField(blank=True, max_length=20, null=True)),
+                ('order_total', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('rewards', models.JSONField(blank=True, default=list)),
+                ('pending_promotions', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='promo_eval_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.4 on 2026-10-18 07:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_progress(apps, schema_editor):
+    """Count existing orders towards every active promotion"""
+    Order = apps.get_model('admin_section', 'Order')
+    Promotion = apps.get_model('admin_section', 'Promotion')
+    PromotionProgress = apps.get_model('admin_section', 'PromotionProgress')
+
+    for promotion in Promotion.objects.filter(is_active=True):
+        orders = Order.objects.filter(
+            delivery_date__gte=promotion.start_date,
+            delivery_date__lte=promotion.end_date
+        ).exclude(status__in=['cancelled', 'awaiting_payment'])
+        if promotion.exclude_primary_orders:
+            orders = orders.filter(primary_school__isnull=True)
+        PromotionProgress.objects.bulk_create([
+            PromotionProgress(promotion=promotion, user_type=row['user_type'], user_id=row['user_id'],
+                              order_count=row['total'])
+            for row in orders.values('user_type', 'user_id').annotate(total=Count('id')).order_by()
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0118_promotionevaluation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromotionProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('user_type', models.CharField(max_length=20)),
+                ('order_count', models.IntegerField(default=0)),
+                ('promotion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='admin_section.promotion')),
+            ],
+            options={
+                'unique_together': {('user_type', 'user_id', 'promotion')},
+            },
+        ),
+        migrations.RunPython(build_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.4 on 2026-10-18 07:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_schools_json(apps, schema_editor):
+    """Create a PromotionSchool row for every existing school in Promotion.schools"""
+    Promotion = apps.get_model('admin_section', 'Promotion')
+    PromotionSchool = apps.get_model('admin_section', 'PromotionSchool')
+    primary_ids = set(apps.get_model('admin_section', 'PrimarySchool').objects.values_list('id', flat=True))
+    secondary_ids = set(apps.get_model('admin_section', 'SecondarySchool').objects.values_list('id', flat=True))
+
+    rows = []
+    for promotion in Promotion.objects.exclude(schools=[]).only('id', 'schools'):
+        seen = set()
+        for school in promotion.schools or []:
+            try:
+                school_id, school_type = int(school.get('id')), school.get('type')
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if (school_type, school_id) in seen:
+                continue
+            seen.add((school_type, school_id))
+            if school_type == 'primary' and school_id in primary_ids:
+                rows.append(PromotionSchool(promotion_id=promotion.id, primary_school_id=school_id))
+            elif school_type == 'secondary' and school_id in secondary_ids:
+                rows.append(PromotionSchool(promotion_id=promotion.id, secondary_school_id=school_id))
+    PromotionSchool.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0119_promotionprogress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromotionSchool',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('primary_school', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promotion_targets', to='admin_section.primaryschool')),
+                ('promotion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='school_targets', to='admin_section.promotion')),
+                ('secondary_school', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promotion_targets', to='admin_section.secondaryschool')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('primary_school', 'promotion'), name='promotion_primary_school_unique'), models.UniqueConstraint(fields=('secondary_school', 'promotion'), name='promotion_secondary_school_unique'), models.CheckConstraint(condition=models.Q(('primary_school__isnull', True), ('secondary_school__isnull', True), _connector='XOR'), name='promotion_school_one_type')],
+            },
+        ),
+        migrations.RunPython(copy_schools_json, migrations.RunPython.noop),
+    ]
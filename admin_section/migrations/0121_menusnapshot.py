@@ -0,0 +1,31 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0120_promotionschool'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('school_type', models.CharField(max_length=20)),
+                ('school_id', models.IntegerField()),
+                ('base_url', models.CharField(blank=True, default='', max_length=255)),
+                ('menu_body', models.TextField()),
+                ('menu_etag', models.CharField(max_length=66)),
+                ('items_body', models.TextField()),
+                ('items_etag', models.CharField(max_length=66)),
+                ('published_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'unique_together': {('school_type', 'school_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:02
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Lower
+
+
+def link_menu_items(apps, schema_editor):
+    """Point every Menu at the oldest MenuItems whose name matches case-insensitively"""
+    Menu = apps.get_model('admin_section', 'Menu')
+    MenuItems = apps.get_model('admin_section', 'MenuItems')
+    Menu.objects.update(menu_item=Subquery(
+        MenuItems.objects.annotate(lower_name=Lower('item_name'))
+        .filter(lower_name=Lower(OuterRef('name')))
+        .order_by('id')
+        .values('id')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0121_menusnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menu',
+            name='menu_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='menus', to='admin_section.menuitems'),
+        ),
+        migrations.AddIndex(
+            model_name='menuitems',
+            index=models.Index(django.db.models.functions.text.Lower('item_name'), name='menuitems_lower_name_idx'),
+        ),
+        migrations.RunPython(link_menu_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0122_menu_menu_item'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuDeactivationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(default='all', max_length=150)),
+                ('dry_run', models.BooleanField(default=False)),
+                ('menus_deactivated', models.PositiveIntegerField(default=0)),
+                ('links_removed', models.PositiveIntegerField(default=0)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0123_menudeactivationrun'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='managerorder',
+            index=models.Index(fields=['-order_date', '-id'], name='manager_order_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-order_date', '-id'], name='order_date_id_idx'),
+        ),
+    ]
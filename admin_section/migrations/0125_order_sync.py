@@ -0,0 +1,46 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:20
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated_at(apps, schema_editor):
+    """Existing orders were last changed, as far as we know, when they were created"""
+    Order = apps.get_model('admin_section', 'Order')
+    Order.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0124_order_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.BigIntegerField()),
+                ('user_id', models.BigIntegerField(blank=True, null=True)),
+                ('user_type', models.CharField(max_length=50)),
+                ('child_id', models.BigIntegerField(blank=True, null=True)),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user_id', 'user_type', 'updated_at'], name='order_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ordertombstone',
+            index=models.Index(fields=['user_id', 'user_type', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:30
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0125_order_sync'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='menusnapshot',
+            unique_together={('school_type', 'school_id', 'base_url')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0126_menusnapshot_base_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, help_text='Lease of the request running the view; an in-progress key can be taken over after it', null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0127_idempotencykey_locked_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menusnapshot',
+            name='is_stale',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='menusnapshot',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
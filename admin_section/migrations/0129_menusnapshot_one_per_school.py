@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:01
+
+from django.db import migrations
+
+
+def drop_snapshots(apps, schema_editor):
+    """Snapshots are republished on the next read; per-host duplicates would break the new key"""
+    apps.get_model('admin_section', 'MenuSnapshot').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_section', '0128_menusnapshot_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_snapshots, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='menusnapshot',
+            unique_together={('school_type', 'school_id')},
+        ),
+        migrations.RemoveField(
+            model_name='menusnapshot',
+            name='base_url',
+        ),
+    ]
@@ -3,8 +3,12 @@ from django.db import models
 from datetime import datetime, timedelta
 from django.utils import timezone
 from django.db.models import JSONField
+from django.db.models.functions import Lower
 from django.contrib.auth.hashers import make_password
 
+from .utils.ledger import credit_account
+from .utils.user_names import resolve_user_name
+
 
 # ------------------------------
 # School Models
@@ -55,8 +59,7 @@ class ParentRegisteration(models.Model):
         super().save(*args, **kwargs)
 
     def top_up_credits(self, amount):
-        self.credits += amount
-        self.save()
+        credit_account(self, 'parent', amount, kind='top_up', description=f"Credit top-up of €{amount}")
 
 
 class StaffRegisteration(models.Model):
@@ -82,8 +85,7 @@ class StaffRegisteration(models.Model):
         super().save(*args, **kwargs)
 
     def top_up_credits(self, amount):
-        self.credits += amount
-        self.save()
+        credit_account(self, 'staff', amount, kind='top_up', description=f"Credit top-up of €{amount}")
 
     def __str__(self):
         return f"{self.id}"
@@ -139,8 +141,7 @@ class SecondaryStudent(models.Model):
         super().save(*args, **kwargs)
 
     def top_up_credits(self, amount):
-        self.credits += amount
-        self.save()
+        credit_account(self, 'student', amount, kind='top_up', description=f"Credit top-up of €{amount}")
 
     def __str__(self):
         return f"{self.username} - {self.class_year}-{self.id}"
@@ -187,6 +188,9 @@ class Menu(models.Model):
     category = models.ForeignKey(Categories, on_delete=models.CASCADE, related_name="menus")
     primary_schools = models.ManyToManyField(PrimarySchool, blank=True, related_name="menus")
     secondary_schools = models.ManyToManyField(SecondarySchool, blank=True, related_name="menus")
+    # MenuItems whose name matches `name` case-insensitively, resolved on save
+    # by the menu and cycle views (see utils/menus.resolve_menu_items)
+    menu_item = models.ForeignKey('MenuItems', on_delete=models.SET_NULL, null=True, blank=True, related_name="menus")
 
     def __str__(self):
         return f"{self.id} Menu: {self.menu_day} {self.name} - {self.cycle_name}"
@@ -212,13 +216,66 @@ class MenuItems(models.Model):
     production_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, default=0)
     is_available = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(Lower('item_name'), name='menuitems_lower_name_idx'),
+        ]
+
     def __str__(self):
         return f"{self.id} Items: {self.item_name}"
 
 
+class MenuSnapshot(models.Model):
+    """
+    Published active menu of one school, pre-serialized for get_active_menu
+    and manager/school-menus together with the ETag of each body. Image URLs
+    are joined onto settings.MENU_IMAGE_BASE_URL. Rows are rewritten on publish and
+    marked stale, with a new version, when menus change; a publish only
+    stores its body if the version is still the one it started from (see
+    utils/menus.py).
+    """
+    school_type = models.CharField(max_length=20)
+    school_id = models.IntegerField()
+    menu_body = models.TextField()
+    menu_etag = models.CharField(max_length=66)
+    items_body = models.TextField()
+    items_etag = models.CharField(max_length=66)
+    published_at = models.DateTimeField(default=timezone.now)
+    version = models.PositiveIntegerField(default=0)
+    is_stale = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('school_type', 'school_id')
+
+    def __str__(self):
+        return f"{self.school_type} {self.school_id} - {self.menu_etag}"
+
+
+class MenuDeactivationRun(models.Model):
+    """One run of the deactivate_menu_cycles command"""
+    scope = models.CharField(max_length=150, default='all')
+    dry_run = models.BooleanField(default=False)
+    menus_deactivated = models.PositiveIntegerField(default=0)
+    links_removed = models.PositiveIntegerField(default=0)
+    duration_ms = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.started_at:%Y-%m-%d %H:%M} {self.scope} - {self.menus_deactivated} menus"
+
+
 # ------------------------------
 # Order Models
 # ------------------------------
+def local_delivery_date(order_date):
+    """Local calendar day an order is delivered on (naive values are already local)"""
+    if order_date is None:
+        return None
+    if timezone.is_naive(order_date):
+        return order_date.date()
+    return timezone.localtime(order_date).date()
+
+
 class Order(models.Model):
     user_id = models.BigIntegerField(null=True, blank=True)
     user_type = models.CharField(max_length=50)
@@ -227,7 +284,11 @@ class Order(models.Model):
     week_number = models.BigIntegerField(null=True)
     year = models.BigIntegerField(null=True)
     order_date = models.DateTimeField(default=datetime.utcnow)
+    # Local date of order_date, stored so date filters can use an index
+    delivery_date = models.DateField(null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
+    # Bumped on every change; queryset updates must set it themselves (see orders/sync/)
+    updated_at = models.DateTimeField(auto_now=True)
     selected_day = models.CharField(max_length=10)
     is_delivered = models.BooleanField(default=False)
     status = models.CharField(max_length=20, default='pending')
@@ -239,24 +300,45 @@ class Order(models.Model):
     primary_school = models.ForeignKey(PrimarySchool, on_delete=models.SET_NULL, null=True, blank=True)
     secondary_school = models.ForeignKey(SecondarySchool, on_delete=models.SET_NULL, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # fetch_orders / order sheets
+            models.Index(fields=['primary_school', 'year', 'week_number', 'selected_day'], name='order_primary_week_idx'),
+            models.Index(fields=['secondary_school', 'year', 'week_number', 'selected_day'], name='order_secondary_week_idx'),
+            # one-order-per-child-per-day check, staff child history
+            models.Index(fields=['child_id', 'year', 'week_number'], name='order_child_week_idx'),
+            # get_orders_by_user
+            models.Index(fields=['user_id', 'user_type', '-order_date'], name='order_user_date_idx'),
+            # get_all_orders keyset pages
+            models.Index(fields=['-order_date', '-id'], name='order_date_id_idx'),
+            # orders/sync/
+            models.Index(fields=['user_id', 'user_type', 'updated_at'], name='order_user_updated_idx'),
+            # school analytics date ranges
+            models.Index(fields=['primary_school', 'delivery_date'], name='order_primary_delivery_idx'),
+            models.Index(fields=['secondary_school', 'delivery_date'], name='order_secondary_delivery_idx'),
+            # auto_complete_orders only ever looks at undelivered orders
+            models.Index(fields=['delivery_date'], condition=models.Q(is_delivered=False), name='order_undelivered_date_idx'),
+        ]
+        constraints = [
+            # A primary school child gets one (non-cancelled) order per day
+            models.UniqueConstraint(
+                models.F('child_id'), models.F('year'), models.F('week_number'), Lower('selected_day'),
+                condition=models.Q(child_id__isnull=False, primary_school__isnull=False) & ~models.Q(status='cancelled'),
+                name='order_child_day_unique',
+            ),
+        ]
+
     def save(self, *args, **kwargs):
-        self.user_name = self.get_user_name()
+        self.delivery_date = local_delivery_date(self.order_date)
+        # user_name is denormalized once; callers that have the user in hand set it directly
+        if self.user_name is None:
+            self.user_name = self.get_user_name()
         super().save(*args, **kwargs)
 
     def get_user_name(self):
-        if self.user_type == 'student':
-            student = SecondaryStudent.objects.filter(id=self.user_id).first()
-            if student:
-                return student.username
-        elif self.user_type == 'parent':
-            parent = ParentRegisteration.objects.filter(id=self.user_id).first()
-            if parent:
-                return parent.username
-        elif self.user_type == 'staff':
-            staff = StaffRegisteration.objects.filter(id=self.user_id).first()
-            if staff:
-                return staff.username
-        return ""
+        if self.user_type not in ('student', 'parent', 'staff'):
+            return ""
+        return resolve_user_name(self.user_type, self.user_id)
 
     @property
     def order_summary(self):
@@ -301,6 +383,23 @@ class OrderItem(models.Model):
         return self._menu_price or (self.menu.price if self.menu else 0)
 
 
+class OrderTombstone(models.Model):
+    """A deleted Order, kept so orders/sync/ can tell clients to drop it"""
+    order_id = models.BigIntegerField()
+    user_id = models.BigIntegerField(null=True, blank=True)
+    user_type = models.CharField(max_length=50)
+    child_id = models.BigIntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'user_type', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"Deleted order {self.order_id}"
+
+
 # ------------------------------
 # Transaction/Payment Records
 # ------------------------------
@@ -338,6 +437,54 @@ class Transaction(models.Model):
         return f"Transaction {self.id} - {self.user_type} {self.user_id} - {self.amount} ({self.payment_method})"
 
 
+class CreditLedgerEntry(models.Model):
+    """
+    Append-only record of a credit balance change, in integer cents.
+    Written in the same transaction as the Transaction it belongs to and the
+    F() update of the user's `credits` column (see utils/ledger.py).
+    """
+    KIND_CHOICES = [
+        ('opening', 'Opening balance'),
+        ('top_up', 'Top-up'),
+        ('order_payment', 'Order payment'),
+        ('refund', 'Refund'),
+        ('promotion', 'Promotion reward'),
+        ('adjustment', 'Adjustment'),
+    ]
+
+    user_id = models.BigIntegerField()
+    user_type = models.CharField(max_length=50)
+    amount_cents = models.BigIntegerField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    transaction = models.OneToOneField(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entry')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    description = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_type', 'user_id', 'id'], name='ledger_account_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_type} {self.user_id}: {self.amount_cents:+d}c ({self.kind})"
+
+
+class CreditBalanceSnapshot(models.Model):
+    """Balance of one account up to and including ledger entry `last_entry_id`"""
+    user_id = models.BigIntegerField()
+    user_type = models.CharField(max_length=50)
+    balance_cents = models.BigIntegerField(default=0)
+    last_entry_id = models.BigIntegerField(default=0)
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('user_type', 'user_id')
+
+    def __str__(self):
+        return f"{self.user_type} {self.user_id}: {self.balance_cents}c @ {self.last_entry_id}"
+
+
 # ------------------------------
 # Canteen Staff & Contact
 # ------------------------------
@@ -388,11 +535,20 @@ class ManagerOrder(models.Model):
     selected_day = models.CharField(max_length=20, blank=True, null=True)
     is_delivered = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # get_all_orders keyset pages
+            models.Index(fields=['-order_date', '-id'], name='manager_order_date_id_idx'),
+        ]
+
     def __str__(self):
         return f"ManagerOrder {self.id} - {self.manager_name or (self.manager.username if self.manager else 'Unknown')}"
 
     @property
     def total_production_price(self):
+        # Already summed by the database when loaded through utils.orders.manager_order_queryset()
+        if hasattr(self, 'production_total'):
+            return self.production_total
         total = sum(item.production_price or 0 for item in self.items.all())
         return total
 
@@ -521,11 +677,40 @@ class Promotion(models.Model):
         null=True, blank=True,
         help_text="Max total redemptions across all users. Null = unlimited."
     )
+    redeemed_count = models.PositiveIntegerField(
+        default=0,
+        help_text="UserPromotion rows for this promotion, maintained by redeem_promotion()"
+    )
 
     def __str__(self):
         return f"{self.name} ({self.start_date} - {self.end_date})"
 
 
+class PromotionSchool(models.Model):
+    """
+    School a promotion is limited to. Mirrors the schools of Promotion.schools
+    that exist, which the CRUD views still write; whether a promotion is
+    targeted at all is decided by that list being non-empty, not by these rows.
+    """
+    promotion = models.ForeignKey(Promotion, on_delete=models.CASCADE, related_name='school_targets')
+    primary_school = models.ForeignKey(PrimarySchool, on_delete=models.CASCADE, null=True, blank=True, related_name='promotion_targets')
+    secondary_school = models.ForeignKey(SecondarySchool, on_delete=models.CASCADE, null=True, blank=True, related_name='promotion_targets')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['primary_school', 'promotion'], name='promotion_primary_school_unique'),
+            models.UniqueConstraint(fields=['secondary_school', 'promotion'], name='promotion_secondary_school_unique'),
+            models.CheckConstraint(
+                condition=models.Q(primary_school__isnull=True) ^ models.Q(secondary_school__isnull=True),
+                name='promotion_school_one_type'
+            ),
+        ]
+
+    def __str__(self):
+        school = self.primary_school_id and f"primary {self.primary_school_id}" or f"secondary {self.secondary_school_id}"
+        return f"{self.promotion_id} - {school}"
+
+
 class UserPromotion(models.Model):
     USER_TYPE_CHOICES = [
         ('parent', 'Parent'),
@@ -542,3 +727,79 @@ class UserPromotion(models.Model):
 
     def __str__(self):
         return f"{self.user_type} {self.user_id} - {self.promotion.name}"
+
+
+class PromotionProgress(models.Model):
+    """
+    Orders a user has in a promotion's date range, kept up to date as orders
+    are placed and cancelled (see utils/promotions.py). Counts the same orders
+    as the min_order_count check: not cancelled, not awaiting payment, and no
+    primary school orders when the promotion excludes them.
+    """
+    promotion = models.ForeignKey(Promotion, on_delete=models.CASCADE, related_name='progress')
+    user_id = models.BigIntegerField()
+    user_type = models.CharField(max_length=20)
+    order_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user_type', 'user_id', 'promotion')
+
+    def __str__(self):
+        return f"{self.user_type} {self.user_id} - {self.promotion_id}: {self.order_count}"
+
+
+class PromotionEvaluation(models.Model):
+    """
+    Promotion check queued by a checkout and run after its transaction commits
+    (see utils/promotions.py). Holds the outcome for the app to fetch.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    user_id = models.BigIntegerField()
+    user_type = models.CharField(max_length=20)
+    school_id = models.IntegerField(null=True, blank=True)
+    school_type = models.CharField(max_length=20, null=True, blank=True)
+    order_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    rewards = models.JSONField(default=list, blank=True)
+    pending_promotions = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='promo_eval_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_type} {self.user_id} - {self.status}"
+
+
+# ------------------------------
+# Idempotency Keys
+# ------------------------------
+class IdempotencyKey(models.Model):
+    """Response recorded for an `Idempotency-Key` header, replayed on client retries"""
+    STATUS_CHOICES = [
+        ('in_progress', 'In progress'),
+        ('completed', 'Completed'),
+    ]
+    key = models.CharField(max_length=255)
+    endpoint = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="SHA-256 of the request method, path and body")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    locked_until = models.DateTimeField(null=True, blank=True, help_text="Lease of the request running the view; an in-progress key can be taken over after it")
+
+    class Meta:
+        unique_together = ('key', 'endpoint')
+
+    def __str__(self):
+        return f"{self.endpoint} {self.key} ({self.status})"
@@ -3,6 +3,9 @@ from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import check_password 
 from django.contrib.auth.tokens import default_token_generator
+from django.db import models
+
+from .utils.user_names import fill_order_user_names
 
 class AllergenSerializer(serializers.ModelSerializer):
     class Meta:
@@ -311,11 +314,13 @@ class MenuSerializer(serializers.ModelSerializer):
     category = serializers.PrimaryKeyRelatedField(queryset=Categories.objects.all())
     primary_school_id = serializers.PrimaryKeyRelatedField(source='primary_school.id', read_only=True)
     secondary_school_id = serializers.PrimaryKeyRelatedField(source='secondary_school.id', read_only=True)
+    menu_item = serializers.PrimaryKeyRelatedField(read_only=True)
     
     class Meta:
         model = Menu
         fields = ['id', 'name', 'price', 'menu_day', 'cycle_name', 'menu_date', 'primary_school_name', 
-                  'secondary_school_name', 'category', 'is_active', 'primary_school_id', 'secondary_school_id']
+                  'secondary_school_name', 'category', 'is_active', 'primary_school_id', 'secondary_school_id',
+                  'menu_item']
 
     def to_representation(self, instance):
         """ Customize the representation to include more details """
@@ -371,6 +376,15 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['id', 'menu', 'item_name', 'quantity', 'order']
 
+class OrderListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        """Resolve missing user names for the whole page in one batch."""
+        orders = data.all() if isinstance(data, models.manager.BaseManager) else data
+        orders = list(orders)
+        fill_order_user_names(orders)
+        return super().to_representation(orders)
+
+
 class OrderSerializer(serializers.ModelSerializer):
 
     items = OrderItemSerializer(many=True, read_only=True, source='order_items')
@@ -382,6 +396,7 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
+        list_serializer_class = OrderListSerializer
         # ✅ Removed 'items_name' from the fields list
         fields = [
             'items', 'user_name', 'child_id', 'week_number', 'year',
@@ -392,7 +407,9 @@ class OrderSerializer(serializers.ModelSerializer):
   
     def get_user_name(self, obj):
         """Return the user name based on the user type."""
-        return obj.get_user_name()
+        if obj.user_name is None:
+            fill_order_user_names([obj])
+        return obj.user_name
 
     def to_representation(self, instance):
         """Customize the serialization."""
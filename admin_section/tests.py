@@ -1,3 +1,1838 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import *
+from .serializers import OrderSerializer
+from .utils import idempotency, menus
+from .utils.checkout import AWAITING_PAYMENT, new_checkout_ref
+from .utils.ledger import credit_account, ledger_balance, take_balance_snapshots
+from .utils.orders import ORDER_TOMBSTONE_RETENTION, delete_orders
+from .utils.promotions import (
+    check_and_apply_promotions, get_active_promotions, rebuild_promotion_progress, redeem_promotion,
+    sync_promotion_schools
+)
+from .utils.stripe_gateway import LocalStripe, clear_customer_cache
+
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+
+
+class CheckoutQueryCountTests(TestCase):
+    """The checkout pipeline must cost a fixed number of queries per cart"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Categories.objects.create(name_category='Mains')
+        cls.school = SecondarySchool.objects.create(
+            secondary_school_name='Test College',
+            secondary_school_email='college@example.com',
+            secondary_school_eircode='T12 3456'
+        )
+        cls.item_names = [f'Dish {i}' for i in range(4)]
+        for day in DAYS:
+            for name in cls.item_names:
+                Menu.objects.create(
+                    name=name, price='4.50', menu_day=day,
+                    cycle_name='Week 1', category=cls.category
+                )
+        cls.student = SecondaryStudent.objects.create(
+            first_name='Sam', last_name='Student', username='sam',
+            email='sam@example.com', password='secret123',
+            school=cls.school, credits=1000
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def _checkout(self, lines):
+        selected_days = [day for day, _ in lines]
+        order_items = [{'item_name': name, 'quantity': 1} for _, name in lines]
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/admin_details/payment/', {
+                'user_type': 'student',
+                'user_id': self.student.id,
+                'school_id': self.school.id,
+                'school_type': 'secondary',
+                'selected_days': selected_days,
+                'order_items': order_items,
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        _, small = self._checkout([('Monday', 'Dish 0')])
+        lines = [(day, name) for day in DAYS for name in self.item_names]
+        response, large = self._checkout(lines)
+
+        self.assertEqual(small, large)
+        self.assertEqual(response.data['total_orders'], len(DAYS))
+        self.assertEqual(OrderItem.objects.count(), 1 + len(lines))
+        self.assertEqual(Transaction.objects.filter(payment_method='credits').count(), 1 + len(DAYS))
+
+    def test_totals_and_credits(self):
+        response, _ = self._checkout([('Monday', 'Dish 0'), ('Monday', 'dish 1'), ('Friday', 'Dish 2')])
+
+        self.assertEqual(response.data['credits_deducted'], 13.5)
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.credits, 1000 - 13.5)
+        monday = Order.objects.get(selected_day='Monday')
+        self.assertEqual(monday.total_price, 9.0)
+        self.assertEqual(monday.user_name, 'sam')
+
+    def test_unknown_item_creates_nothing(self):
+        response = self.client.post('/admin_details/payment/', {
+            'user_type': 'student',
+            'user_id': self.student.id,
+            'school_id': self.school.id,
+            'school_type': 'secondary',
+            'selected_days': ['Monday', 'Tuesday'],
+            'order_items': [{'item_name': 'Dish 0', 'quantity': 1}, {'item_name': 'Nope', 'quantity': 1}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderUserNameTests(TestCase):
+    """Order display names are denormalized and batch-resolved"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.parents = [
+            ParentRegisteration.objects.create(
+                first_name='Pat', last_name=str(i), username=f'parent{i}',
+                email=f'parent{i}@example.com', password='secret123'
+            )
+            for i in range(5)
+        ]
+
+    def _order(self, parent, **kwargs):
+        return Order(user_id=parent.id, user_type='parent', total_price=0, selected_day='Monday', **kwargs)
+
+    def test_save_does_not_look_up_known_name(self):
+        order = self._order(self.parents[0], user_name='parent0')
+        with self.assertNumQueries(1):
+            order.save()
+        order.status = 'cancelled'
+        with self.assertNumQueries(1):
+            order.save()
+
+    def test_save_resolves_missing_name_once(self):
+        order = self._order(self.parents[1])
+        order.save()
+        self.assertEqual(order.user_name, 'parent1')
+
+    def test_serializing_many_orders_batches_name_lookups(self):
+        Order.objects.bulk_create([
+            self._order(parent) for parent in self.parents for _ in range(20)
+        ])
+        cache.clear()
+        orders = Order.objects.prefetch_related('order_items')
+        # orders + items + one batched name lookup
+        with self.assertNumQueries(3):
+            data = OrderSerializer(orders, many=True).data
+        self.assertEqual(len(data), 100)
+        self.assertEqual({row['user_name'] for row in data}, {p.username for p in self.parents})
+
+
+class OrderIndexExplainTests(TestCase):
+    """
+    Hot Order filters must be answered from an index.
+    Seed size defaults to something quick; set ORDER_EXPLAIN_ROWS=1000000 to
+    check the plans against a production-sized table.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rows = int(os.environ.get('ORDER_EXPLAIN_ROWS', 20000))
+        cls.primary = PrimarySchool.objects.create(
+            school_name='Primary', school_email='p@example.com', school_eircode='P1'
+        )
+        cls.secondary = SecondarySchool.objects.create(
+            secondary_school_name='Secondary', secondary_school_email='s@example.com',
+            secondary_school_eircode='S1'
+        )
+        start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        batch = []
+        for i in range(rows):
+            order_date = start + timedelta(days=i % 700)
+            primary = i % 2 == 0
+            batch.append(Order(
+                user_id=i % 5000, user_type=['parent', 'staff', 'student'][i % 3],
+                child_id=i % 8000 if primary else None, total_price=4.5,
+                week_number=order_date.isocalendar()[1], year=order_date.year,
+                order_date=order_date, delivery_date=order_date.date(),
+                selected_day=order_date.strftime('%A'), user_name='',
+                is_delivered=i % 10 != 0,
+                primary_school=cls.primary if primary else None,
+                secondary_school=None if primary else cls.secondary,
+            ))
+            if len(batch) == 10000:
+                Order.objects.bulk_create(batch)
+                batch = []
+        Order.objects.bulk_create(batch)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_fetch_orders_uses_school_week_index(self):
+        self.assertUsesIndex(
+            Order.objects.filter(primary_school_id=self.primary.id, year=2024, week_number=10, selected_day='Monday'),
+            'order_primary_week_idx'
+        )
+
+    def test_child_duplicate_check_uses_child_week_index(self):
+        self.assertUsesIndex(
+            Order.objects.filter(child_id=42, year=2024, week_number=10).exclude(status__iexact='cancelled'),
+            'order_child_week_idx'
+        )
+
+    def test_user_history_uses_user_index(self):
+        self.assertUsesIndex(
+            Order.objects.filter(user_id=42, user_type='parent').order_by('-order_date'),
+            'order_user_date_idx'
+        )
+
+    def test_school_analytics_uses_delivery_date_index(self):
+        self.assertUsesIndex(
+            Order.objects.filter(
+                secondary_school_id=self.secondary.id,
+                delivery_date__gte=date(2024, 3, 1), delivery_date__lte=date(2024, 3, 28)
+            ).values('secondary_school_id', 'delivery_date').annotate(count=Count('id')),
+            'order_secondary_delivery_idx'
+        )
+
+    def test_auto_complete_uses_undelivered_index(self):
+        self.assertUsesIndex(
+            Order.objects.filter(delivery_date__lte=date(2024, 2, 1), is_delivered=False),
+            'order_undelivered_date_idx'
+        )
+
+
+class PrimaryChildDayGuardTests(TestCase):
+    """One non-cancelled order per primary child per day"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name_category='Mains')
+        cls.school = PrimarySchool.objects.create(
+            school_name='St Test', school_email='st@example.com', school_eircode='D01'
+        )
+        for day in DAYS:
+            Menu.objects.create(name='Pasta', price='3.00', menu_day=day, cycle_name='Week 1', category=category)
+        cls.parent = ParentRegisteration.objects.create(
+            first_name='Pat', last_name='Parent', username='pat',
+            email='pat@example.com', password='secret123'
+        )
+        cls.child = PrimaryStudentsRegister.objects.create(
+            first_name='Kid', last_name='Parent', class_year='1st', school=cls.school, parent=cls.parent
+        )
+
+    def _order(self, days):
+        return APIClient().post('/admin_details/payment/', {
+            'user_type': 'parent',
+            'user_id': self.parent.id,
+            'school_id': self.school.id,
+            'school_type': 'primary',
+            'child_id': self.child.id,
+            'selected_days': days,
+            'order_items': [{'item_name': 'Pasta', 'quantity': 1} for _ in days],
+        }, format='json')
+
+    def test_second_order_for_same_day_is_rejected(self):
+        self.assertEqual(self._order(['Monday', 'Tuesday']).status_code, 201)
+
+        response = self._order(['Wednesday', 'tuesday'])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Tuesday', response.data['error'])
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_cancelled_day_can_be_reordered(self):
+        self.assertEqual(self._order(['Monday']).status_code, 201)
+        Order.objects.update(status='cancelled')
+        self.assertEqual(self._order(['Monday']).status_code, 201)
+
+
+@override_settings(STRIPE_BACKEND='local')
+class StripeCheckoutTests(TestCase):
+    """Card checkout talks to Stripe outside of any database transaction"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name_category='Mains')
+        cls.school = SecondarySchool.objects.create(
+            secondary_school_name='Card College', secondary_school_email='card@example.com',
+            secondary_school_eircode='C1'
+        )
+        for day in DAYS:
+            Menu.objects.create(name='Wrap', price='5.00', menu_day=day, cycle_name='Week 1', category=category)
+        cls.student = SecondaryStudent.objects.create(
+            first_name='Cara', last_name='Card', username='cara',
+            email='cara@example.com', password='secret123', school=cls.school
+        )
+
+    def setUp(self):
+        LocalStripe.reset()
+        clear_customer_cache()
+
+    def _pay(self, payment_id, days=('Monday', 'Tuesday')):
+        return APIClient().post('/admin_details/payment/', {
+            'user_type': 'student',
+            'user_id': self.student.id,
+            'school_id': self.school.id,
+            'school_type': 'secondary',
+            'payment_id': payment_id,
+            'selected_days': list(days),
+            'order_items': [{'item_name': 'Wrap', 'quantity': 1} for _ in days],
+        }, format='json')
+
+    def test_card_checkout_confirms_orders(self):
+        depth = len(connection.atomic_blocks)
+        create_intent = LocalStripe.PaymentIntent.create
+
+        def create_outside_transaction(**kwargs):
+            self.assertEqual(len(connection.atomic_blocks), depth)
+            self.assertEqual(Order.objects.filter(status=AWAITING_PAYMENT).count(), 2)
+            return create_intent(**kwargs)
+
+        with mock.patch.object(LocalStripe.PaymentIntent, 'create', side_effect=create_outside_transaction):
+            response = self._pay('pm_card_visa')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        intent = next(iter(LocalStripe.payment_intents.values()))
+        self.assertEqual(intent.amount, 1000)
+        self.assertEqual(set(Order.objects.values_list('status', 'payment_id')), {('pending', intent.id)})
+        self.assertEqual(Transaction.objects.filter(payment_method='stripe', payment_intent_id=intent.id).count(), 2)
+
+    def test_customer_is_looked_up_once_and_stored(self):
+        with mock.patch.object(LocalStripe.Customer, 'list', wraps=LocalStripe.Customer.list) as customer_list:
+            self.assertEqual(self._pay('pm_card_visa', days=['Monday']).status_code, 201)
+            self.assertEqual(self._pay('pm_card_visa', days=['Tuesday']).status_code, 201)
+
+        self.assertEqual(customer_list.call_count, 1)
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.stripe_customer_id, next(iter(LocalStripe.customers)))
+
+    def test_declined_card_rolls_back_orders(self):
+        response = self._pay(LocalStripe.DECLINED_PAYMENT_METHOD)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_stripe_timeout_leaves_orders_for_reconcile(self):
+        create_intent = LocalStripe.PaymentIntent.create
+
+        def charged_then_timed_out(**kwargs):
+            create_intent(**kwargs)
+            raise stripe.error.APIConnectionError('Request timed out')
+
+        with mock.patch.object(LocalStripe.PaymentIntent, 'create', side_effect=charged_then_timed_out), \
+                self.assertLogs('admin_section.views', 'WARNING'):
+            response = self._pay('pm_card_visa')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Order.objects.filter(status=AWAITING_PAYMENT, payment_id=response.data['checkout_ref']).count(), 2)
+        Order.objects.update(created_at=timezone.now() - timedelta(hours=1))
+        call_command('reconcile_checkout_payments', stdout=io.StringIO())
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'pending'})
+
+    def test_failure_before_the_intent_rolls_back(self):
+        with mock.patch.object(LocalStripe.PaymentMethod, 'attach', side_effect=stripe.error.APIConnectionError('down')):
+            response = self._pay('pm_card_visa')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(Order.objects.exists())
+
+    def _interrupted_checkout(self, paid):
+        checkout_ref = new_checkout_ref()
+        order = Order.objects.create(
+            user_id=self.student.id, user_type='student', total_price=5.0, selected_day='Monday',
+            status=AWAITING_PAYMENT, payment_id=checkout_ref, secondary_school=self.school,
+            created_at=timezone.now() - timedelta(hours=1)
+        )
+        if paid:
+            LocalStripe.PaymentIntent.create(amount=500, payment_method='pm_card_visa', metadata={'checkout_ref': checkout_ref})
+        return order
+
+    def test_reconcile_confirms_paid_and_removes_unpaid_checkouts(self):
+        paid = self._interrupted_checkout(paid=True)
+        unpaid = self._interrupted_checkout(paid=False)
+
+        call_command('reconcile_checkout_payments', stdout=io.StringIO())
+
+        paid.refresh_from_db()
+        self.assertEqual(paid.status, 'pending')
+        self.assertTrue(paid.payment_id.startswith('pi_'))
+        self.assertEqual(Transaction.objects.get().order, paid)
+        self.assertFalse(Order.objects.filter(id=unpaid.id).exists())
+
+    def test_unpaid_checkout_is_not_completed_before_reconcile(self):
+        unpaid = self._interrupted_checkout(paid=False)
+        Order.objects.filter(id=unpaid.id).update(delivery_date=timezone.localdate() - timedelta(days=1))
+
+        call_command('auto_complete_orders', stdout=io.StringIO())
+        response = APIClient().post('/admin_details/complete_order/', {'order_id': unpaid.id}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        unpaid.refresh_from_db()
+        self.assertEqual(unpaid.status, AWAITING_PAYMENT)
+        call_command('reconcile_checkout_payments', stdout=io.StringIO())
+        self.assertFalse(Order.objects.filter(id=unpaid.id).exists())
+
+
+class IdempotencyKeyTests(TestCase):
+    """Retries carrying the same Idempotency-Key replay the first response"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name_category='Mains')
+        cls.school = SecondarySchool.objects.create(
+            secondary_school_name='Retry College', secondary_school_email='retry@example.com',
+            secondary_school_eircode='R1'
+        )
+        Menu.objects.create(name='Soup', price='3.00', menu_day='Monday', cycle_name='Week 1', category=category)
+        cls.student = SecondaryStudent.objects.create(
+            first_name='Rita', last_name='Retry', username='rita',
+            email='rita@example.com', password='secret123', school=cls.school, credits=100
+        )
+
+    def _checkout(self, key, quantity=1):
+        return APIClient().post('/admin_details/payment/', {
+            'user_type': 'student',
+            'user_id': self.student.id,
+            'school_id': self.school.id,
+            'school_type': 'secondary',
+            'selected_days': ['Monday'],
+            'order_items': [{'item_name': 'Soup', 'quantity': quantity}],
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_response_without_new_orders(self):
+        first = self._checkout('key-1')
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self._checkout('key-1')
+
+        self.assertEqual(first.status_code, 201, first.data)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.credits, 97)
+
+    def test_key_reused_with_different_body_is_rejected(self):
+        self._checkout('key-2')
+        response = self._checkout('key-2', quantity=2)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_duplicate_waits_for_the_first_request(self):
+        self._checkout('key-3')
+        record = IdempotencyKey.objects.get(key='key-3')
+        stored = (record.response_status, record.response_body)
+        IdempotencyKey.objects.filter(pk=record.pk).update(status='in_progress', response_body=None)
+
+        def first_request_finishes(_):
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                status='completed', response_status=stored[0], response_body=stored[1]
+            )
+
+        with mock.patch.object(idempotency.time, 'sleep', side_effect=first_request_finishes) as sleep:
+            response = self._checkout('key-3')
+
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total_orders'], 1)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_duplicate_gets_409_while_first_request_is_still_running(self):
+        self._checkout('key-4')
+        IdempotencyKey.objects.filter(key='key-4').update(status='in_progress')
+
+        with mock.patch.object(idempotency, 'IDEMPOTENCY_WAIT_SECONDS', 0.01), \
+                mock.patch.object(idempotency.time, 'sleep'):
+            response = self._checkout('key-4')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_retry_takes_over_a_key_whose_lease_ran_out(self):
+        # The first request's worker died after claiming the key
+        self._checkout('key-5')
+        Order.objects.all().delete()
+        IdempotencyKey.objects.filter(key='key-5').update(
+            status='in_progress', response_body=None, locked_until=timezone.now() - timedelta(seconds=1)
+        )
+
+        with mock.patch.object(idempotency.time, 'sleep') as sleep:
+            response = self._checkout('key-5')
+
+        self.assertEqual(sleep.call_count, 0)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Order.objects.count(), 1)
+        record = IdempotencyKey.objects.get(key='key-5')
+        self.assertEqual(record.status, 'completed')
+        self.assertGreater(record.locked_until, timezone.now())
+
+    def test_failed_request_releases_key_and_expired_keys_are_purged(self):
+        response = self._checkout('key-5', quantity=1000)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(IdempotencyKey.objects.get(key='key-5').response_status, 400)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self._checkout('key-5', quantity=1).status_code, 201)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        call_command('purge_idempotency_keys', stdout=io.StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class CreditLedgerTests(TestCase):
+    """Credit balance changes go through the ledger and are never applied twice"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name_category='Mains')
+        cls.school = SecondarySchool.objects.create(
+            secondary_school_name='Ledger College', secondary_school_email='ledger@example.com',
+            secondary_school_eircode='L1'
+        )
+        for day in DAYS:
+            Menu.objects.create(name='Pasta', price='4.10', menu_day=day, cycle_name='Week 1', category=category)
+        cls.student = SecondaryStudent.objects.create(
+            first_name='Lee', last_name='Ledger', username='lee',
+            email='lee@example.com', password='secret123', school=cls.school
+        )
+
+    def setUp(self):
+        credit_account(self.student, 'student', 10, kind='top_up', description='Credit top-up of €10')
+
+    def _checkout(self, days):
+        return APIClient().post('/admin_details/payment/', {
+            'user_type': 'student',
+            'user_id': self.student.id,
+            'school_id': self.school.id,
+            'school_type': 'secondary',
+            'selected_days': days,
+            'order_items': [{'item_name': 'Pasta', 'quantity': 1} for _ in days],
+        }, format='json')
+
+    def test_checkout_debits_through_the_ledger(self):
+        response = self._checkout(['Monday', 'Tuesday'])
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['remaining_credits'], 1.8)
+        entries = CreditLedgerEntry.objects.filter(kind='order_payment')
+        self.assertEqual(sorted(entries.values_list('amount_cents', flat=True)), [-410, -410])
+        self.assertTrue(all(entry.transaction.order_id == entry.order_id for entry in entries))
+        self.assertEqual(ledger_balance('student', self.student.id), 180)
+
+    def test_insufficient_credits_write_nothing(self):
+        response = self._checkout(['Monday', 'Tuesday', 'Wednesday'])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(CreditLedgerEntry.objects.filter(kind='order_payment').exists())
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.credits, 10)
+
+    def test_order_is_refunded_once(self):
+        self._checkout(['Monday'])
+        order_id = Order.objects.get().id
+
+        first = APIClient().post('/admin_details/cancel_order/', {'order_id': order_id}, format='json')
+        second = APIClient().post('/admin_details/cancel_order/', {'order_id': order_id}, format='json')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data['order_info']['user_credits'], 10)
+        self.assertEqual(second.status_code, 400)
+        self.assertEqual(CreditLedgerEntry.objects.filter(kind='refund').count(), 1)
+        self.assertEqual(ledger_balance('student', self.student.id), 1000)
+
+    def test_snapshot_keeps_balance(self):
+        self._checkout(['Monday'])
+        self.assertEqual(take_balance_snapshots(), 1)
+        credit_account(self.student, 'student', 2.25, kind='top_up', description='Credit top-up of €2.25')
+
+        snapshot = CreditBalanceSnapshot.objects.get(user_type='student', user_id=self.student.id)
+        self.assertEqual(snapshot.balance_cents, 590)
+        self.assertEqual(ledger_balance('student', self.student.id), 815)
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.credits, 8.15)
+
+    def test_entry_committed_after_a_higher_id_is_not_skipped(self):
+        last_id = CreditLedgerEntry.objects.get().id
+        CreditLedgerEntry.objects.create(id=last_id + 100, user_type='parent', user_id=1, amount_cents=500, kind='top_up')
+        take_balance_snapshots()
+
+        # An id handed out before the snapshot that commits after it
+        CreditLedgerEntry.objects.create(id=last_id + 50, user_type='student', user_id=self.student.id, amount_cents=-300, kind='adjustment')
+
+        snapshot = CreditBalanceSnapshot.objects.get(user_type='student', user_id=self.student.id)
+        self.assertEqual(snapshot.last_entry_id, last_id)
+        self.assertEqual(ledger_balance('student', self.student.id), 700)
+        # The student's own last entry is still below the parent's, so only
+        # a per-account comparison finds it
+        self.assertEqual(take_balance_snapshots(), 1)
+        snapshot.refresh_from_db()
+        self.assertEqual(snapshot.last_entry_id, last_id + 50)
+        self.assertEqual(snapshot.balance_cents, 700)
+        self.assertEqual(ledger_balance('student', self.student.id), 700)
+
+
+class CreditLedgerConcurrencyTests(TransactionTestCase):
+    def test_benchmark_balances_agree(self):
+        out = io.StringIO()
+        call_command('benchmark_credit_ledger', threads=8, operations=20, stdout=out)
+        self.assertIn('Balances agree', out.getvalue())
+
+
+class PromotionEngineTests(TestCase):
+    """Promotion evaluation costs the same number of queries for any number of promotions"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = SecondarySchool.objects.create(
+            secondary_school_name='Promo College', secondary_school_email='promo@example.com',
+            secondary_school_eircode='P1'
+        )
+        cls.student = SecondaryStudent.objects.create(
+            first_name='Pat', last_name='Promo', username='pat',
+            email='pat@example.com', password='secret123', school=cls.school
+        )
+        today = date.today()
+        for _ in range(2):
+            Order.objects.create(
+                user_id=cls.student.id, user_type='student', total_price=5, selected_day='Monday',
+                order_date=timezone.now(), secondary_school=cls.school
+            )
+        cls.window = {'start_date': today - timedelta(days=7), 'end_date': today + timedelta(days=7)}
+
+    def setUp(self):
+        cache.clear()
+
+    def _promotion(self, name, **kwargs):
+        promotion = Promotion.objects.create(name=name, credit_reward='5.00', **self.window, **kwargs)
+        sync_promotion_schools(promotion)
+        rebuild_promotion_progress(promotion)
+        return promotion
+
+    def _evaluate(self, total=5):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            result = check_and_apply_promotions(
+                self.student, 'student', school_id=self.school.id, school_type='secondary',
+                current_order_total=total
+            )
+        return result, len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_promotions(self):
+        self._promotion('Loyalty 1', min_order_count=5, max_redemptions=100)
+        _, few = self._evaluate()
+        for i in range(2, 11):
+            self._promotion(f'Loyalty {i}', min_order_count=5 + i, max_redemptions=100)
+        (rewards, pending), many = self._evaluate()
+
+        self.assertEqual(few, many)
+        self.assertEqual(rewards, [])
+        self.assertEqual(len(pending), 10)
+        self.assertEqual(pending[0]['orders_placed'], 2)
+        self.assertEqual(pending[0]['orders_remaining'], 3)
+
+    def test_conditions(self):
+        self._promotion('Two orders', min_order_count=2)
+        self._promotion('Big spender', spending_threshold='20.00')
+        other = SecondarySchool.objects.create(
+            secondary_school_name='Elsewhere', secondary_school_email='elsewhere@example.com',
+            secondary_school_eircode='P2'
+        )
+        self._promotion('Other school', schools=[{'id': other.id, 'type': 'secondary'}])
+        self._promotion('Full', max_redemptions=1, redeemed_count=1)
+
+        (rewards, pending), _ = self._evaluate(total=10)
+
+        self.assertEqual([r['promotion_name'] for r in rewards], ['Two orders'])
+        self.assertEqual(pending, [])
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.credits, 5)
+
+        # Already received
+        (rewards, _), _ = self._evaluate(total=10)
+        self.assertEqual(rewards, [])
+
+    def test_active_promotions_are_cached(self):
+        self._promotion('Cached', min_order_count=10)
+        check_and_apply_promotions(self.student, 'student')
+        with CaptureQueriesContext(connection) as ctx:
+            check_and_apply_promotions(self.student, 'student')
+        self.assertFalse(any('FROM "admin_section_promotion"' in q['sql'] for q in ctx.captured_queries))
+
+    def test_redemption_cap_is_enforced_by_the_counter(self):
+        promotion = self._promotion('Last slot', max_redemptions=1)
+        other = SecondaryStudent.objects.create(username='other', email='other@example.com', school=self.school)
+
+        self.assertTrue(redeem_promotion(promotion, self.student.id, 'student'))
+        self.assertFalse(redeem_promotion(promotion, other.id, 'student'))
+
+        promotion.refresh_from_db()
+        self.assertEqual(promotion.redeemed_count, 1)
+        self.assertEqual(UserPromotion.objects.filter(promotion=promotion).count(), 1)
+
+    def test_repeat_redemption_does_not_consume_a_slot(self):
+        promotion = self._promotion('Twice', max_redemptions=5)
+
+        self.assertTrue(redeem_promotion(promotion, self.student.id, 'student'))
+        self.assertFalse(redeem_promotion(promotion, self.student.id, 'student'))
+
+        promotion.refresh_from_db()
+        self.assertEqual(promotion.redeemed_count, 1)
+
+
+@override_settings(PROMOTIONS_ASYNC=False)
+class DeferredPromotionTests(TestCase):
+    """Checkout queues promotion evaluation instead of running it inline"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name_category='Mains')
+        cls.school = SecondarySchool.objects.create(
+            secondary_school_name='Deferred College', secondary_school_email='deferred@example.com',
+            secondary_school_eircode='D1'
+        )
+        Menu.objects.create(name='Curry', price='6.00', menu_day='Monday', cycle_name='Week 1', category=category)
+        cls.student = SecondaryStudent.objects.create(
+            first_name='Dee', last_name='Deferred', username='dee',
+            email='dee@example.com', password='secret123', school=cls.school, credits=50
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def _promotion(self, name, **kwargs):
+        today = date.today()
+        return Promotion.objects.create(
+            name=name, credit_reward='2.00', start_date=today - timedelta(days=30),
+            end_date=today + timedelta(days=30), **kwargs
+        )
+
+    def _checkout(self):
+        return APIClient().post('/admin_details/payment/', {
+            'user_type': 'student',
+            'user_id': self.student.id,
+            'school_id': self.school.id,
+            'school_type': 'secondary',
+            'selected_days': ['Monday'],
+            'order_items': [{'item_name': 'Curry', 'quantity': 1}],
+        }, format='json')
+
+    def test_checkout_cost_does_not_depend_on_promotions(self):
+        self._promotion('Campaign 0', min_order_count=3)
+        with CaptureQueriesContext(connection) as one:
+            self.assertEqual(self._checkout().status_code, 201)
+        Order.objects.all().delete()
+        for i in range(1, 10):
+            self._promotion(f'Campaign {i}', min_order_count=3)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(self._checkout().status_code, 201)
+
+        self.assertEqual(len(one), len(many))
+        self.assertFalse(UserPromotion.objects.exists())
+
+    def test_reward_is_available_after_commit(self):
+        self._promotion('First order', min_order_count=1)
+        self._promotion('Three orders', min_order_count=3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._checkout()
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['pending_promotions'], [])
+        evaluation = APIClient().get(
+            f"/admin_details/promotions/evaluations/{response.data['promotion_evaluation_id']}/"
+        ).data
+        self.assertEqual(evaluation['status'], 'done')
+        self.assertEqual([r['promotion_name'] for r in evaluation['promotion_rewards']], ['First order'])
+        self.assertEqual(evaluation['pending_promotions'][0]['orders_remaining'], 2)
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.credits, 46)
+
+        # The next checkout returns the last known pending snapshot
+        Menu.objects.create(name='Curry', price='6.00', menu_day='Tuesday', cycle_name='Week 1',
+                            category=Categories.objects.get())
+        response = APIClient().post('/admin_details/payment/', {
+            'user_type': 'student', 'user_id': self.student.id, 'school_id': self.school.id,
+            'school_type': 'secondary', 'selected_days': ['Tuesday'],
+            'order_items': [{'item_name': 'Curry', 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.data['pending_promotions'][0]['promotion_name'], 'Three orders')
+
+    def test_sweep_runs_lost_evaluations_once(self):
+        self._promotion('First order', min_order_count=1)
+        response = self._checkout()
+        evaluation = PromotionEvaluation.objects.get(pk=response.data['promotion_evaluation_id'])
+        PromotionEvaluation.objects.filter(pk=evaluation.pk).update(created_at=timezone.now() - timedelta(minutes=10))
+
+        call_command('process_promotion_evaluations', stdout=io.StringIO())
+        call_command('process_promotion_evaluations', stdout=io.StringIO())
+
+        evaluation.refresh_from_db()
+        self.assertEqual(evaluation.status, 'done')
+        self.assertEqual(CreditLedgerEntry.objects.filter(kind='promotion').count(), 1)
+
+
+class PromotionProgressTests(TestCase):
+    """Progress counters follow order creation and cancellation"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name_category='Mains')
+        cls.school = SecondarySchool.objects.create(
+            secondary_school_name='Progress College', secondary_school_email='progress@example.com',
+            secondary_school_eircode='G1'
+        )
+        for day in DAYS:
+            Menu.objects.create(name='Bagel', price='3.00', menu_day=day, cycle_name='Week 1', category=category)
+        cls.student = SecondaryStudent.objects.create(
+            first_name='Gus', last_name='Progress', username='gus',
+            email='gus@example.com', password='secret123', school=cls.school, credits=100
+        )
+        today = date.today()
+        cls.promotion = Promotion.objects.create(
+            name='Five orders', credit_reward='5.00', min_order_count=5,
+            start_date=today - timedelta(days=1), end_date=today + timedelta(days=14)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def _checkout(self, days):
+        response = APIClient().post('/admin_details/payment/', {
+            'user_type': 'student',
+            'user_id': self.student.id,
+            'school_id': self.school.id,
+            'school_type': 'secondary',
+            'selected_days': days,
+            'order_items': [{'item_name': 'Bagel', 'quantity': 1} for _ in days],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response
+
+    def _progress(self):
+        response = APIClient().get('/admin_details/promotions/progress/', {
+            'user_id': self.student.id, 'user_type': 'student',
+            'school_id': self.school.id, 'school_type': 'secondary',
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.data['promotions']
+
+    def test_orders_and_cancellations_move_the_counter(self):
+        self._checkout(['Monday', 'Tuesday', 'Wednesday'])
+        progress = self._progress()
+        self.assertEqual(progress[0]['orders_placed'], 3)
+        self.assertEqual(progress[0]['orders_remaining'], 2)
+
+        order = Order.objects.filter(selected_day='Tuesday').get()
+        APIClient().post('/admin_details/cancel_order/', {'order_id': order.id}, format='json')
+        self.assertEqual(self._progress()[0]['orders_placed'], 2)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self._progress()
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+    def test_rebuild_matches_incremental_counts(self):
+        self._checkout(['Monday', 'Friday'])
+        incremental = PromotionProgress.objects.get(promotion=self.promotion).order_count
+
+        rebuild_promotion_progress(self.promotion)
+
+        self.assertEqual(PromotionProgress.objects.get(promotion=self.promotion).order_count, incremental)
+
+    def test_create_order_endpoint_moves_the_counter(self):
+        response = APIClient().post('/admin_details/create_order/', {
+            'user_type': 'student', 'user_id': self.student.id,
+            'school_id': self.school.id, 'school_type': 'secondary',
+            'selected_days': ['Monday', 'Tuesday'],
+            'order_items': [{'item_name': 'Bagel', 'quantity': 1, 'price': 3} for _ in range(2)],
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        incremental = PromotionProgress.objects.get(promotion=self.promotion).order_count
+        rebuild_promotion_progress(self.promotion)
+        self.assertEqual(PromotionProgress.objects.get(promotion=self.promotion).order_count, incremental)
+        self.assertEqual(incremental, 2)
+
+    def test_rebuild_overwrites_rows_in_place(self):
+        self._checkout(['Monday', 'Friday'])
+        row = PromotionProgress.objects.get(promotion=self.promotion)
+        stale = PromotionProgress.objects.create(promotion=self.promotion, user_type='parent', user_id=1, order_count=4)
+        PromotionProgress.objects.filter(pk=row.pk).update(order_count=9)
+
+        rebuild_promotion_progress(self.promotion)
+
+        # Same rows, so an F() increment racing the rebuild still finds its row
+        self.assertEqual(
+            dict(PromotionProgress.objects.filter(promotion=self.promotion).values_list('pk', 'order_count')),
+            {row.pk: 2, stale.pk: 0}
+        )
+
+
+class PromotionSchoolTargetingTests(TestCase):
+    """School targeting is stored in PromotionSchool and filtered in the database"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.primary = PrimarySchool.objects.create(school_name='Little School', school_email='little@example.com', school_eircode='S1')
+        cls.secondary = SecondarySchool.objects.create(
+            secondary_school_name='Big School', secondary_school_email='big@example.com', secondary_school_eircode='S2'
+        )
+        cls.other = SecondarySchool.objects.create(
+            secondary_school_name='Other School', secondary_school_email='other@example.com', secondary_school_eircode='S3'
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def _create(self, name, schools):
+        today = date.today()
+        response = APIClient().post('/admin_details/promotions/', {
+            'name': name, 'credit_reward': '1.00', 'schools': schools,
+            'start_date': str(today - timedelta(days=1)), 'end_date': str(today + timedelta(days=1)),
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def _names(self, school_id, school_type):
+        return [p.name for p in get_active_promotions(school_id=school_id, school_type=school_type)]
+
+    def test_crud_writes_targets_and_lookup_filters_by_school(self):
+        everyone = self._create('Everyone', [])
+        targeted = self._create('Targeted', [
+            {'id': self.primary.id, 'type': 'primary'}, {'id': self.secondary.id, 'type': 'secondary'},
+        ])
+
+        self.assertEqual(PromotionSchool.objects.filter(promotion_id=everyone).count(), 0)
+        self.assertEqual(PromotionSchool.objects.filter(promotion_id=targeted).count(), 2)
+        self.assertEqual(self._names(self.primary.id, 'primary'), ['Everyone', 'Targeted'])
+        self.assertEqual(self._names(self.secondary.id, 'secondary'), ['Everyone', 'Targeted'])
+        self.assertEqual(self._names(self.other.id, 'secondary'), ['Everyone'])
+        self.assertEqual(self._names(None, None), ['Everyone'])
+
+        response = APIClient().put(f'/admin_details/promotions/{targeted}/', {
+            'schools': [{'id': self.other.id, 'type': 'secondary'}],
+        }, format='json')
+        self.assertEqual(response.data['schools'], [{'id': self.other.id, 'type': 'secondary'}])
+        self.assertEqual(self._names(self.other.id, 'secondary'), ['Everyone', 'Targeted'])
+        self.assertEqual(self._names(self.secondary.id, 'secondary'), ['Everyone'])
+
+    def test_targeted_promotion_without_surviving_schools_matches_nothing(self):
+        gone = SecondarySchool.objects.create(
+            secondary_school_name='Closed School', secondary_school_email='closed@example.com', secondary_school_eircode='S4'
+        )
+        self._create('Closed', [{'id': gone.id, 'type': 'secondary'}])
+        self._create('Unknown', [{'id': 999999, 'type': 'primary'}])
+        gone.delete()
+        cache.clear()
+
+        self.assertEqual(self._names(self.other.id, 'secondary'), [])
+        self.assertEqual(self._names(None, None), [])
+
+
+class ActiveMenuReadModelTests(TestCase):
+    """get_active_menu is built in a fixed number of queries and published per school"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Categories.objects.create(name_category='Mains')
+        cls.school = PrimarySchool.objects.create(school_name='Menu School', school_email='menu@example.com', school_eircode='M1')
+        cls.nuts = Allergens.objects.create(allergy='Nuts')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def _add_menus(self, count, cycle_name='Week 1'):
+        for i in range(count):
+            name = f'{cycle_name} Dish {i}'
+            item = MenuItems.objects.create(item_name=name, item_description='Tasty', image='menu_items/dish.png')
+            item.allergies.add(self.nuts)
+            menu = Menu.objects.create(
+                name=name, price='4.50', menu_day=DAYS[i % len(DAYS)],
+                cycle_name=cycle_name, category=self.category, is_active=True, menu_item=item
+            )
+            menu.primary_schools.add(self.school)
+
+    def _fetch(self, **headers):
+        return self.client.post('/admin_details/get_active_menu/', {
+            'school_type': 'primary', 'school_id': self.school.id
+        }, format='json', **headers)
+
+    def _menu(self):
+        return json.loads(self._fetch().content)
+
+    def _query_count(self):
+        cache.clear()
+        MenuSnapshot.objects.all().delete()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._fetch().status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_menus(self):
+        self._add_menus(2)
+        few = self._query_count()
+        self._add_menus(10, cycle_name='Week 2')
+        self.assertEqual(self._query_count(), few)
+
+    def test_response_shape_and_snapshot_hit(self):
+        self._add_menus(1)
+        inactive = Menu.objects.create(name='Old', price='1.00', menu_day='Monday', cycle_name='Old', category=self.category)
+        inactive.primary_schools.add(self.school)
+
+        data = self._menu()
+        monday = data['menus']['Monday']
+        self.assertEqual(set(data['menus']), {'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'})
+        self.assertEqual(data['cycles'], [{'cycle': 'Week 1'}])
+        self.assertEqual([m['name'] for m in monday], ['Week 1 Dish 0'])
+        self.assertEqual(monday[0]['price'], '4.50')
+        self.assertEqual(monday[0]['category'], 'Mains')
+        item = monday[0]['menu_items'][0]
+        self.assertEqual(item['allergies'], ['Nuts'])
+        self.assertTrue(item['image_url'].startswith(settings.MENU_IMAGE_BASE_URL))
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._menu(), data)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('admin_section_menusnapshot', ctx.captured_queries[0]['sql'])
+
+    def test_menu_edit_invalidates_cache(self):
+        self._add_menus(1)
+        menu = Menu.objects.get()
+        self._fetch()
+
+        # Snapshots are dropped once the change commits
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(f'/admin_details/edit_menu/{menu.id}/', {'price': '5.25'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._menu()['menus']['Monday'][0]['price'], '5.25')
+
+        item = MenuItems.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/admin_details/make_menu_unavailable/', {'menu_id': item.id}, format='json')
+            self.client.put(f'/admin_details/update_menu_items/{item.id}/', {'item_description': 'Spicy'}, format='json')
+        self.assertEqual(self._menu()['menus']['Monday'][0]['menu_items'][0]['item_description'], 'Spicy')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('deactivate_menu_cycles', stdout=io.StringIO())
+        self.assertEqual(self._menu()['menus']['Monday'], [])
+
+    def test_edit_only_invalidates_linked_schools(self):
+        self._add_menus(1)
+        other = PrimarySchool.objects.create(school_name='Other School', school_email='o@example.com', school_eircode='O1')
+        Menu.objects.create(name='Other Dish', price='2.00', menu_day='Monday', cycle_name='Other',
+                            category=self.category, is_active=True).primary_schools.add(other)
+        self._fetch()
+        self.client.post('/admin_details/get_active_menu/', {'school_type': 'primary', 'school_id': other.id}, format='json')
+
+        menu = Menu.objects.get(cycle_name='Week 1')
+        with self.assertNumQueries(5), self.captureOnCommitCallbacks(execute=True):
+            # menu, save, linked schools, category for the response, then marking the snapshot stale on commit
+            self.client.put(f'/admin_details/edit_menu/{menu.id}/', {'price': '6.00'}, format='json')
+        self.assertEqual(
+            dict(MenuSnapshot.objects.values_list('school_id', 'is_stale')), {self.school.id: True, other.id: False}
+        )
+
+
+class MenuSnapshotTests(TestCase):
+    """Published menus are served with an ETag and revalidated without reading the Menu tables"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name_category='Mains')
+        cls.school = SecondarySchool.objects.create(
+            secondary_school_name='Snapshot College', secondary_school_email='snap@example.com', secondary_school_eircode='N1'
+        )
+        for day in DAYS:
+            Menu.objects.create(name='Stew', price='5.00', menu_day=day, cycle_name='Week 1', category=category)
+            Menu.objects.create(name='Salad', price='4.00', menu_day=day, cycle_name='Week 2', category=category)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def _activate(self, cycle_name):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/admin_details/activate_cycle/', {
+                'school_id': self.school.id, 'school_type': 'secondary', 'cycle_name': cycle_name
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def _fetch(self, **headers):
+        return self.client.get('/admin_details/get_active_menu/', {
+            'school_type': 'secondary', 'school_id': self.school.id
+        }, **headers)
+
+    def test_activate_cycle_publishes_snapshot_and_304_skips_menu_tables(self):
+        self._activate('Week 1')
+        snapshot = MenuSnapshot.objects.get(school_type='secondary', school_id=self.school.id)
+        self.assertEqual([m['name'] for m in json.loads(snapshot.menu_body)['menus']['Monday']], ['Stew'])
+
+        response = self._fetch()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], snapshot.menu_etag)
+        self.assertIn('must-revalidate', response['Cache-Control'])
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self._fetch(HTTP_IF_NONE_MATCH=snapshot.menu_etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertFalse([q for q in ctx.captured_queries if 'admin_section_menu"' in q['sql'] or 'admin_section_menuitems' in q['sql']])
+
+    def test_new_cycle_changes_etag(self):
+        self._activate('Week 1')
+        old = self._fetch()['ETag']
+        self._activate('Week 2')
+
+        response = self._fetch(HTTP_IF_NONE_MATCH=old)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], old)
+        self.assertEqual([m['name'] for m in json.loads(response.content)['menus']['Monday']], ['Salad'])
+
+    def test_bulk_activation_republishes_after_commit(self):
+        self._activate('Week 1')
+        self._fetch()
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/admin_details/activate_cycle/bulk/', {
+                'cycle_name': 'Week 2', 'schools': [{'id': self.school.id, 'type': 'secondary'}]
+            }, format='json')
+            self.assertEqual(response.status_code, 200)
+            # Until the links commit, the published menu is left alone
+            self.assertEqual(MenuSnapshot.objects.count(), 1)
+
+        for callback in callbacks:
+            callback()
+        snapshot = MenuSnapshot.objects.get()
+        self.assertEqual([m['name'] for m in json.loads(snapshot.menu_body)['menus']['Monday']], ['Salad'])
+
+    def test_deleted_snapshot_is_never_served(self):
+        self._activate('Week 1')
+        old = self._fetch()['ETag']
+        # As another process does after a menu change: no local state survives the row
+        Menu.objects.filter(cycle_name='Week 1').update(price='6.00')
+        MenuSnapshot.objects.all().delete()
+
+        response = self._fetch(HTTP_IF_NONE_MATCH=old)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['menus']['Monday'][0]['price'], '6.00')
+
+    def test_read_that_raced_an_edit_does_not_store_its_menu(self):
+        self._activate('Week 1')
+        MenuSnapshot.objects.update(is_stale=True)
+        build = menus._active_menus
+
+        def edited_while_building(*args):
+            built = build(*args)
+            with self.captureOnCommitCallbacks(execute=True):
+                Menu.objects.filter(cycle_name='Week 1').update(price='6.00')
+                menus.invalidate_school_menus([('secondary', self.school.id)])
+            return built
+
+        with mock.patch.object(menus, '_active_menus', side_effect=edited_while_building):
+            self.assertEqual(json.loads(self._fetch().content)['menus']['Monday'][0]['price'], '5.00')
+
+        self.assertTrue(MenuSnapshot.objects.get().is_stale)
+        self.assertEqual(json.loads(self._fetch().content)['menus']['Monday'][0]['price'], '6.00')
+
+    def test_one_snapshot_per_school_whatever_the_host(self):
+        self._activate('Week 1')
+        self._fetch()
+        response = self._fetch(HTTP_HOST='api.example.com')
+        self.assertEqual(MenuSnapshot.objects.count(), 1)
+        self.assertEqual(response['ETag'], MenuSnapshot.objects.get().menu_etag)
+
+    def test_manager_school_menus_served_from_snapshot(self):
+        self._activate('Week 1')
+        url = f'/admin_details/manager/school-menus/?school_id={self.school.id}&school_type=secondary'
+        response = self.client.get(url)
+        self.assertEqual(json.loads(response.content), {'items': ['Stew']})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class MenuItemLinkTests(TestCase):
+    """Menu.menu_item is resolved by case-insensitive name when menus are saved"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Categories.objects.create(name_category='Mains')
+        cls.pizza = MenuItems.objects.create(item_name='Pizza Slice', item_description='Cheese')
+
+    def test_create_cycle_and_edit_menu_resolve_item(self):
+        response = APIClient().post('/admin_details/create_cycle/', {
+            'cycle_name': 'Autumn',
+            'category_Monday': [self.category.id, self.category.id],
+            'item_names_Monday': ['pizza slice', 'Mystery Dish'],
+            'price_Monday': ['3.00', '2.00'],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            dict(Menu.objects.values_list('name', 'menu_item')),
+            {'pizza slice': self.pizza.id, 'Mystery Dish': None}
+        )
+
+        menu = Menu.objects.get(name='Mystery Dish')
+        APIClient().put(f'/admin_details/edit_menu/{menu.id}/', {'name': 'PIZZA SLICE'}, format='json')
+        menu.refresh_from_db()
+        self.assertEqual(menu.menu_item, self.pizza)
+
+    def test_new_menu_item_links_existing_menus(self):
+        menu = Menu.objects.create(name='Wrap', price='4.00', menu_day='Monday', cycle_name='Week 1', category=self.category)
+        response = APIClient().post('/admin_details/add_menu_item/', {
+            'item_name': 'WRAP', 'item_description': 'Chicken', 'nutrients': [],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        menu.refresh_from_db()
+        self.assertEqual(menu.menu_item.item_name, 'WRAP')
+
+
+class ActivateCycleTests(TestCase):
+    """Cycle activation runs set-based statements on the school link tables"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Categories.objects.create(name_category='Mains')
+        cls.schools = [
+            PrimarySchool.objects.create(school_name=f'School {i}', school_email=f's{i}@example.com', school_eircode=f'A{i}')
+            for i in range(3)
+        ]
+        cls.college = SecondarySchool.objects.create(
+            secondary_school_name='College', secondary_school_email='c@example.com', secondary_school_eircode='C1'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def _cycle(self, cycle_name, count):
+        Menu.objects.bulk_create([
+            Menu(name=f'{cycle_name} {i}', price='3.00', menu_day=DAYS[i % len(DAYS)], cycle_name=cycle_name, category=self.category)
+            for i in range(count)
+        ])
+
+    def _activate(self, cycle_name, school):
+        return self.client.post('/admin_details/activate_cycle/', {
+            'school_id': school.id, 'school_type': 'primary', 'cycle_name': cycle_name
+        }, format='json')
+
+    def _queries(self, cycle_name, school):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._activate(cycle_name, school).status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_cycle_size(self):
+        self._cycle('Old', 2)
+        self._cycle('Small', 2)
+        self._cycle('Large', 25)
+        self._activate('Old', self.schools[2])
+        small = self._queries('Small', self.schools[2])
+        self.assertEqual(self._queries('Large', self.schools[2]), small)
+
+    def test_previous_cycle_unlinked_and_deactivated_when_unused(self):
+        self._cycle('Week 1', 3)
+        self._cycle('Week 2', 3)
+        self._activate('Week 1', self.schools[0])
+        self._activate('Week 1', self.schools[1])
+
+        response = self._activate('Week 2', self.schools[0])
+        self.assertEqual(response.data['menus'][0]['schools'], {'primary': ['School 0'], 'secondary': []})
+        self.assertFalse(Menu.objects.filter(cycle_name='Week 1', primary_schools=self.schools[0]).exists())
+        self.assertTrue(all(Menu.objects.filter(cycle_name='Week 1').values_list('is_active', flat=True)))
+
+        self._activate('Week 2', self.schools[1])
+        self.assertFalse(any(Menu.objects.filter(cycle_name='Week 1').values_list('is_active', flat=True)))
+        self.assertEqual(Menu.objects.filter(cycle_name='Week 2', is_active=True, primary_schools=self.schools[1]).count(), 3)
+
+    def test_bulk_activation_for_many_schools(self):
+        self._cycle('Rollout', 4)
+        schools = [{'id': school.id, 'type': 'primary'} for school in self.schools]
+        schools.append({'id': self.college.id, 'type': 'secondary'})
+
+        response = self.client.post('/admin_details/activate_cycle/bulk/', {
+            'cycle_name': 'Rollout', 'schools': schools
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Menu.primary_schools.through.objects.count(), 12)
+        self.assertEqual(Menu.secondary_schools.through.objects.count(), 4)
+        self.assertEqual(Menu.objects.filter(is_active=True).count(), 4)
+
+        response = self.client.post('/admin_details/activate_cycle/bulk/', {
+            'cycle_name': 'Rollout', 'schools': [{'id': 999, 'type': 'primary'}]
+        }, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+class CycleEditTests(TestCase):
+    """Editing a cycle updates rows in place instead of deleting and recreating them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.mains = Categories.objects.create(name_category='Mains')
+        cls.sides = Categories.objects.create(name_category='Sides')
+        cls.school = PrimarySchool.objects.create(school_name='Edit School', school_email='edit@example.com', school_eircode='E1')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.payload = {'cycle_name': 'Week 1'}
+        for day in DAYS:
+            names = [f'{day} Dish {i}' for i in range(5)]
+            self.payload.update({
+                f'category_{day}': [self.mains.id] * 5,
+                f'item_names_{day}': names,
+                f'price_{day}': ['4.00'] * 5,
+            })
+            for name in names:
+                menu = Menu.objects.create(name=name, price='4.00', menu_day=day, cycle_name='Week 1',
+                                           category=self.mains, is_active=True)
+                menu.primary_schools.add(self.school)
+
+    def _put(self):
+        return self.client.put('/admin_details/get_cycle_menus/', self.payload, format='json')
+
+    def test_price_change_updates_one_row_in_place(self):
+        menu = Menu.objects.get(name='Monday Dish 0')
+        order = Order.objects.create(user_id=1, user_type='parent', total_price=4, week_number=1, year=2025,
+                                     order_date=timezone.now(), selected_day='Monday')
+        order_item = OrderItem.objects.create(order=order, menu=menu, quantity=1)
+        ids = set(Menu.objects.values_list('id', flat=True))
+
+        self.payload['price_Monday'][0] = '4.75'
+        with CaptureQueriesContext(connection) as ctx:
+            response = self._put()
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(ctx.captured_queries), 15)
+
+        self.assertEqual(set(Menu.objects.values_list('id', flat=True)), ids)
+        menu.refresh_from_db()
+        self.assertEqual(str(menu.price), '4.75')
+        self.assertEqual(list(menu.primary_schools.all()), [self.school])
+        order_item.refresh_from_db()
+        self.assertEqual(order_item.menu_id, menu.id)
+
+    def test_added_and_removed_rows(self):
+        self.payload['item_names_Tuesday'][4] = 'Soup'
+        self.payload['category_Tuesday'][4] = 'Sides'
+        response = self._put()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['menus']), 25)
+
+        self.assertTrue(Menu.objects.get(name='Tuesday Dish 4').is_deleted)
+        soup = Menu.objects.get(name='Soup')
+        self.assertEqual((soup.category, soup.is_active), (self.sides, True))
+        self.assertEqual(list(soup.primary_schools.all()), [self.school])
+
+        fetched = self.client.post('/admin_details/get_cycle_menus/', {'cycle_name': 'Week 1'}, format='json')
+        self.assertNotIn('Tuesday Dish 4', [m['name'] for m in fetched.data['menus']])
+
+    def test_invalid_payload_changes_nothing(self):
+        self.payload['item_names_Friday'][0] = 'Renamed'
+        self.payload['category_Friday'][1] = 'Unknown'
+        response = self._put()
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Menu.objects.filter(is_deleted=True).exists())
+        self.assertFalse(Menu.objects.filter(name='Renamed').exists())
+
+
+class CycleCreateAndDuplicateTests(TestCase):
+    """Creating and duplicating cycles costs a fixed number of queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Categories.objects.create(name_category='Mains')
+        cls.school = PrimarySchool.objects.create(school_name='Copy School', school_email='copy@example.com', school_eircode='D1')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def _payload(self, cycle_name, per_day):
+        payload = {'cycle_name': cycle_name}
+        for day in DAYS:
+            payload.update({
+                f'category_{day}': [self.category.id] * per_day,
+                f'item_names_{day}': [f'{day} {i}' for i in range(per_day)],
+                f'price_{day}': ['3.50'] * per_day,
+            })
+        return payload
+
+    def _create(self, payload):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/admin_details/create_cycle/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response, len(ctx.captured_queries)
+
+    def test_create_cycle_query_count_is_constant(self):
+        small, small_queries = self._create(self._payload('Small', 1))
+        large, large_queries = self._create(self._payload('Large', 10))
+        self.assertEqual(len(large.data['menus']), 50)
+        self.assertEqual(large_queries, small_queries)
+        self.assertLess(large_queries, 10)
+
+    def test_create_cycle_validates_before_inserting(self):
+        payload = self._payload('Broken', 2)
+        payload['price_Friday'][1] = 'free'
+        response = self.client.post('/admin_details/create_cycle/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Menu.objects.filter(cycle_name='Broken').exists())
+
+    def test_duplicate_cycle_lists_source_schools_without_linking(self):
+        self._create(self._payload('Source', 4))
+        Menu.primary_schools.through.objects.bulk_create([
+            Menu.primary_schools.through(menu_id=menu_id, primaryschool_id=self.school.id)
+            for menu_id in Menu.objects.values_list('id', flat=True)
+        ])
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/admin_details/duplicate_cycle/', {
+                'cycle_name': 'Source', 'new_cycle_name': 'Copy', 'include_source_schools': True
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertLess(len(ctx.captured_queries), 10)
+        self.assertEqual(len(response.data['menus']), 20)
+        self.assertEqual(response.data['source_schools'], [{'id': self.school.id, 'type': 'primary'}])
+        self.assertFalse(Menu.objects.filter(cycle_name='Copy', primary_schools__isnull=False).exists())
+        self.assertFalse(Menu.objects.filter(cycle_name='Copy', is_active=True).exists())
+
+    def test_activating_copy_for_one_school_leaves_the_others_alone(self):
+        other = PrimarySchool.objects.create(school_name='Other School', school_email='other@example.com', school_eircode='D2')
+        self._create(self._payload('Old', 1))
+        schools = [{'id': self.school.id, 'type': 'primary'}, {'id': other.id, 'type': 'primary'}]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/admin_details/activate_cycle/bulk/', {'cycle_name': 'Old', 'schools': schools}, format='json')
+
+        response = self.client.post('/admin_details/duplicate_cycle/', {
+            'cycle_name': 'Old', 'new_cycle_name': 'New', 'include_source_schools': True
+        }, format='json')
+        self.assertEqual(response.data['source_schools'], schools)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/admin_details/activate_cycle/bulk/', {
+                'cycle_name': 'New', 'schools': [{'id': self.school.id, 'type': 'primary'}]
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        menu = json.loads(self.client.get('/admin_details/get_active_menu/', {
+            'school_type': 'primary', 'school_id': other.id
+        }).content)
+        self.assertEqual(menu['cycles'], [{'cycle': 'Old'}])
+        self.assertEqual([dish['name'] for dish in menu['menus']['Monday']], ['Monday 0'])
+
+
+class CycleListTests(TestCase):
+    """get_all_cycles_with_menus pages over cycles and lists each menu once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name_category='Mains')
+        schools = [
+            PrimarySchool.objects.create(school_name=f'List School {i}', school_email=f'l{i}@example.com', school_eircode=f'L{i}')
+            for i in range(3)
+        ]
+        for c in range(5):
+            for day in DAYS:
+                menu = Menu.objects.create(name=f'Cycle {c} {day}', price='3.00', menu_day=day,
+                                           cycle_name=f'Cycle {c}', category=category, is_active=c == 0)
+                menu.primary_schools.add(*schools)
+        Menu.objects.filter(cycle_name='Cycle 4').update(is_deleted=True)
+
+    def _get(self, **params):
+        return APIClient().get('/admin_details/get_all_cycles_with_menus/', params)
+
+    def test_pages_follow_the_cursor(self):
+        first = self._get(limit=2)
+        self.assertEqual([c['cycle_name'] for c in first.data['cycles']], ['Cycle 0', 'Cycle 1'])
+        menu = first.data['cycles'][0]['menus'][0]
+        self.assertEqual(len(first.data['cycles'][0]['menus']), 5)
+        self.assertEqual([s['school_name'] for s in menu['primary_schools']], ['List School 0', 'List School 1', 'List School 2'])
+
+        second = self._get(limit=2, cursor=first.data['next_cursor'])
+        self.assertEqual([c['cycle_name'] for c in second.data['cycles']], ['Cycle 2', 'Cycle 3'])
+        self.assertIsNone(second.data['next_cursor'])
+        self.assertEqual(self._get(cursor='!!').status_code, 400)
+
+    def test_filters_and_constant_queries(self):
+        self.assertEqual([c['cycle_name'] for c in self._get(active_only='true').data['cycles']], ['Cycle 0'])
+        self.assertEqual(len(self._get(exclude_deleted='false', limit=10).data['cycles']), 5)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self._get(limit=1)
+        few = len(ctx.captured_queries)
+        with CaptureQueriesContext(connection) as ctx:
+            self._get(limit=4)
+        self.assertEqual(len(ctx.captured_queries), few)
+
+
+class DeactivateMenuCyclesTests(TestCase):
+    """The Friday deactivation summarises with grouped queries and records each run"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Categories.objects.create(name_category='Mains')
+        cls.schools = [
+            PrimarySchool.objects.create(school_name=f'Friday School {i}', school_email=f'f{i}@example.com', school_eircode=f'F{i}')
+            for i in range(2)
+        ]
+        cls.college = SecondarySchool.objects.create(
+            secondary_school_name='Friday College', secondary_school_email='fc@example.com', secondary_school_eircode='FC'
+        )
+        for cycle_name in ('Week 1', 'Week 2'):
+            for day in DAYS:
+                menu = Menu.objects.create(name=f'{cycle_name} {day}', price='3.00', menu_day=day,
+                                           cycle_name=cycle_name, category=category, is_active=True)
+                menu.primary_schools.add(*cls.schools)
+                if cycle_name == 'Week 2':
+                    menu.secondary_schools.add(cls.college)
+
+    def _run(self, *args):
+        out = io.StringIO()
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('deactivate_menu_cycles', *args, stdout=out)
+        return out.getvalue(), len(ctx.captured_queries)
+
+    def test_summary_queries_do_not_grow_with_menus(self):
+        output, queries = self._run('--dry-run')
+        self.assertIn('Affected Primary Schools: 4', output)
+        self.assertIn('Affected Secondary Schools: 1', output)
+        self.assertLess(queries, 6)
+        self.assertEqual(Menu.objects.filter(is_active=True).count(), 10)
+        self.assertTrue(MenuDeactivationRun.objects.get().dry_run)
+
+    def test_batched_deactivation_records_run(self):
+        self._run('--batch-size', '3')
+        self.assertFalse(Menu.objects.filter(is_active=True).exists())
+        run = MenuDeactivationRun.objects.get()
+        self.assertEqual((run.scope, run.menus_deactivated, run.dry_run), ('all', 10, False))
+
+    def test_cycle_and_school_scopes(self):
+        self._run('--cycle', 'Week 1')
+        self.assertEqual(set(Menu.objects.filter(is_active=True).values_list('cycle_name', flat=True)), {'Week 2'})
+
+        # Week 2 is still used by the other primary school and the college
+        self._run('--school-id', str(self.schools[0].id), '--school-type', 'primary')
+        self.assertEqual(Menu.objects.filter(is_active=True).count(), 5)
+        self.assertFalse(Menu.objects.filter(cycle_name='Week 2', primary_schools=self.schools[0]).exists())
+        run = MenuDeactivationRun.objects.latest('id')
+        self.assertEqual((run.links_removed, run.menus_deactivated), (5, 0))
+
+
+class OrderReadTests(TestCase):
+    """The order listing endpoints cost a fixed number of queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Categories.objects.create(name_category='Mains')
+        cls.menu = Menu.objects.create(name='Pasta', price='4.00', menu_day='Monday', cycle_name='Week 1', category=cls.category)
+        cls.school = PrimarySchool.objects.create(school_name='Read School', school_email='read@example.com', school_eircode='RS')
+        cls.college = SecondarySchool.objects.create(
+            secondary_school_name='Read College', secondary_school_email='rc@example.com', secondary_school_eircode='RC'
+        )
+        cls.manager = Manager.objects.create(username='kitchen', password='secret123')
+
+    def setUp(self):
+        self.client = APIClient()
+        self._add_orders(1)
+
+    def _add_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(
+                user_id=7, user_type='parent', child_id=Order.objects.count() + 1, total_price=8.0, selected_day='Monday',
+                week_number=10, year=2025, user_name='parent', primary_school=self.school
+            )
+            OrderItem.objects.create(order=order, menu=self.menu, quantity=2)
+            OrderItem.objects.create(order=order, menu=None, quantity=1, _menu_name='Soup', _menu_price='2.50')
+            for school_type, school_id in (('primary', self.school.id), ('secondary', self.college.id)):
+                m_order = ManagerOrder.objects.create(
+                    manager=self.manager, manager_name='kitchen', school_type=school_type, school_id=school_id,
+                    order_date=date(2025, 3, 3), week_number=10, year=2025, selected_day='Monday'
+                )
+                ManagerOrderItem.objects.create(order=m_order, day='Monday', item='Pasta', quantity=5, production_price='1.50')
+                ManagerOrderItem.objects.create(order=m_order, day='Monday', item='Soup', quantity=2, production_price='0.75')
+
+    def _assert_constant(self, queries, request):
+        with self.assertNumQueries(queries):
+            small = request()
+        self._add_orders(4)
+        with self.assertNumQueries(queries):
+            large = request()
+        self.assertEqual(large.status_code, 200)
+        self.assertGreater(len(large.data['orders']), len(small.data['orders']))
+        return large
+
+    def test_get_all_orders(self):
+        # orders, order items, manager orders, manager items, primary and secondary school names
+        response = self._assert_constant(6, lambda: self.client.get('/admin_details/get_all_orders/'))
+        orders = response.data['orders']
+        self.assertEqual(len(orders), 15)
+
+        order = orders[0]
+        self.assertEqual(order['school_name'], 'Read School')
+        self.assertEqual(order['child_id'], 5)
+        self.assertEqual([(i['item_name'], i['quantity']) for i in order['items']], [('Pasta', 2), ('Soup', 1)])
+
+        m_order = next(o for o in orders if o['user_type'] == 'manager' and o['school_type'] == 'secondary')
+        self.assertEqual(m_order['total_production_price'], Decimal('2.25'))
+        self.assertEqual(m_order['school_name'], 'Read College')
+        self.assertEqual(m_order['user_name'], 'kitchen')
+
+    def test_get_orders_by_school(self):
+        response = self._assert_constant(5, lambda: self.client.post(
+            '/admin_details/get_orders_by_school/', {'school_id': self.school.id, 'school_type': 'primary'}, format='json'
+        ))
+        self.assertEqual(len(response.data['orders']), 10)
+        self.assertEqual({o['user_type'] for o in response.data['orders']}, {'parent', 'manager'})
+
+    def test_get_orders_by_user(self):
+        self._assert_constant(2, lambda: self.client.post(
+            '/admin_details/get_orders_by_user/', {'user_id': 7, 'user_type': 'parent'}, format='json'
+        ))
+        response = self._assert_constant(4, lambda: self.client.post(
+            '/admin_details/get_orders_by_user/', {'user_id': self.manager.id, 'user_type': 'manager'}, format='json'
+        ))
+        self.assertEqual(response.data['orders'][0]['manager_name'], 'kitchen')
+
+    def test_get_order_by_id(self):
+        order = Order.objects.get()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/admin_details/get_order_by_id/{order.id}/')
+        self.assertEqual(response.data['order']['school_type'], 'primary')
+
+        m_order = ManagerOrder.objects.get(school_type='primary')
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/admin_details/get_order_by_id/m_{m_order.id}/')
+        self.assertEqual(response.data['order']['total_production_price'], Decimal('2.25'))
+        self.assertEqual(self.client.get('/admin_details/get_order_by_id/m_0/').status_code, 404)
+
+
+class OrderPaginationTests(TestCase):
+    """get_all_orders pages through orders and manager orders as one keyset stream"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = PrimarySchool.objects.create(school_name='Page School', school_email='page@example.com', school_eircode='PS')
+        cls.other = PrimarySchool.objects.create(school_name='Other School', school_email='other@example.com', school_eircode='OS')
+        noon = timezone.make_aware(datetime(2025, 3, 3, 12, 0))
+        for i in range(6):
+            # Two orders share each timestamp, so ties are broken by id
+            Order.objects.create(
+                user_id=1, user_type='student' if i % 2 else 'parent', total_price=5.0, selected_day='Monday',
+                week_number=10, year=2025, user_name='kid', order_date=noon - timedelta(days=i // 2),
+                primary_school=cls.school if i < 4 else cls.other, status='pending' if i % 3 else 'completed'
+            )
+        for day in (date(2025, 3, 3), date(2025, 3, 2)):
+            ManagerOrder.objects.create(manager_name='kitchen', school_type='primary', school_id=cls.school.id,
+                                        order_date=day, week_number=10, year=2025, selected_day='Monday')
+
+    def setUp(self):
+        cache.clear()
+
+    def _get(self, **params):
+        response = APIClient().get('/admin_details/get_all_orders/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def _walk(self, limit, **params):
+        ids, cursor = [], None
+        while True:
+            page = self._get(limit=limit, **({'cursor': cursor} if cursor else {}), **params)
+            ids += [o['order_id'] for o in page['orders']]
+            cursor = page['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_pages_merge_both_sources_without_gaps(self):
+        everything = self._get(limit=100)
+        self.assertIsNone(everything['next_cursor'])
+        ids = [o['order_id'] for o in everything['orders']]
+        self.assertEqual(len(ids), 8)
+        # A manager order sorts at local midnight of its date, after that day's orders
+        manager = [ids.index(i) for i in ids if str(i).startswith('m_')]
+        self.assertEqual(manager, [2, 5])
+
+        for limit in (1, 2, 3):
+            self.assertEqual(self._walk(limit), ids)
+
+    def test_filters(self):
+        self.assertEqual(len(self._get(school_id=self.school.id, school_type='primary')['orders']), 6)
+        self.assertEqual({o['user_type'] for o in self._get(user_type='manager')['orders']}, {'manager'})
+        self.assertEqual(len(self._get(user_type='student')['orders']), 3)
+        self.assertEqual(len(self._get(status='completed')['orders']), 2)
+        self.assertEqual(len(self._get(week=10, year=2025, day='monday')['orders']), 8)
+        # Both orders of the other school share a timestamp: newest id first
+        other_ids = list(Order.objects.filter(primary_school=self.other).order_by('-id').values_list('id', flat=True))
+        self.assertEqual(self._walk(1, school_id=self.other.id, school_type='primary'), other_ids)
+
+        client = APIClient()
+        self.assertEqual(client.get('/admin_details/get_all_orders/', {'cursor': 'nope'}).status_code, 400)
+        self.assertEqual(client.get('/admin_details/get_all_orders/', {'school_type': 'primary'}).status_code, 400)
+
+    def test_total_is_cached_and_pages_cost_the_same(self):
+        self.assertEqual(self._get(include_total='true')['approximate_total'], 8)
+        Order.objects.filter(primary_school=self.other).delete()
+        self.assertEqual(self._get(include_total='true')['approximate_total'], 8)
+        self.assertNotIn('approximate_total', self._get())
+
+        first = self._get(limit=2)
+        with CaptureQueriesContext(connection) as ctx:
+            self._get(limit=2)
+        with self.assertNumQueries(len(ctx.captured_queries)):
+            self._get(limit=2, cursor=first['next_cursor'])
+
+
+class OrderSyncTests(TestCase):
+    """orders/sync/ sends only what changed since the client's token"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.parent = ParentRegisteration.objects.create(
+            first_name='Sync', last_name='Parent', username='syncparent',
+            email='sync@example.com', password='secret123', credits=0
+        )
+        yesterday = timezone.now() - timedelta(days=1)
+        cls.orders = [
+            Order.objects.create(user_id=cls.parent.id, user_type='parent', child_id=i + 1, total_price=4.0,
+                                 selected_day=day, week_number=10, year=2025, order_date=yesterday)
+            for i, day in enumerate(DAYS[:4])
+        ]
+        Order.objects.create(user_id=cls.parent.id + 1, user_type='parent', total_price=4.0, selected_day='Monday')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def _sync(self, since=None, **params):
+        params = {'user_type': 'parent', 'user_id': self.parent.id, **params}
+        if since:
+            params['since'] = since
+        return self.client.get('/admin_details/orders/sync/', params)
+
+    def test_full_then_delta_sync(self):
+        with self.assertNumQueries(2):
+            full = self._sync()
+        self.assertEqual(full.status_code, 200)
+        self.assertEqual({o['order_id'] for o in full.data['orders']}, {o.id for o in self.orders})
+        self.assertEqual(full.data['deleted'], [])
+
+        # Everything so far happened well before the token
+        Order.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        token = self._sync().data['sync_token']
+        with self.assertNumQueries(2):
+            self.assertEqual(self._sync(token).data['orders'], [])
+
+        completed, cancelled, auto_completed, deleted = self.orders
+        self.client.post('/admin_details/complete_order/', {'order_id': completed.id}, format='json')
+        self.assertEqual(self.client.post('/admin_details/cancel_order/', {'order_id': cancelled.id}, format='json').status_code, 200)
+        call_command('auto_complete_orders', stdout=io.StringIO())
+        delete_orders(Order.objects.filter(id=deleted.id))
+
+        with self.assertNumQueries(3):
+            delta = self._sync(token)
+        self.assertEqual(
+            {(o['order_id'], o['status']) for o in delta.data['orders']},
+            {(completed.id, 'collected'), (cancelled.id, 'cancelled'), (auto_completed.id, 'collected')}
+        )
+        self.assertEqual(delta.data['deleted'], [deleted.id])
+        self.assertEqual(OrderTombstone.objects.get().user_id, self.parent.id)
+        self.assertFalse(delta.data['full_resync'])
+        self.assertTrue(full.data['full_resync'])
+
+    def test_token_older_than_the_tombstones_kept_gets_a_full_resync(self):
+        token = self._sync().data['sync_token']
+        delete_orders(Order.objects.filter(id=self.orders[0].id))
+        OrderTombstone.objects.update(deleted_at=timezone.now() - ORDER_TOMBSTONE_RETENTION - timedelta(days=1))
+        call_command('purge_idempotency_keys', stdout=io.StringIO())
+        self.assertFalse(OrderTombstone.objects.exists())
+
+        later = timezone.now() + ORDER_TOMBSTONE_RETENTION
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response = self._sync(token)
+        self.assertTrue(response.data['full_resync'])
+        self.assertEqual({o['order_id'] for o in response.data['orders']}, {o.id for o in self.orders[1:]})
+        self.assertEqual(response.data['deleted'], [])
+
+    def test_bad_requests(self):
+        self.assertEqual(self._sync(user_type='manager').status_code, 400)
+        self.assertEqual(self._sync(user_id='').status_code, 400)
+        self.assertEqual(self._sync('not-a-token').status_code, 400)
+        child = self._sync(user_type='staff', user_id='', child_id=self.orders[0].child_id)
+        self.assertEqual([o['order_id'] for o in child.data['orders']], [self.orders[0].id])
+
+
+class OrderExportTests(TestCase):
+    """Orders export streams chunk by chunk with a fixed number of queries per chunk"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.school = PrimarySchool.objects.create(school_name='Export School', school_email='ex@example.com', school_eircode='EX')
+        start = timezone.make_aware(datetime(2025, 3, 3, 12, 0))
+        for i in range(6):
+            order = Order.objects.create(
+                user_id=1, user_type='parent', child_id=i + 1, total_price=5.0, selected_day='Monday', user_name='kid',
+                order_date=start + timedelta(days=i), primary_school=cls.school if i % 2 == 0 else None
+            )
+            for n in range(i % 3):
+                OrderItem.objects.create(order=order, quantity=1, _menu_name=f'Dish {n}', _menu_price='2.00')
+
+    def _get(self, **params):
+        response = APIClient().get('/admin_details/orders/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_with_filters(self):
+        lines = self._get(date_from='2025-03-04', date_to='2025-03-07').splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([r['delivery_date'] for r in records], ['2025-03-04', '2025-03-05', '2025-03-06', '2025-03-07'])
+        self.assertEqual([len(r['items']) for r in records], [1, 2, 0, 1])
+
+        school = [json.loads(line) for line in self._get(school_id=self.school.id, school_type='primary').splitlines()]
+        self.assertEqual({r['school_name'] for r in school}, {'Export School'})
+        self.assertEqual(len(school), 3)
+
+        client = APIClient()
+        self.assertEqual(client.get('/admin_details/orders/export/', {'date_from': 'soon'}).status_code, 400)
+        self.assertEqual(client.get('/admin_details/orders/export/', {'export_format': 'xlsx'}).status_code, 400)
+
+    def test_csv_has_a_row_per_item(self):
+        rows = list(csv.DictReader(io.StringIO(self._get(export_format='csv'))))
+        # 0 + 1 + 2 + 0 + 1 + 2 items, orders without items get one row
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(rows[0]['item_name'], '')
+        self.assertEqual(rows[1]['item_name'], 'Dish 0')
+
+    def test_command_reads_in_chunks(self):
+        out = io.StringIO()
+        # one cursor over the orders, then an items query per chunk of two orders
+        with self.assertNumQueries(4):
+            call_command('export_orders', '--chunk-size', '2', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 6)
+
+        with self.assertRaises(CommandError):
+            call_command('export_orders', '--school-id', '1', stdout=io.StringIO())
@@ -68,6 +68,7 @@ urlpatterns = [
     path("duplicate_cycle/", views.duplicate_cycle, name="duplicate_cycle"),
     path("get_complete_menu/",views.get_complete_menu,name='get_complete_menu'),
     path("activate_cycle/",views.activate_cycle,name='activate_cycle'),
+    path("activate_cycle/bulk/",views.activate_cycle_bulk,name='activate_cycle_bulk'),
 
     path("edit_menu/<int:id>/",views.edit_menu,name='edit_menu'),
     path("get_cycle_names/",views.get_cycle_names,name='get_cycle_names'),
@@ -96,6 +97,8 @@ urlpatterns = [
     path('get_order_by_id/<str:order_id>/', views.get_order_by_id, name='get_order_by_id'),
     path('get_orders_by_user/', views.get_orders_by_user, name='get_orders_by_user'),
     path('get_orders_by_school/', views.get_orders_by_school, name='get_orders_by_school'),
+    path('orders/sync/', views.sync_orders, name='sync_orders'),
+    path('orders/export/', views.export_orders, name='export_orders'),
 
     path('contactmessage/', views.contactmessage, name='contactmessage'),
 
@@ -130,7 +133,9 @@ urlpatterns = [
 
     # Promotions
     path('promotions/', views.promotions, name='promotions'),
+    path('promotions/progress/', views.promotion_progress_view, name='promotion_progress'),
     path('promotions/<int:pk>/', views.promotion_detail, name='promotion_detail'),
+    path('promotions/evaluations/<int:pk>/', views.promotion_evaluation_detail, name='promotion_evaluation_detail'),
 
     # Admin Dashboard Analytics
     path('dashboard/analytics/', views.get_dashboard_analytics, name='dashboard_analytics'),
@@ -0,0 +1,304 @@
+"""
+Checkout Helper Functions
+Batched order building for the checkout/payment endpoint.
+
+A cart is planned completely in memory (menu lookups, prices, totals) before
+anything is written, so the number of queries does not grow with the number
+of cart lines.
+"""
+
+import operator
+import uuid
+from datetime import datetime, timedelta
+from functools import reduce
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .ledger import build_transaction, post_transactions
+from .orders import delete_orders
+from .promotions import record_order_progress
+from .user_names import display_name_for
+
+
+CHILD_DAY_CONSTRAINT = 'order_child_day_unique'
+
+# Card orders are committed in this state before Stripe is called and moved
+# to 'pending' once the PaymentIntent exists (see confirm_checkout_payment).
+AWAITING_PAYMENT = 'awaiting_payment'
+
+# Orders in these states are not (or not yet) going to be delivered: kitchen
+# sheets, completion and analytics leave them out. An awaiting order may still
+# be rolled back by reconcile_checkout_payments.
+UNPLACED_STATUSES = ('cancelled', AWAITING_PAYMENT)
+
+DAYS_MAP = {
+    'monday': 0, 'tuesday': 1, 'wednesday': 2,
+    'thursday': 3, 'friday': 4, 'saturday': 5, 'sunday': 6
+}
+
+
+class CheckoutError(ValueError):
+    """Raised when a cart cannot be turned into orders"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_next_order_date(day, today=None):
+    """Next occurrence of `day` (never today) at midnight"""
+    today = today or datetime.now()
+    target_day_num = DAYS_MAP[day.lower()]
+
+    # No same-day ordering → push to next week
+    days_ahead = (target_day_num - today.weekday() + 7) % 7
+    if days_ahead == 0:
+        days_ahead = 7
+
+    order_date = today + timedelta(days=days_ahead)
+    return order_date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def group_items_by_day(selected_days, order_items_data):
+    """Group cart lines by their selected day, keeping the cart order"""
+    daily_orders = {}
+    for i, day in enumerate(selected_days):
+        daily_orders.setdefault(day, []).append(order_items_data[i])
+    return daily_orders
+
+
+def resolve_menu_items(daily_orders):
+    """
+    Resolve every (day, item_name) pair of the cart with a single query.
+    Returns a dict keyed by (day.lower(), item_name.lower()).
+    """
+    from ..models import Menu
+
+    pairs = {
+        (day.lower(), item['item_name'].lower())
+        for day, items_list in daily_orders.items()
+        for item in items_list
+        if item.get('item_name')
+    }
+    if not pairs:
+        return {}
+
+    condition = reduce(operator.or_, (
+        Q(menu_day__iexact=day, name__iexact=name) for day, name in pairs
+    ))
+    menus = Menu.objects.filter(condition, is_deleted=False).select_related('category').order_by('id')
+
+    # Keep the lowest id per pair, same as the old `.first()` lookup
+    lookup = {}
+    for menu in menus:
+        lookup.setdefault(((menu.menu_day or '').lower(), menu.name.lower()), menu)
+    return lookup
+
+
+def plan_orders(user, user_type, daily_orders, *, is_primary_free=False, payment_id=None,
+                child_id=None, school_id=None, school_type=None):
+    """
+    Build unsaved Order/OrderItem instances for the whole cart.
+    All validation and price calculation happens here, before the first insert.
+    Returns (plan, total) where plan is a list of (order, items) tuples.
+    """
+    from ..models import Order, OrderItem
+
+    for day, items_list in daily_orders.items():
+        if day.lower() not in DAYS_MAP:
+            raise CheckoutError(f'Invalid day "{day}".')
+        for item in items_list:
+            if not item.get('item_name') or not item.get('quantity'):
+                raise CheckoutError('Each item must have item_name and quantity.')
+
+    menu_lookup = resolve_menu_items(daily_orders)
+
+    plan = []
+    calculated_total_price = 0
+    today = datetime.now()
+
+    for day, items_list in daily_orders.items():
+        order_date = get_next_order_date(day, today)
+
+        items = []
+        daily_total_price = 0
+        for item in items_list:
+            item_name = item['item_name']
+            quantity = item['quantity']
+
+            menu_item = menu_lookup.get((day.lower(), item_name.lower()))
+            if not menu_item:
+                raise CheckoutError(f'Menu item with name "{item_name}" not found for {day}.', status_code=404)
+
+            item_price = 0 if is_primary_free else float(item.get('price', menu_item.price))
+
+            items.append(OrderItem(
+                menu=menu_item,
+                quantity=quantity,
+                _menu_name=menu_item.name,
+                _menu_price=item_price
+            ))
+            daily_total_price += item_price * quantity
+
+        order = Order(
+            user_id=user.id,
+            user_type=user_type,
+            user_name=display_name_for(user),
+            total_price=daily_total_price,
+            week_number=order_date.isocalendar()[1],
+            year=order_date.year,
+            order_date=order_date,
+            delivery_date=order_date.date(),
+            selected_day=day,
+            is_delivered=False,
+            status='pending',
+            payment_id=payment_id,
+            child_id=child_id if user_type in ['parent', 'staff'] and child_id else None,
+            primary_school_id=school_id if school_type == 'primary' else None,
+            secondary_school_id=school_id if school_type == 'secondary' else None
+        )
+        plan.append((order, items))
+        calculated_total_price += daily_total_price
+
+    return plan, calculated_total_price
+
+
+def save_planned_orders(plan):
+    """
+    Insert planned orders and their items with one bulk insert each.
+    The created items are attached to each order's prefetch cache so that
+    serializing the result does not query again. Paid orders are added to the
+    user's promotion progress.
+    """
+    from ..models import Order, OrderItem
+
+    orders = Order.objects.bulk_create([order for order, _ in plan])
+
+    all_items = []
+    for order, items in plan:
+        for item in items:
+            item.order = order
+        all_items.extend(items)
+    OrderItem.objects.bulk_create(all_items)
+
+    for order, items in plan:
+        order._prefetched_objects_cache = {'order_items': items}
+
+    # Card orders count towards promotions once paid (confirm_checkout_payment)
+    record_order_progress([order for order in orders if order.status != AWAITING_PAYMENT])
+    return orders
+
+
+def build_order_transactions(user, user_type, orders, payment_method, description, amount=None,
+                             payment_intent_id=None):
+    """
+    Unsaved payment Transaction per order.
+    `description` is formatted with the order id; `amount` defaults to
+    the negated order total.
+    """
+    return [
+        build_transaction(
+            user, user_type,
+            -order.total_price if amount is None else amount,
+            transaction_type='payment',
+            payment_method=payment_method,
+            description=description.format(order_id=order.id),
+            order=order,
+            payment_intent_id=payment_intent_id
+        )
+        for order in orders
+    ]
+
+
+def create_order_transactions(user, user_type, orders, payment_method, description, amount=None,
+                              payment_intent_id=None):
+    """Record one payment Transaction per order with a single bulk insert"""
+    from ..models import Transaction
+
+    return Transaction.objects.bulk_create(build_order_transactions(
+        user, user_type, orders, payment_method, description, amount, payment_intent_id
+    ))
+
+
+def pay_orders_with_credits(user, user_type, orders):
+    """
+    Debit the order totals from the user's credits through the ledger.
+    Raises InsufficientCredits (a ValueError) if the balance does not cover them.
+    """
+    return post_transactions(user, user_type, build_order_transactions(
+        user, user_type, orders, 'credits',
+        "Payment for order #{order_id} using credits"
+    ), 'order_payment')
+
+
+def is_child_day_conflict(error):
+    """True if an IntegrityError comes from the one-order-per-child-per-day index"""
+    return CHILD_DAY_CONSTRAINT in str(error)
+
+
+def find_child_day_conflict(child_id, plan):
+    """
+    Existing non-cancelled order that blocks one of the planned days.
+    One query covers every day in the cart.
+    """
+    from ..models import Order
+
+    if child_id is None or not plan:
+        return None
+
+    condition = reduce(operator.or_, (
+        Q(year=order.year, week_number=order.week_number, selected_day__iexact=order.selected_day)
+        for order, _ in plan
+    ))
+    return (
+        Order.objects.filter(condition, child_id=child_id, primary_school__isnull=False)
+        .exclude(status='cancelled')
+        .order_by('delivery_date', 'id')
+        .first()
+    )
+
+
+def new_checkout_ref():
+    """
+    Reference stored in Order.payment_id while a card checkout awaits Stripe.
+    It is also sent as PaymentIntent metadata and idempotency key, so the
+    reconciliation command can find the intent of an interrupted checkout.
+    """
+    return f"chk_{uuid.uuid4().hex}"
+
+
+def confirm_checkout_payment(user, user_type, orders, payment_intent_id):
+    """
+    Second phase of a card checkout: mark the awaiting orders as paid and record
+    their transactions. Only orders still awaiting payment are touched, so a
+    checkout confirmed by reconciliation is never recorded twice.
+    Returns True if this call confirmed the orders.
+    """
+    from ..models import Order
+
+    updated = Order.objects.filter(
+        id__in=[order.id for order in orders],
+        status=AWAITING_PAYMENT
+    ).update(payment_id=payment_intent_id, status='pending', updated_at=timezone.now())
+    if not updated:
+        return False
+
+    for order in orders:
+        order.payment_id = payment_intent_id
+        order.status = 'pending'
+    record_order_progress(orders)
+
+    create_order_transactions(
+        user, user_type, orders, 'stripe',
+        "Payment for order #{order_id} via Stripe",
+        payment_intent_id=payment_intent_id
+    )
+    return True
+
+
+def rollback_checkout(checkout_ref):
+    """Delete the orders of a card checkout whose payment never went through"""
+    from ..models import Order
+
+    return delete_orders(Order.objects.filter(payment_id=checkout_ref, status=AWAITING_PAYMENT))
@@ -0,0 +1,322 @@
+"""
+Menu Cycle Helper Functions
+Validation and diff-based saving for the cycle create/edit endpoints.
+
+A cycle payload carries, per weekday, parallel lists `category_<Day>`,
+`item_names_<Day>` and `price_<Day>`. It is validated completely, with all
+categories resolved in one query, before anything is written. Editing a cycle
+matches the incoming (day, name) rows to the existing menus, so unchanged
+rows keep their primary key, their school links and their order history.
+"""
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Q
+
+from .menus import _school_links, invalidate_active_menus, linked_schools, resolve_menu_items
+
+
+CYCLE_DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+
+
+class CycleError(ValueError):
+    """Raised when a cycle payload cannot be saved"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _category_key(value):
+    """Categories are given by id (int or digit string) or by name"""
+    if isinstance(value, int) or (isinstance(value, str) and value.strip().isdigit()):
+        return 'id', int(value)
+    return 'name', str(value)
+
+
+def parse_cycle_rows(data, days=CYCLE_DAYS):
+    """
+    Validated rows of a cycle payload, in payload order:
+    [{'day', 'name', 'price' (Decimal), 'category' (Categories)}].
+    One query (the categories), none if the payload has no rows.
+    Raises CycleError with the status code to answer with.
+    """
+    from ..models import Categories
+
+    rows = []
+    for day in days:
+        categories = data.get(f'category_{day}')
+        item_names = data.get(f'item_names_{day}')
+        prices = data.get(f'price_{day}')
+
+        # Skip the day if any of the lists is missing, empty or only holds empty values
+        if not categories or not item_names or not prices:
+            continue
+
+        if not isinstance(categories, list) or not isinstance(item_names, list) or not isinstance(prices, list):
+            raise CycleError(f'Invalid data format for {day}. Expecting lists of categories, item names, and prices.')
+
+        if all(val is None or val == "" for val in categories + item_names + prices):
+            continue
+
+        if len(categories) != len(item_names) or len(item_names) != len(prices):
+            raise CycleError(f'Inconsistent data length for {day}. Categories, item names, and prices must have the same number of items.')
+
+        for category, menu_name, price in zip(categories, item_names, prices):
+            # Skip incomplete rows
+            if category is None or not menu_name or price is None or price == "":
+                continue
+
+            try:
+                price = Decimal(str(price))
+                if not price.is_finite():
+                    raise InvalidOperation
+            except InvalidOperation:
+                raise CycleError(f'Invalid price format for {menu_name} on {day}.')
+            if price < 0:
+                raise CycleError(f'Price for {menu_name} on {day} must be positive.')
+
+            rows.append({
+                'day': day,
+                'name': menu_name,
+                'price': price.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
+                'category': _category_key(category)
+            })
+
+    if not rows:
+        return rows
+
+    ids = {value for kind, value in (row['category'] for row in rows) if kind == 'id'}
+    names = {value for kind, value in (row['category'] for row in rows) if kind == 'name'}
+    found = {}
+    for category in Categories.objects.filter(Q(id__in=ids) | Q(name_category__in=names)).order_by('id'):
+        found[('id', category.id)] = category
+        found.setdefault(('name', category.name_category), category)
+
+    for row in rows:
+        category = found.get(row['category'])
+        if category is None:
+            kind, value = row['category']
+            label = f'ID {value}' if kind == 'id' else f'"{value}"'
+            raise CycleError(f'Category {label} not found for {row["name"]} on {row["day"]}.', status_code=404)
+        row['category'] = category
+    return rows
+
+
+def _row_key(day, name):
+    return (day or '').lower(), name.strip().lower()
+
+
+def save_cycle_edit(cycle_name, rows, menu_date):
+    """
+    Bring the live menus of `cycle_name` in line with `rows` (see parse_cycle_rows).
+
+    Rows are matched to existing menus by (day, name), case-insensitively;
+    matched menus that changed are saved with one bulk_update, new rows with
+    one bulk_create (active and linked to the cycle's schools when the cycle
+    is in use) and menus missing from `rows` are soft-deleted with one UPDATE.
+    Returns the cycle's menus in payload order.
+    """
+    from ..models import Menu
+
+    with transaction.atomic():
+        existing = {}
+        for menu in Menu.objects.select_for_update(of=('self',)).filter(
+            cycle_name=cycle_name, is_deleted=False
+        ).select_related('category').order_by('id'):
+            existing.setdefault(_row_key(menu.menu_day, menu.name), []).append(menu)
+        cycle_active = any(menu.is_active for menus in existing.values() for menu in menus)
+        cycle_menu_ids = [menu.id for menus in existing.values() for menu in menus]
+
+        menu_items = resolve_menu_items(row['name'] for row in rows)
+        result, changed, new = [], [], []
+        for row in rows:
+            menu_item = menu_items.get(row['name'].strip().lower())
+            matches = existing.get(_row_key(row['day'], row['name']))
+            if matches:
+                menu = matches.pop(0)
+                if (menu.name, menu.price, menu.category_id, menu.menu_item_id) != \
+                        (row['name'], row['price'], row['category'].id, menu_item and menu_item.id):
+                    menu.name = row['name']
+                    menu.price = row['price']
+                    menu.category = row['category']
+                    menu.menu_item = menu_item
+                    changed.append(menu)
+            else:
+                menu = Menu(
+                    name=row['name'],
+                    price=row['price'],
+                    menu_day=row['day'],
+                    cycle_name=cycle_name,
+                    menu_date=menu_date,
+                    category=row['category'],
+                    menu_item=menu_item,
+                    is_active=cycle_active
+                )
+                new.append(menu)
+            result.append(menu)
+
+        removed = [menu.id for menus in existing.values() for menu in menus]
+
+        if changed:
+            Menu.objects.bulk_update(changed, ['name', 'price', 'category', 'menu_item'], batch_size=500)
+        if new:
+            Menu.objects.bulk_create(new, batch_size=500)
+            # New dishes join the schools the cycle is already active for
+            for school_type in ('primary', 'secondary'):
+                links, school_column = _school_links(school_type)
+                school_ids = set(links.objects.filter(menu_id__in=cycle_menu_ids).values_list(school_column, flat=True))
+                links.objects.bulk_create([
+                    links(menu_id=menu.id, **{school_column: school_id})
+                    for menu in new
+                    for school_id in school_ids
+                ], batch_size=1000, ignore_conflicts=True)
+        if removed:
+            Menu.objects.filter(id__in=removed).update(is_deleted=True)
+
+    if changed or new or removed:
+        invalidate_active_menus(cycle_menu_ids + [menu.id for menu in new])
+    return result
+
+
+def create_cycle_menus(cycle_name, rows, menu_date):
+    """Insert the rows of a new cycle (see parse_cycle_rows) with one bulk_create"""
+    from ..models import Menu
+
+    menu_items = resolve_menu_items(row['name'] for row in rows)
+    return Menu.objects.bulk_create([
+        Menu(
+            name=row['name'],
+            price=row['price'],
+            menu_day=row['day'],
+            cycle_name=cycle_name,
+            menu_date=menu_date,
+            category=row['category'],
+            menu_item=menu_items.get(row['name'].strip().lower())
+        )
+        for row in rows
+    ], batch_size=500)
+
+
+def duplicate_cycle_menus(cycle_name, new_cycle_name, include_source_schools=False):
+    """
+    Copy the live menus of `cycle_name` into `new_cycle_name` with one
+    bulk_create. Copies start inactive and are not linked to any school:
+    is_active lives on the menu, so a copy linked to several schools would go
+    live for all of them, next to their current cycle, as soon as one school
+    activates it. With `include_source_schools` the schools of the originals
+    are returned as [{id, type}] (one UNION query); the caller assigns them by
+    passing that list to activate_cycle_bulk. Returns (menus, schools).
+    """
+    from ..models import Menu
+
+    originals = list(Menu.objects.filter(cycle_name=cycle_name, is_deleted=False).select_related('category').order_by('id'))
+    copies = [
+        Menu(
+            name=menu.name,
+            price=menu.price,
+            menu_day=menu.menu_day,
+            menu_date=menu.menu_date,
+            cycle_name=new_cycle_name,
+            category=menu.category,
+            menu_item_id=menu.menu_item_id
+        )
+        for menu in originals
+    ]
+
+    with transaction.atomic():
+        Menu.objects.bulk_create(copies, batch_size=500)
+
+    schools = []
+    if include_source_schools:
+        schools = [
+            {'id': school_id, 'type': school_type}
+            for school_type, school_id in sorted(linked_schools([menu.id for menu in originals]))
+        ]
+    return copies, schools
+
+
+def _school_lists(menu_ids):
+    """{menu_id: ([primary schools], [secondary schools])} from the link tables, two queries"""
+    schools = {menu_id: ([], []) for menu_id in menu_ids}
+    for index, (school_type, name_field) in enumerate((
+        ('primary', 'primaryschool__school_name'),
+        ('secondary', 'secondaryschool__secondary_school_name'),
+    )):
+        links, school_column = _school_links(school_type)
+        for menu_id, school_id, name in links.objects.filter(menu_id__in=menu_ids).order_by(
+            school_column
+        ).values_list('menu_id', school_column, name_field):
+            schools[menu_id][index].append((school_id, name))
+    return schools
+
+
+def _aggregated_school_columns():
+    """PostgreSQL: per-menu arrays of school ids and names, aggregated in correlated subqueries"""
+    from django.contrib.postgres.aggregates import ArrayAgg
+    from django.db.models import OuterRef, Subquery
+
+    columns = {}
+    for school_type, name_field in (
+        ('primary', 'primaryschool__school_name'),
+        ('secondary', 'secondaryschool__secondary_school_name'),
+    ):
+        links, school_column = _school_links(school_type)
+        per_menu = links.objects.filter(menu_id=OuterRef('pk')).values('menu_id')
+        columns[f'{school_type}_school_ids'] = Subquery(
+            per_menu.annotate(agg=ArrayAgg(school_column, ordering=school_column)).values('agg')
+        )
+        columns[f'{school_type}_school_names'] = Subquery(
+            per_menu.annotate(agg=ArrayAgg(name_field, ordering=school_column)).values('agg')
+        )
+    return columns
+
+
+def list_cycles_with_menus(after=None, limit=20, active_only=False, exclude_deleted=True):
+    """
+    One page of cycles, ordered by name, each with its menus and every menu's
+    school lists. `after` is the last cycle name of the previous page.
+    A fixed number of queries per page: the cycle names, the menus (with their
+    schools aggregated by ArrayAgg on PostgreSQL, or two link-table queries on
+    other backends). Returns (cycles, has_more).
+    """
+    from django.db import connection
+
+    from ..models import Menu
+
+    menus = Menu.objects.all()
+    if active_only:
+        menus = menus.filter(is_active=True)
+    if exclude_deleted:
+        menus = menus.filter(is_deleted=False)
+
+    names = menus
+    if after is not None:
+        names = names.filter(cycle_name__gt=after)
+    names = list(names.order_by('cycle_name').values_list('cycle_name', flat=True).distinct()[:limit + 1])
+    has_more = len(names) > limit
+    names = names[:limit]
+    if not names:
+        return [], False
+
+    fields = ['id', 'cycle_name', 'name', 'category', 'menu_date', 'menu_day', 'price', 'is_active', 'is_deleted']
+    page = menus.filter(cycle_name__in=names).order_by('cycle_name', 'id')
+    if connection.vendor == 'postgresql':
+        columns = _aggregated_school_columns()
+        rows = list(page.annotate(**columns).values(*fields, *columns))
+        for row in rows:
+            row['primary_schools'] = list(zip(row.pop('primary_school_ids') or [], row.pop('primary_school_names') or []))
+            row['secondary_schools'] = list(zip(row.pop('secondary_school_ids') or [], row.pop('secondary_school_names') or []))
+    else:
+        rows = list(page.values(*fields))
+        schools = _school_lists([row['id'] for row in rows])
+        for row in rows:
+            row['primary_schools'], row['secondary_schools'] = schools[row['id']]
+
+    cycles = {name: [] for name in names}
+    for row in rows:
+        row['primary_schools'] = [{'id': i, 'school_name': n} for i, n in row['primary_schools']]
+        row['secondary_schools'] = [{'id': i, 'secondary_school_name': n} for i, n in row['secondary_schools']]
+        cycles[row['cycle_name']].append(row)
+    return [{'cycle_name': name, 'menus': menus} for name, menus in cycles.items()], has_more
@@ -0,0 +1,168 @@
+"""
+Idempotency Helper Functions
+`Idempotency-Key` header support for order and payment endpoints.
+
+The first request with a key claims a row in IdempotencyKey and runs the view;
+its response is stored and replayed to any retry with the same key. A retry
+that arrives while the first request is still running waits for it instead of
+running the view a second time.
+
+A claim is a lease (locked_until): a request that crashed or timed out
+without releasing its key stops blocking retries once the lease runs out,
+and the next retry takes the key over. The lease has to outlast the longest
+a request can run, or a slow request and the retry would both run the view.
+"""
+
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_TTL = timedelta(hours=24)
+IDEMPOTENCY_LEASE = timedelta(minutes=2)
+IDEMPOTENCY_WAIT_SECONDS = 30
+IDEMPOTENCY_POLL_INTERVAL = 0.2
+
+
+def request_fingerprint(request):
+    """Hash of method, path and (canonical JSON) body"""
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(f"{request.method}:{request.path}:{body}".encode()).hexdigest()
+
+
+def _claim(key, endpoint, fingerprint):
+    """
+    Return (record, created). One indexed lookup when the key is already known.
+    An in-progress record of the same request whose lease ran out is taken
+    over (created is then True as well).
+    """
+    from ..models import IdempotencyKey
+
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(key=key, endpoint=endpoint).first()
+    if record and record.expires_at > now:
+        if record.status == 'in_progress' and record.fingerprint == fingerprint and _lease_expired(record, now):
+            locked_until = now + IDEMPOTENCY_LEASE
+            # Conditional update: of several retries racing for the key, one wins
+            if IdempotencyKey.objects.filter(pk=record.pk, locked_until=record.locked_until, status='in_progress').update(
+                locked_until=locked_until
+            ):
+                record.locked_until = locked_until
+                return record, True
+        return record, False
+    if record:
+        record.delete()
+
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                key=key, endpoint=endpoint, fingerprint=fingerprint,
+                expires_at=now + IDEMPOTENCY_TTL, locked_until=now + IDEMPOTENCY_LEASE
+            ), True
+    except IntegrityError:
+        # A concurrent request claimed the key between our lookup and insert
+        return IdempotencyKey.objects.get(key=key, endpoint=endpoint), False
+
+
+def _lease_expired(record, now):
+    # Rows claimed before leases existed have none
+    return record.locked_until is None or record.locked_until <= now
+
+
+def _held(record):
+    """The record, only while this request's lease on it has not been taken over"""
+    from ..models import IdempotencyKey
+
+    return IdempotencyKey.objects.filter(pk=record.pk, locked_until=record.locked_until)
+
+
+def _replay(record, fingerprint, deadline):
+    """
+    Response for a request whose key is already claimed, waiting until
+    `deadline` (time.monotonic()) for it to complete. None if the holder's
+    lease ran out first, so the caller can claim the key.
+    """
+    from ..models import IdempotencyKey
+
+    if record.fingerprint != fingerprint:
+        return Response(
+            {'error': 'Idempotency-Key was already used for a different request.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+
+    while record.status != 'completed':
+        if _lease_expired(record, timezone.now()):
+            return None
+        if time.monotonic() >= deadline:
+            return Response(
+                {'error': 'A request with this Idempotency-Key is still being processed.'},
+                status=status.HTTP_409_CONFLICT
+            )
+        time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+        try:
+            record.refresh_from_db(fields=['status', 'response_status', 'response_body', 'locked_until'])
+        except IdempotencyKey.DoesNotExist:
+            # The first request failed and released the key
+            return Response(
+                {'error': 'The original request failed, please retry.'},
+                status=status.HTTP_409_CONFLICT
+            )
+
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_func=None, *, wait_seconds=None):
+    """
+    Decorator for function views and APIView methods.
+    Requests without an Idempotency-Key header are passed straight through.
+    5xx responses and exceptions release the key so the client can retry.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            request = args[0] if hasattr(args[0], 'META') else args[1]
+            key = request.META.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return func(*args, **kwargs)
+
+            fingerprint = request_fingerprint(request)
+            deadline = time.monotonic() + (wait_seconds or IDEMPOTENCY_WAIT_SECONDS)
+            record, created = _claim(key[:255], request.path, fingerprint)
+            while not created:
+                response = _replay(record, fingerprint, deadline)
+                if response is not None:
+                    return response
+                record, created = _claim(key[:255], request.path, fingerprint)
+
+            try:
+                response = func(*args, **kwargs)
+            except Exception:
+                _held(record).delete()
+                raise
+
+            if response.status_code >= 500:
+                _held(record).delete()
+                return response
+
+            _held(record).update(
+                status='completed',
+                response_status=response.status_code,
+                response_body=json.loads(json.dumps(response.data, cls=DjangoJSONEncoder))
+            )
+            return response
+        return wrapper
+
+    if view_func is not None:
+        return decorator(view_func)
+    return decorator
@@ -0,0 +1,235 @@
+"""
+Credit Ledger Helper Functions
+Append-only ledger behind the `credits` balance of parents, staff and students.
+
+Every balance change is written as integer-cent CreditLedgerEntry rows together
+with their Transaction rows, and the user's `credits` column is moved by one
+conditional F() update in the same database transaction. Concurrent top-ups,
+orders and refunds therefore never overwrite each other, and a debit cannot
+take a balance below zero. CreditBalanceSnapshot rows (taken periodically by
+the snapshot_credit_balances command) keep ledger_balance() a short range scan.
+"""
+
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+
+
+SNAPSHOT_BATCH_SIZE = 500
+
+
+class InsufficientCredits(ValueError):
+    """Raised when a debit would take a balance below zero"""
+
+    def __init__(self, message="Insufficient credits to complete the order."):
+        super().__init__(message)
+
+
+def to_cents(amount):
+    """Euro amount (float, Decimal or str) to integer cents"""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def build_transaction(user, user_type, amount, *, transaction_type, payment_method='credits',
+                      description=None, order=None, payment_intent_id=None):
+    """Unsaved Transaction row for `user`"""
+    from ..models import Transaction
+
+    return Transaction(
+        user_id=user.id,
+        user_type=user_type,
+        transaction_type=transaction_type,
+        payment_method=payment_method,
+        amount=amount,
+        order=order,
+        payment_intent_id=payment_intent_id,
+        description=description,
+        parent=user if user_type == 'parent' else None,
+        staff=user if user_type == 'staff' else None,
+        student=user if user_type == 'student' else None
+    )
+
+
+def _move_balance(user, cents):
+    """
+    Add `cents` to the user's credits with one conditional UPDATE.
+    Debits only match while the balance covers them.
+    """
+    model = type(user)
+    amount = cents / 100
+    rows = model.objects.filter(pk=user.pk)
+    if cents < 0:
+        rows = rows.filter(credits__gte=-amount)
+    if not rows.update(credits=Round(F('credits') + amount, 2)):
+        raise InsufficientCredits()
+    user.credits = model.objects.filter(pk=user.pk).values_list('credits', flat=True).get()
+
+
+def post_transactions(user, user_type, transactions, kind):
+    """
+    Apply unsaved Transaction rows to the user's balance.
+    Each transaction gets one ledger entry of the same (signed) amount; the
+    balance moves once by their sum. Returns the saved transactions.
+    """
+    from ..models import CreditLedgerEntry, Transaction
+
+    cents = [to_cents(t.amount) for t in transactions]
+    with transaction.atomic():
+        _move_balance(user, sum(cents))
+        transactions = Transaction.objects.bulk_create(transactions)
+        CreditLedgerEntry.objects.bulk_create([
+            CreditLedgerEntry(
+                user_id=user.id,
+                user_type=user_type,
+                amount_cents=amount_cents,
+                kind=kind,
+                transaction=t,
+                order_id=t.order_id,
+                description=t.description
+            )
+            for t, amount_cents in zip(transactions, cents)
+        ])
+    return transactions
+
+
+def credit_account(user, user_type, amount, *, kind, description, transaction_type='credit',
+                   payment_method='credits', order=None, payment_intent_id=None):
+    """Add a positive `amount` (euro) to the user's credits. Returns the Transaction."""
+    return post_transactions(user, user_type, [build_transaction(
+        user, user_type, amount,
+        transaction_type=transaction_type,
+        payment_method=payment_method,
+        description=description,
+        order=order,
+        payment_intent_id=payment_intent_id
+    )], kind)[0]
+
+
+def debit_account(user, user_type, amount, *, kind, description, transaction_type='payment',
+                  payment_method='credits', order=None):
+    """
+    Take a positive `amount` (euro) from the user's credits. Returns the Transaction.
+    Raises InsufficientCredits if the balance does not cover it.
+    """
+    return post_transactions(user, user_type, [build_transaction(
+        user, user_type, -Decimal(str(amount)),
+        transaction_type=transaction_type,
+        payment_method=payment_method,
+        description=description,
+        order=order
+    )], kind)[0]
+
+
+def ledger_balance(user_type, user_id):
+    """Balance in cents: latest snapshot plus the entries written after it"""
+    from ..models import CreditBalanceSnapshot, CreditLedgerEntry
+
+    snapshot = CreditBalanceSnapshot.objects.filter(user_type=user_type, user_id=user_id).first()
+    base, after = (snapshot.balance_cents, snapshot.last_entry_id) if snapshot else (0, 0)
+    tail = CreditLedgerEntry.objects.filter(
+        user_type=user_type, user_id=user_id, id__gt=after
+    ).aggregate(total=Sum('amount_cents'))['total'] or 0
+    return base + tail
+
+
+def _account_model(user_type):
+    from ..models import ParentRegisteration, SecondaryStudent, StaffRegisteration
+
+    return {
+        'parent': ParentRegisteration,
+        'staff': StaffRegisteration,
+        'student': SecondaryStudent,
+    }.get(user_type)
+
+
+def _folded_entry_id():
+    """Subquery: last_entry_id of the snapshot of the account in OuterRef user_type/user_id, 0 if none"""
+    from ..models import CreditBalanceSnapshot
+
+    return Coalesce(Subquery(CreditBalanceSnapshot.objects.filter(
+        user_type=OuterRef('user_type'), user_id=OuterRef('user_id')
+    ).values('last_entry_id')), 0)
+
+
+def pending_snapshot_accounts():
+    """
+    (user_type, user_id) of the accounts with entries their own snapshot has
+    not folded, one grouped query over the ledger's account index. There is
+    no global watermark: an entry that commits after higher ids of other
+    accounts were folded is still above its own account's last_entry_id.
+    """
+    from ..models import CreditLedgerEntry
+
+    return CreditLedgerEntry.objects.values('user_type', 'user_id').annotate(
+        last=Max('id')
+    ).filter(last__gt=_folded_entry_id()).values_list('user_type', 'user_id').order_by()
+
+
+def take_balance_snapshots(now=None):
+    """
+    Fold new ledger entries into CreditBalanceSnapshot rows, for every
+    account in pending_snapshot_accounts(), in batches of one user type.
+    Each account is folded under its row lock up to its own last entry at
+    lock time (see _snapshot_accounts). Returns the number of accounts updated.
+    """
+    now = now or timezone.now()
+    accounts = defaultdict(list)
+    for user_type, user_id in pending_snapshot_accounts():
+        accounts[user_type].append(user_id)
+
+    updated = 0
+    for user_type, user_ids in accounts.items():
+        user_ids.sort()
+        for start in range(0, len(user_ids), SNAPSHOT_BATCH_SIZE):
+            updated += _snapshot_accounts(user_type, user_ids[start:start + SNAPSHOT_BATCH_SIZE], now)
+    return updated
+
+
+def _snapshot_accounts(user_type, user_ids, now):
+    """
+    Snapshot `user_ids` in one transaction. Their user rows are locked first:
+    post_transactions updates that row before writing entries and holds it
+    until commit, so while the lock is held none of these accounts has an
+    entry in flight: each account is folded up to its own last entry at lock
+    time, and its later entries get higher ids. Returns the number of
+    accounts updated.
+    """
+    from ..models import CreditBalanceSnapshot, CreditLedgerEntry
+
+    with transaction.atomic():
+        model = _account_model(user_type)
+        if model is not None:
+            list(model.objects.select_for_update().filter(pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+
+        snapshots = {
+            s.user_id: s
+            for s in CreditBalanceSnapshot.objects.select_for_update().filter(user_type=user_type, user_id__in=user_ids)
+        }
+        tails = list(
+            CreditLedgerEntry.objects.filter(
+                user_type=user_type, user_id__in=user_ids, id__gt=_folded_entry_id()
+            ).values('user_id').annotate(delta=Sum('amount_cents'), last=Max('id')).order_by()
+        )
+
+        new = []
+        for row in tails:
+            snapshot = snapshots.get(row['user_id'])
+            if snapshot is None:
+                new.append(CreditBalanceSnapshot(
+                    user_type=user_type, user_id=row['user_id'], balance_cents=row['delta'],
+                    last_entry_id=row['last'], taken_at=now
+                ))
+                continue
+            snapshot.balance_cents += row['delta']
+            snapshot.last_entry_id = row['last']
+            snapshot.taken_at = now
+        CreditBalanceSnapshot.objects.bulk_update(
+            [snapshots[row['user_id']] for row in tails if row['user_id'] in snapshots],
+            ['balance_cents', 'last_entry_id', 'taken_at'], batch_size=500
+        )
+        CreditBalanceSnapshot.objects.bulk_create(new, batch_size=500)
+    return len(tails)
@@ -0,0 +1,301 @@
+"""
+Menu Helper Functions
+Read model behind get_active_menu and manager/school-menus.
+
+The active menu of a school is built in two queries (menus joined to their
+category and Menu.menu_item, then the allergens) and published as a
+MenuSnapshot: both response bodies serialized once, each with a content hash
+served as its ETag. Image URLs are joined onto settings.MENU_IMAGE_BASE_URL,
+never the request's Host, so a school has exactly one snapshot. activate_cycle and deactivate_menus publish the
+school's snapshot straight away; other menu, cycle or menu item changes mark
+the snapshots of the schools linked to the changed menus stale, so those
+schools are republished on their next read.
+
+Marking a snapshot stale also bumps its version, and a publish only stores
+its body if the version it read before building is still current: a read
+that built the menus as they were before a change cannot store them after
+the change was invalidated.
+
+Every read looks the snapshot row up (one indexed query); nothing is kept in
+a per-process cache, so no worker serves a snapshot after it went stale. A
+request whose If-None-Match matches is answered with 304 from that row
+without reading the Menu tables.
+"""
+
+import hashlib
+import json
+import operator
+from functools import reduce
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, Exists, F, OuterRef, Q, Value
+from django.db.models.functions import Lower
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+
+WEEK_DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def invalidate_school_menus(schools):
+    """
+    Mark the published menus of `schools`, (school_type, school_id) pairs,
+    stale in one UPDATE once the current transaction commits: marked any
+    earlier, a concurrent read could republish the menus as they were before
+    the change.
+    """
+    from ..models import MenuSnapshot
+
+    school_ids = {}
+    for school_type, school_id in schools:
+        school_ids.setdefault(school_type, set()).add(school_id)
+    if not school_ids:
+        return
+    snapshots = MenuSnapshot.objects.filter(
+        reduce(operator.or_, (Q(school_type=school_type, school_id__in=ids) for school_type, ids in school_ids.items()))
+    )
+    transaction.on_commit(lambda: snapshots.update(is_stale=True, version=F('version') + 1))
+
+
+def invalidate_active_menus(menu_ids):
+    """
+    Mark stale the published menus of the schools linked to `menu_ids` (ids or a
+    Menu id queryset); called after a menu, cycle or menu item change. Call it
+    while the changed menus are still linked, i.e. before deleting them.
+    """
+    invalidate_school_menus(linked_schools(menu_ids))
+
+
+def _active_menus(school_type, school_id):
+    from ..models import Menu
+
+    if school_type == 'primary':
+        menus = Menu.objects.filter(primary_schools__id=school_id)
+    else:
+        menus = Menu.objects.filter(secondary_schools__id=school_id)
+    return list(
+        menus.filter(is_active=True, is_deleted=False)
+        .select_related('category', 'menu_item')
+        .prefetch_related('menu_item__allergies')
+        .order_by('id')
+    )
+
+
+def resolve_menu_items(names):
+    """
+    MenuItems for each of `names`, keyed by the lower-cased name, in one query.
+    Names matching several items resolve to the oldest one; unknown names are
+    left out.
+    """
+    from ..models import MenuItems
+
+    lower_names = {name.strip().lower() for name in names if name}
+    if not lower_names:
+        return {}
+    items = {}
+    for item in MenuItems.objects.annotate(lower_name=Lower('item_name')).filter(
+        lower_name__in=lower_names
+    ).order_by('-id'):
+        items[item.lower_name] = item
+    return items
+
+
+def _menu_item_data(item):
+    return {
+        "item_name": item.item_name,
+        "item_description": item.item_description,
+        "ingredients": item.ingredients,
+        "nutrients": item.nutrients,
+        "allergies": [allergy.allergy for allergy in item.allergies.all()],
+        "image_url": urljoin(settings.MENU_IMAGE_BASE_URL, item.image.url) if item.image else None
+    }
+
+
+def build_active_menu(school_type, school_id, menus=None):
+    """
+    {"menus": {<day>: [...]}, "cycles": [...]} for the school's active menus.
+    Two queries whatever the number of menus; image URLs are joined onto
+    settings.MENU_IMAGE_BASE_URL.
+    """
+    from ..serializers import MenuSerializer
+
+    if menus is None:
+        menus = _active_menus(school_type, school_id)
+
+    weekly_menu = {day: [] for day in WEEK_DAYS}
+    for instance, menu in zip(menus, MenuSerializer(menus, many=True).data):
+        if menu['menu_day'] in weekly_menu:
+            weekly_menu[menu['menu_day']].append({
+                'id': menu['id'],
+                "name": menu['name'],
+                "price": menu['price'],
+                "menu_date": menu['menu_date'],
+                "cycle_name": menu['cycle_name'],
+                "category": menu.get('category'),
+                "is_active": menu['is_active'],
+                "menu_items": [_menu_item_data(instance.menu_item)] if instance.menu_item else []
+            })
+
+    cycles = list(dict.fromkeys(menu.cycle_name for menu in menus))
+    return {
+        "menus": weekly_menu,
+        "cycles": [{"cycle": cycle} for cycle in cycles]
+    }
+
+
+def _school_links(school_type):
+    """Through model of Menu.<school_type>_schools and its school column"""
+    from ..models import Menu
+
+    if school_type == 'primary':
+        return Menu.primary_schools.through, 'primaryschool_id'
+    return Menu.secondary_schools.through, 'secondaryschool_id'
+
+
+def linked_schools(menu_ids):
+    """(school_type, school_id) of every school linked to `menu_ids`, one UNION query over the link tables"""
+    per_type = []
+    for school_type in ('primary', 'secondary'):
+        links, school_column = _school_links(school_type)
+        per_type.append(links.objects.filter(menu_id__in=menu_ids).values_list(
+            Value(school_type, output_field=CharField()), school_column
+        ))
+    return set(per_type[0].union(per_type[1]))
+
+
+def deactivate_unlinked_menus(menu_ids):
+    """Deactivate those of `menu_ids` no school is linked to any more; returns how many"""
+    from ..models import Menu
+
+    if not menu_ids:
+        return 0
+    primary_links, _ = _school_links('primary')
+    secondary_links, _ = _school_links('secondary')
+    return Menu.objects.filter(id__in=menu_ids, is_active=True).exclude(
+        Exists(primary_links.objects.filter(menu_id=OuterRef('pk')))
+    ).exclude(
+        Exists(secondary_links.objects.filter(menu_id=OuterRef('pk')))
+    ).update(is_active=False)
+
+
+def activate_cycle_for_schools(cycle_name, school_type, school_ids, publish=False):
+    """
+    Make `cycle_name` the active cycle of every school in `school_ids`.
+
+    The schools are unlinked from their other active menus (menus left without
+    any school are deactivated), the cycle's menus are activated and linked to
+    every school, all with set-based statements on the M2M through tables:
+    apart from the batched link insert, the number of queries does not depend
+    on the number of menus or schools. Once the transaction commits, the
+    affected snapshots are marked stale and, with `publish`, the schools'
+    snapshots are republished. Returns the ids of the cycle's menus.
+    """
+    from ..models import Menu
+
+    links, school_column = _school_links(school_type)
+    cycle_menu_ids = list(Menu.objects.filter(cycle_name=cycle_name, is_deleted=False).values_list('id', flat=True))
+
+    with transaction.atomic():
+        previous = links.objects.filter(
+            **{f'{school_column}__in': school_ids}, menu__is_active=True
+        ).exclude(menu_id__in=cycle_menu_ids)
+        previous_menu_ids = set(previous.values_list('menu_id', flat=True))
+        previous.delete()
+
+        deactivate_unlinked_menus(previous_menu_ids)
+
+        Menu.objects.filter(id__in=cycle_menu_ids).update(is_active=True)
+        links.objects.bulk_create([
+            links(menu_id=menu_id, **{school_column: school_id})
+            for menu_id in cycle_menu_ids
+            for school_id in school_ids
+        ], batch_size=1000, ignore_conflicts=True)
+
+    # The schools themselves, and any other school already linked to the cycle
+    invalidate_school_menus(
+        linked_schools(cycle_menu_ids) | {(school_type, school_id) for school_id in school_ids}
+    )
+    if publish:
+        def republish():
+            for school_id in school_ids:
+                publish_menu_snapshot(school_type, school_id)
+
+        transaction.on_commit(republish)
+    return cycle_menu_ids
+
+
+def _serialize(data):
+    body = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+    return body, f'"{hashlib.sha256(body.encode()).hexdigest()}"'
+
+
+def _snapshot_row(school_type, school_id):
+    """The school's MenuSnapshot row, created empty and stale if there is none"""
+    from ..models import MenuSnapshot
+
+    lookup = {'school_type': school_type, 'school_id': school_id}
+    try:
+        with transaction.atomic():
+            snapshot, _ = MenuSnapshot.objects.get_or_create(**lookup, defaults={'is_stale': True})
+    except IntegrityError:
+        # A concurrent reader created it first
+        snapshot = MenuSnapshot.objects.get(**lookup)
+    return snapshot
+
+
+def publish_menu_snapshot(school_type, school_id, snapshot=None):
+    """
+    Build the school's MenuSnapshot and store it, unless the
+    snapshot was marked stale again while it was being built. Returns the
+    snapshot with the freshly built bodies either way.
+    """
+    from ..models import MenuSnapshot
+
+    if snapshot is None:
+        snapshot = _snapshot_row(school_type, school_id)
+    version = snapshot.version
+
+    menus = _active_menus(school_type, school_id)
+    menu_body, menu_etag = _serialize(build_active_menu(school_type, school_id, menus))
+    items_body, items_etag = _serialize({
+        'items': list(dict.fromkeys(menu.name for menu in menus))
+    })
+    values = {
+        'menu_body': menu_body,
+        'menu_etag': menu_etag,
+        'items_body': items_body,
+        'items_etag': items_etag,
+        'published_at': timezone.now()
+    }
+    MenuSnapshot.objects.filter(pk=snapshot.pk, version=version).update(is_stale=False, **values)
+    for field, value in values.items():
+        setattr(snapshot, field, value)
+    return snapshot
+
+
+def get_menu_snapshot(school_type, school_id):
+    """The school's MenuSnapshot (one indexed query), published first if it is missing or stale"""
+    from ..models import MenuSnapshot
+
+    snapshot = MenuSnapshot.objects.filter(school_type=school_type, school_id=school_id).first()
+    if snapshot is None or snapshot.is_stale:
+        return publish_menu_snapshot(school_type, school_id, snapshot)
+    return snapshot
+
+
+def snapshot_response(request, body, etag):
+    """200 with the pre-serialized body, or 304 when the client already has it"""
+    etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if '*' in etags or etag in etags or f'W/{etag}' in etags:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+
+    response['ETag'] = etag
+    patch_cache_control(response, max_age=settings.MENU_SNAPSHOT_MAX_AGE, must_revalidate=True)
+    return response
@@ -0,0 +1,146 @@
+"""
+Order Export Helper Functions
+Streaming NDJSON/CSV export behind orders/export/ and the export_orders command.
+
+Orders are read with .iterator(chunk_size=...), a server-side cursor on
+PostgreSQL, and their items are prefetched one chunk at a time, so memory
+holds a single chunk whatever the size of the export. Every writer is a
+generator of text lines, ready for StreamingHttpResponse or a file.
+"""
+
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.utils.dateparse import parse_date
+
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+CSV_COLUMNS = [
+    'order_id', 'order_date', 'delivery_date', 'selected_day', 'week_number', 'year', 'status', 'is_delivered',
+    'user_type', 'user_id', 'child_id', 'user_name', 'school_type', 'school_id', 'school_name', 'total_price',
+    'payment_id', 'item_name', 'item_price', 'quantity',
+]
+
+
+def export_filters(params):
+    """
+    Filters of an export from request params or command options: date_from and
+    date_to (YYYY-MM-DD, inclusive, on the delivery date), school_id +
+    school_type. Raises ValueError if one is malformed.
+    """
+    filters = {}
+    for name in ('date_from', 'date_to'):
+        if params.get(name):
+            value = parse_date(str(params[name]))
+            if value is None:
+                raise ValueError(f'{name} must be a date (YYYY-MM-DD).')
+            filters[name] = value
+    if 'date_from' in filters and 'date_to' in filters and filters['date_from'] > filters['date_to']:
+        raise ValueError('date_from must not be after date_to.')
+
+    school_id, school_type = params.get('school_id'), params.get('school_type')
+    if school_id or school_type:
+        if school_type not in ('primary', 'secondary') or not school_id:
+            raise ValueError('school_id and school_type ("primary" or "secondary") must be given together.')
+        try:
+            filters['school_id'] = int(school_id)
+        except ValueError:
+            raise ValueError('school_id must be a number.')
+        filters['school_type'] = school_type
+    return filters
+
+
+def export_queryset(filters):
+    """Orders matching `filters` (see export_filters) in id order, schools joined, items prefetched"""
+    from ..models import Order, OrderItem
+
+    orders = Order.objects.all()
+    if 'date_from' in filters:
+        orders = orders.filter(delivery_date__gte=filters['date_from'])
+    if 'date_to' in filters:
+        orders = orders.filter(delivery_date__lte=filters['date_to'])
+    if 'school_type' in filters:
+        orders = orders.filter(**{f"{filters['school_type']}_school_id": filters['school_id']})
+
+    return orders.select_related('primary_school', 'secondary_school').prefetch_related(
+        Prefetch('order_items', queryset=OrderItem.objects.select_related('menu').order_by('id'))
+    ).order_by('id')
+
+
+def _order_record(order):
+    if order.primary_school:
+        school = ('primary', order.primary_school.id, order.primary_school.school_name)
+    elif order.secondary_school:
+        school = ('secondary', order.secondary_school.id, order.secondary_school.secondary_school_name)
+    else:
+        school = (None, None, None)
+
+    return {
+        'order_id': order.id,
+        'order_date': order.order_date,
+        'delivery_date': order.delivery_date,
+        'selected_day': order.selected_day,
+        'week_number': order.week_number,
+        'year': order.year,
+        'status': order.status,
+        'is_delivered': order.is_delivered,
+        'user_type': order.user_type,
+        'user_id': order.user_id,
+        'child_id': order.child_id,
+        'user_name': order.user_name,
+        'school_type': school[0],
+        'school_id': school[1],
+        'school_name': school[2],
+        'total_price': order.total_price,
+        'payment_id': order.payment_id,
+        'items': [
+            {
+                'item_name': item.menu_name,
+                'item_price': item.menu_price,
+                'quantity': item.quantity
+            }
+            for item in order.order_items.all()
+        ],
+    }
+
+
+def _records(queryset, chunk_size):
+    for order in queryset.iterator(chunk_size=chunk_size):
+        yield _order_record(order)
+
+
+def ndjson_lines(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """One JSON object per order (items nested), newline-terminated"""
+    for record in _records(queryset, chunk_size):
+        yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """A header, then one row per order item (orders without items get one row with empty item columns)"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for record in _records(queryset, chunk_size):
+        items = record.pop('items') or [{'item_name': None, 'item_price': None, 'quantity': None}]
+        for item in items:
+            row = {**record, **item}
+            yield writer.writerow([
+                row[column].isoformat() if hasattr(row[column], 'isoformat') else row[column]
+                for column in CSV_COLUMNS
+            ])
+
+
+def export_lines(filters, export_format, chunk_size=EXPORT_CHUNK_SIZE):
+    """Lines of the export of the orders matching `filters` in `export_format` ('ndjson' or 'csv')"""
+    writer = ndjson_lines if export_format == 'ndjson' else csv_lines
+    return writer(export_queryset(filters), chunk_size=chunk_size)
@@ -0,0 +1,411 @@
+"""
+Order Helper Functions
+Read model behind get_all_orders, get_orders_by_school, get_orders_by_user and
+get_order_by_id.
+
+Orders are loaded with their schools joined and their items prefetched (menu
+joined); manager orders with their manager joined, their items prefetched and
+total_production_price summed by the database. School names of manager orders
+are looked up with one query per school type. Whatever the number of orders,
+a listing costs a fixed number of queries.
+
+get_all_orders pages through orders and manager orders as one stream, newest
+first, keyed on (order_date, source, id). A manager order has only a date and
+sorts at local midnight of that date. The optional total is a cached count
+and may be up to ORDER_COUNT_CACHE_TIMEOUT seconds old.
+
+orders/sync/ sends a user's orders changed (Order.updated_at) since a sync
+token, plus the ids of orders deleted since (OrderTombstone, written by
+delete_orders). The token is the server time of the previous sync; changes
+are re-read from ORDER_SYNC_OVERLAP before it so rows committed late by a
+concurrent transaction are not missed. Clients apply rows as upserts.
+Tombstones are purged after ORDER_TOMBSTONE_RETENTION (purge_idempotency_keys
+cron); a token older than that gets a full sync with full_resync set, and the
+client replaces its copy instead of applying a delta.
+"""
+
+import hashlib
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, Prefetch, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from django.utils.timezone import is_aware, localtime, make_aware
+
+from .pagination import decode_cursor, encode_cursor
+
+
+ORDER_COUNT_CACHE_TIMEOUT = 60 * 5
+ORDER_COUNT_CACHE_PREFIX = 'orders:count'
+
+# Sources of the merged stream; on equal order_date orders come before manager orders
+ORDER_SOURCE = 'order'
+MANAGER_SOURCE = 'manager'
+
+ORDER_SYNC_OVERLAP = timedelta(seconds=30)
+ORDER_TOMBSTONE_RETENTION = timedelta(days=90)
+
+
+def _local_date(value):
+    """Local calendar date of an order_date (a datetime for Order, a date for ManagerOrder)"""
+    if hasattr(value, 'tzinfo'):
+        return localtime(value).date() if value.tzinfo else value.date()
+    return value
+
+
+def _format_date(value):
+    return _local_date(value).strftime('%d %B, %Y') if value else None
+
+
+def order_queryset():
+    """Orders with schools joined and items (with their menu) prefetched"""
+    from ..models import Order, OrderItem
+
+    return Order.objects.select_related('primary_school', 'secondary_school').prefetch_related(
+        Prefetch('order_items', queryset=OrderItem.objects.select_related('menu').order_by('id'))
+    )
+
+
+def manager_order_queryset():
+    """Manager orders with the manager joined, items prefetched and `production_total` annotated"""
+    from ..models import ManagerOrder, ManagerOrderItem
+
+    return ManagerOrder.objects.select_related('manager').annotate(
+        production_total=Coalesce(
+            Sum('items__production_price'),
+            Value(0, output_field=DecimalField(max_digits=12, decimal_places=2))
+        )
+    ).prefetch_related(
+        Prefetch('items', queryset=ManagerOrderItem.objects.order_by('id'))
+    )
+
+
+def load_manager_orders(queryset):
+    """
+    Evaluate a manager_order_queryset(), setting `school_name` on every order.
+    School names come from one query per school type referenced.
+    """
+    from ..models import PrimarySchool, SecondarySchool
+
+    manager_orders = list(queryset)
+    school_ids = {'primary': set(), 'secondary': set()}
+    for m_order in manager_orders:
+        if not m_order.custom_school_name and m_order.school_type in school_ids and m_order.school_id:
+            school_ids[m_order.school_type].add(m_order.school_id)
+
+    names = {}
+    if school_ids['primary']:
+        for school_id, name in PrimarySchool.objects.filter(id__in=school_ids['primary']).values_list('id', 'school_name'):
+            names['primary', school_id] = name
+    if school_ids['secondary']:
+        for school_id, name in SecondarySchool.objects.filter(
+            id__in=school_ids['secondary']
+        ).values_list('id', 'secondary_school_name'):
+            names['secondary', school_id] = name
+
+    for m_order in manager_orders:
+        m_order.school_name = m_order.custom_school_name or names.get((m_order.school_type, m_order.school_id))
+    return manager_orders
+
+
+def order_data(order):
+    """Response dict of an order loaded through order_queryset()"""
+    local_date = _local_date(order.order_date)
+    data = {
+        'order_id': order.id,
+        'selected_day': order.selected_day,
+        'total_price': order.total_price,
+        'order_date': _format_date(order.order_date),
+        'order_date_raw': str(local_date),
+        'status': order.status,
+        'week_number': order.week_number,
+        'year': order.year,
+        'items': [
+            {
+                'item_name': item.menu_name,
+                'item_price': item.menu_price,
+                'quantity': item.quantity
+            }
+            for item in order.order_items.all()
+        ],
+        'user_name': order.user_name,
+        'user_type': order.user_type,
+    }
+
+    if order.primary_school:
+        data['school_id'] = order.primary_school.id
+        data['school_name'] = order.primary_school.school_name
+        data['school_type'] = 'primary'
+    elif order.secondary_school:
+        data['school_id'] = order.secondary_school.id
+        data['school_name'] = order.secondary_school.secondary_school_name
+        data['school_type'] = 'secondary'
+
+    if order.user_type in ['parent', 'staff']:
+        data['child_id'] = order.child_id
+    return data
+
+
+def manager_order_data(m_order):
+    """Response dict of a manager order loaded through load_manager_orders()"""
+    if m_order.manager:
+        manager_name = m_order.manager.username
+    else:
+        manager_name = m_order.manager_name or 'Unknown'
+
+    data = {
+        'order_id': f"m_{m_order.id}",
+        'selected_day': m_order.selected_day,
+        'total_production_price': m_order.production_total,
+        'order_date': _format_date(m_order.order_date),
+        'order_date_raw': str(_local_date(m_order.order_date)) if m_order.order_date else None,
+        'status': m_order.status,
+        'week_number': m_order.week_number,
+        'year': m_order.year,
+        'is_delivered': m_order.is_delivered,
+        'manager_name': manager_name,
+        'user_name': manager_name,
+        'user_type': 'manager',
+        'items': [
+            {
+                'day': item.day,
+                'item': item.item,
+                'quantity': item.quantity,
+                'production_price': item.production_price or 0
+            }
+            for item in m_order.items.all()
+        ],
+    }
+
+    if m_order.school_type in ('primary', 'secondary') and m_order.school_id:
+        data['school_id'] = m_order.school_id
+        data['school_type'] = m_order.school_type
+    if m_order.school_name:
+        data['school_name'] = m_order.school_name
+    return data
+
+
+def order_filters(params):
+    """
+    Filters of the order listing from query params: school_id + school_type,
+    status, week, year, user_type, day. Raises ValueError if one is malformed.
+    """
+    filters = {}
+    school_id, school_type = params.get('school_id'), params.get('school_type')
+    if school_id or school_type:
+        if school_type not in ('primary', 'secondary') or not school_id:
+            raise ValueError('school_id and school_type ("primary" or "secondary") must be given together.')
+        filters['school_type'] = school_type
+        filters['school_id'] = int(school_id)
+    for name in ('week', 'year'):
+        if params.get(name):
+            filters[name] = int(params[name])
+    for name in ('status', 'user_type', 'day'):
+        if params.get(name):
+            filters[name] = params[name]
+    return filters
+
+
+def _filtered_streams(filters, orders, manager_orders):
+    """
+    The `orders` and `manager_orders` querysets narrowed to `filters`. Orders
+    awaiting payment are left out unless asked for by status.
+    """
+    from .checkout import AWAITING_PAYMENT
+
+    # Rows without a date have no place in the stream; the create view always sets one
+    manager_orders = manager_orders.filter(order_date__isnull=False)
+
+    user_type = filters.get('user_type')
+    if user_type == 'manager':
+        orders = orders.none()
+    elif user_type:
+        orders = orders.filter(user_type=user_type)
+        manager_orders = manager_orders.none()
+
+    if 'school_type' in filters:
+        orders = orders.filter(**{f"{filters['school_type']}_school_id": filters['school_id']})
+        manager_orders = manager_orders.filter(school_type=filters['school_type'], school_id=filters['school_id'])
+
+    common = {}
+    if 'status' in filters:
+        common['status'] = filters['status']
+    else:
+        orders = orders.exclude(status=AWAITING_PAYMENT)
+    if 'week' in filters:
+        common['week_number'] = filters['week']
+    if 'year' in filters:
+        common['year'] = filters['year']
+    if 'day' in filters:
+        common['selected_day__iexact'] = filters['day']
+    return orders.filter(**common), manager_orders.filter(**common)
+
+
+def _manager_sort_at(day):
+    return make_aware(datetime.combine(day, time.min))
+
+
+def _sort_key(row):
+    if row.source == ORDER_SOURCE:
+        return row.order_date, ORDER_SOURCE, row.id
+    return _manager_sort_at(row.order_date), MANAGER_SOURCE, row.id
+
+
+def _parse_cursor(token):
+    sort_at, source, pk = decode_cursor(token, 3)
+    sort_at = parse_datetime(sort_at) if isinstance(sort_at, str) else None
+    if sort_at is None or not is_aware(sort_at) or source not in (ORDER_SOURCE, MANAGER_SOURCE) \
+            or not isinstance(pk, int):
+        raise ValueError('Invalid cursor.')
+    return sort_at, source, pk
+
+
+def _orders_after(sort_at, source, pk):
+    """Orders whose key sorts below the cursor key (sort_at, source, pk)"""
+    after = Q(order_date__lt=sort_at)
+    if source == ORDER_SOURCE:
+        after |= Q(order_date=sort_at, id__lt=pk)
+    return after
+
+
+def _manager_orders_after(sort_at, source, pk):
+    """Manager orders whose key (local midnight of order_date, ...) sorts below the cursor key"""
+    day = localtime(sort_at).date()
+    if _manager_sort_at(day) != sort_at or source == ORDER_SOURCE:
+        return Q(order_date__lte=day)
+    return Q(order_date__lt=day) | Q(order_date=day, id__lt=pk)
+
+
+def list_orders(filters, cursor=None, limit=20):
+    """
+    One page of the merged order stream, newest first: (rows, next_cursor).
+    Rows are order_data()/manager_order_data() dicts (orders also carry
+    payment_id). Each source is read with one keyset query of `limit + 1`
+    rows, so the query count is fixed and deep pages cost the same as the
+    first. Raises ValueError for a malformed cursor.
+    """
+    orders, manager_orders = _filtered_streams(filters, order_queryset(), manager_order_queryset())
+    if cursor:
+        after = _parse_cursor(cursor)
+        orders = orders.filter(_orders_after(*after))
+        manager_orders = manager_orders.filter(_manager_orders_after(*after))
+
+    candidates = list(orders.order_by('-order_date', '-id')[:limit + 1])
+    for order in candidates:
+        order.source = ORDER_SOURCE
+    manager_candidates = load_manager_orders(manager_orders.order_by('-order_date', '-id')[:limit + 1])
+    for m_order in manager_candidates:
+        m_order.source = MANAGER_SOURCE
+
+    merged = sorted(candidates + manager_candidates, key=_sort_key, reverse=True)
+    page = merged[:limit]
+    rows = [
+        dict(order_data(row), payment_id=row.payment_id) if row.source == ORDER_SOURCE else manager_order_data(row)
+        for row in page
+    ]
+
+    next_cursor = None
+    if len(merged) > limit:
+        sort_at, source, pk = _sort_key(page[-1])
+        next_cursor = encode_cursor([sort_at.isoformat(), source, pk])
+    return rows, next_cursor
+
+
+def approximate_order_total(filters):
+    """Number of rows in the stream for `filters`, counted at most every ORDER_COUNT_CACHE_TIMEOUT seconds"""
+    digest = hashlib.sha256(json.dumps(sorted(filters.items())).encode()).hexdigest()
+    key = f'{ORDER_COUNT_CACHE_PREFIX}:{digest}'
+    total = cache.get(key)
+    if total is None:
+        from ..models import ManagerOrder, Order
+
+        orders, manager_orders = _filtered_streams(filters, Order.objects.all(), ManagerOrder.objects.all())
+        total = orders.count() + manager_orders.count()
+        cache.set(key, total, ORDER_COUNT_CACHE_TIMEOUT)
+    return total
+
+
+def delete_orders(queryset):
+    """Delete the orders of `queryset`, leaving a tombstone for each; returns how many were deleted"""
+    from ..models import OrderTombstone
+
+    with transaction.atomic():
+        # Locked, so a concurrent update cannot change a row between the read and the delete
+        rows = list(queryset.select_for_update().values_list('id', 'user_id', 'user_type', 'child_id'))
+        if not rows:
+            return 0
+        now = timezone.now()
+        OrderTombstone.objects.bulk_create([
+            OrderTombstone(order_id=order_id, user_id=user_id, user_type=user_type, child_id=child_id, deleted_at=now)
+            for order_id, user_id, user_type, child_id in rows
+        ], batch_size=1000)
+        queryset.model.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
+
+
+def expired_tombstones(now=None):
+    """OrderTombstones past ORDER_TOMBSTONE_RETENTION, which no sync token still needs"""
+    from ..models import OrderTombstone
+
+    cutoff = (now or timezone.now()) - ORDER_TOMBSTONE_RETENTION
+    return OrderTombstone.objects.filter(deleted_at__lt=cutoff)
+
+
+def order_sync_scope(params):
+    """
+    Filter kwargs (for Order and OrderTombstone) of the orders a client syncs:
+    a staff member's child with user_type=staff and child_id, else the user's
+    own orders. Raises ValueError when the params do not name one.
+    """
+    user_type = params.get('user_type')
+    if user_type not in ('student', 'parent', 'staff'):
+        raise ValueError('user_type must be student, parent or staff.')
+    user_id, child_id = params.get('user_id'), params.get('child_id')
+    if not (user_id or (user_type == 'staff' and child_id)):
+        raise ValueError('user_id is required.')
+    try:
+        if user_type == 'staff' and child_id:
+            return {'child_id': int(child_id)}
+        return {'user_id': int(user_id), 'user_type': user_type}
+    except ValueError:
+        raise ValueError('user_id and child_id must be numbers.')
+
+
+def order_changes(scope, since=None):
+    """
+    (changed orders as order_data() dicts, deleted order ids, next sync token,
+    full_resync) for `scope` (see order_sync_scope) since the sync token
+    `since`. Without a token, or with one older than the tombstones kept,
+    every order is sent and full_resync is True. Three queries. Raises
+    ValueError for a malformed token.
+    """
+    from ..models import OrderTombstone
+
+    synced_at = timezone.now()
+    orders = order_queryset().filter(**scope)
+    tombstones = OrderTombstone.objects.filter(**scope)
+    full_resync = True
+    if since:
+        try:
+            since_at = decode_cursor(since, 1)[0]
+            since_at = parse_datetime(since_at) if isinstance(since_at, str) else None
+        except ValueError:
+            since_at = None
+        if since_at is None or not is_aware(since_at):
+            raise ValueError('Invalid sync token.')
+        changed_from = since_at - ORDER_SYNC_OVERLAP
+        # Deletions before the retention window may have been purged
+        full_resync = changed_from < synced_at - ORDER_TOMBSTONE_RETENTION
+        if not full_resync:
+            orders = orders.filter(updated_at__gte=changed_from)
+            tombstones = tombstones.filter(deleted_at__gte=changed_from)
+    if full_resync:
+        tombstones = tombstones.none()
+
+    changed = [order_data(order) for order in orders.order_by('-order_date', '-id')]
+    deleted = list(tombstones.order_by('order_id').values_list('order_id', flat=True).distinct())
+    return changed, deleted, encode_cursor([synced_at.isoformat()]), full_resync
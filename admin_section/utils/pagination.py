@@ -0,0 +1,42 @@
+"""
+Pagination Helper Functions
+Opaque cursors for keyset pagination.
+
+A cursor is the sort key of the last row of a page (a list of JSON values),
+encoded as URL-safe base64 so clients pass it back unchanged.
+"""
+
+import base64
+import binascii
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(values):
+    """Cursor token for the sort key `values`"""
+    raw = json.dumps(list(values), cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, length):
+    """Sort key of a cursor token; raises ValueError for anything malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError('Invalid cursor.')
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError('Invalid cursor.')
+    return values
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """`limit` query parameter clamped to 1..maximum; raises ValueError if not a number"""
+    if value in (None, ''):
+        return default
+    return max(1, min(int(value), maximum))
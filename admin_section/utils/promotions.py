@@ -0,0 +1,438 @@
+"""
+Promotion Helper Functions
+Batched promotion evaluation for checkout.
+
+Active promotions are cached per day; the user's redemptions and the user's
+PromotionProgress counters are each loaded with one query, whatever the
+number of live promotions. Everything else is evaluated in memory, and
+max_redemptions is enforced by a conditional UPDATE of Promotion.redeemed_count.
+
+Checkout does not evaluate promotions itself: it queues a PromotionEvaluation
+row and the evaluation runs on a small thread pool once the order transaction
+has committed. The response carries the user's last known pending promotions;
+the app fetches the outcome from promotions/evaluations/<id>/.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+from django.db.models import Case, Count, Exists, F, IntegerField, OuterRef, Q, Value, When
+
+from .ledger import credit_account
+from .user_names import _get_user_model
+
+
+logger = logging.getLogger(__name__)
+
+# Keys change at midnight and on every promotion edit (version bump); the
+# timeout bounds how long another worker process with its own cache can keep
+# serving promotions edited through the API.
+ACTIVE_PROMOTIONS_CACHE_TIMEOUT = 60 * 10
+ACTIVE_PROMOTIONS_CACHE_PREFIX = 'promotions:active'
+ACTIVE_PROMOTIONS_VERSION_KEY = 'promotions:active:version'
+
+PENDING_PROMOTIONS_CACHE_TIMEOUT = 60 * 60 * 24
+PENDING_PROMOTIONS_CACHE_PREFIX = 'promotions:pending'
+
+# Evaluations still pending after this many attempts are marked failed
+MAX_EVALUATION_ATTEMPTS = 5
+
+_executor = None
+
+
+def _active_cache_key(today, school_id, school_type):
+    version = cache.get_or_set(ACTIVE_PROMOTIONS_VERSION_KEY, 1, None)
+    return f'{ACTIVE_PROMOTIONS_CACHE_PREFIX}:{version}:{today.isoformat()}:{school_type}:{school_id}'
+
+
+def get_active_promotions(today=None, school_id=None, school_type=None):
+    """
+    Promotions running today that apply to the school, from the cache when
+    possible. Promotions with an empty `schools` list apply to every school;
+    targeted ones only match a school that still has a PromotionSchool row,
+    so one whose schools were all deleted matches none.
+    """
+    from ..models import Promotion, PromotionSchool
+
+    today = today or date.today()
+    key = _active_cache_key(today, school_id, school_type)
+    promotions = cache.get(key)
+    if promotions is None:
+        targets = PromotionSchool.objects.filter(promotion=OuterRef('pk'))
+        applies = Q(schools=[])
+        if school_id is not None and school_type == 'primary':
+            applies |= Exists(targets.filter(primary_school_id=school_id))
+        elif school_id is not None and school_type == 'secondary':
+            applies |= Exists(targets.filter(secondary_school_id=school_id))
+
+        promotions = list(Promotion.objects.filter(
+            applies,
+            is_active=True,
+            start_date__lte=today,
+            end_date__gte=today
+        ).order_by('id'))
+        cache.set(key, promotions, ACTIVE_PROMOTIONS_CACHE_TIMEOUT)
+    return promotions
+
+
+def invalidate_active_promotions():
+    """Drop the cached active promotions after a promotion is created, edited or deleted"""
+    try:
+        cache.incr(ACTIVE_PROMOTIONS_VERSION_KEY)
+    except ValueError:
+        cache.set(ACTIVE_PROMOTIONS_VERSION_KEY, 2, None)
+
+
+def sync_promotion_schools(promotion):
+    """
+    Rewrite a promotion's PromotionSchool rows from its `schools` JSON
+    ([{"id": 1, "type": "primary"}, ...]). Unknown schools are ignored.
+    """
+    from ..models import PrimarySchool, PromotionSchool, SecondarySchool
+
+    wanted = {'primary': set(), 'secondary': set()}
+    for school in promotion.schools or []:
+        try:
+            wanted[school.get('type')].add(int(school.get('id')))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            continue
+
+    with transaction.atomic():
+        PromotionSchool.objects.filter(promotion=promotion).delete()
+        PromotionSchool.objects.bulk_create(
+            [PromotionSchool(promotion=promotion, primary_school_id=school_id)
+             for school_id in PrimarySchool.objects.filter(id__in=wanted['primary']).values_list('id', flat=True)]
+            + [PromotionSchool(promotion=promotion, secondary_school_id=school_id)
+               for school_id in SecondarySchool.objects.filter(id__in=wanted['secondary']).values_list('id', flat=True)]
+        )
+
+
+def _progress_counts(user_type, user_id, promotions):
+    """Orders counted towards each promotion, from PromotionProgress in one query"""
+    from ..models import PromotionProgress
+
+    if not promotions:
+        return {}
+    counts = dict(PromotionProgress.objects.filter(
+        user_type=user_type,
+        user_id=user_id,
+        promotion_id__in=[p.id for p in promotions]
+    ).values_list('promotion_id', 'order_count'))
+    return {p.id: counts.get(p.id, 0) for p in promotions}
+
+
+def _pending_entry(promotion, orders_placed):
+    return {
+        'promotion_name': promotion.name,
+        'credit_reward': float(promotion.credit_reward),
+        'orders_remaining': max(promotion.min_order_count - orders_placed, 0),
+        'orders_placed': orders_placed,
+        'min_order_count': promotion.min_order_count,
+        'promotion_ends': str(promotion.end_date),
+    }
+
+
+def redeem_promotion(promotion, user_id, user_type):
+    """
+    Record a redemption if the promotion still has room.
+    The counter is claimed with a conditional UPDATE, so concurrent checkouts
+    cannot push a capped promotion past max_redemptions. Returns False when the
+    cap is reached or the user already redeemed it. Call inside a transaction.
+    """
+    from ..models import Promotion, UserPromotion
+
+    claimed = Promotion.objects.filter(
+        Q(max_redemptions__isnull=True) | Q(redeemed_count__lt=F('max_redemptions')),
+        pk=promotion.pk
+    ).update(redeemed_count=F('redeemed_count') + 1)
+    if not claimed:
+        return False
+
+    try:
+        with transaction.atomic():
+            UserPromotion.objects.create(promotion=promotion, user_id=user_id, user_type=user_type)
+    except IntegrityError:
+        Promotion.objects.filter(pk=promotion.pk).update(redeemed_count=F('redeemed_count') - 1)
+        return False
+    return True
+
+
+def check_and_apply_promotions(user, user_type, school_id=None, school_type=None, current_order_total=0):
+    """
+    Check if user qualifies for any active promotions.
+    - min_order_count is checked against orders placed within the promotion's date range.
+    - spending_threshold is checked against the current order total only.
+    Returns:
+      - rewards: list of awarded promotions
+      - pending: list of promotions user hasn't qualified for yet, with orders_remaining
+    """
+    from ..models import UserPromotion
+
+    promotions = get_active_promotions(school_id=school_id, school_type=school_type)
+    if not promotions:
+        return [], []
+
+    received = set(UserPromotion.objects.filter(
+        promotion_id__in=[p.id for p in promotions],
+        user_id=user.id,
+        user_type=user_type
+    ).values_list('promotion_id', flat=True))
+
+    candidates = [p for p in promotions if p.id not in received]
+    # The cached counters may lag behind; redeem_promotion() has the final say
+    candidates = [
+        p for p in candidates
+        if p.max_redemptions is None or p.redeemed_count < p.max_redemptions
+    ]
+    order_counts = _progress_counts(user_type, user.id, [p for p in candidates if p.min_order_count is not None])
+
+    rewards = []
+    pending_promotions = []
+
+    for promotion in candidates:
+        # ── Min order count within promotion date range ──
+        if promotion.min_order_count is not None:
+            orders_in_range = order_counts[promotion.id]
+            if orders_in_range < promotion.min_order_count:
+                pending_promotions.append(_pending_entry(promotion, orders_in_range))
+                continue
+
+        # ── Spending threshold — checked against current order total only ──
+        if promotion.spending_threshold is not None:
+            if float(current_order_total) < float(promotion.spending_threshold):
+                continue
+
+        # ── All conditions passed — award credits ──
+        with transaction.atomic():
+            if not redeem_promotion(promotion, user.id, user_type):
+                continue
+            credit_account(
+                user, user_type, float(promotion.credit_reward),
+                kind='promotion',
+                description=f"Promotion reward: {promotion.name}"
+            )
+        logger.info("Promotion %s awarded to %s %s", promotion.id, user_type, user.id)
+
+        rewards.append({
+            'promotion_name': promotion.name,
+            'credit_reward': float(promotion.credit_reward),
+        })
+
+    return rewards, pending_promotions
+
+
+# ------------------------------
+# Progress counters
+# ------------------------------
+def _counts_towards(order, promotion):
+    return (
+        promotion.start_date <= order.delivery_date <= promotion.end_date
+        and not (promotion.exclude_primary_orders and order.primary_school_id)
+    )
+
+
+def record_order_progress(orders, delta=1):
+    """
+    Move the PromotionProgress counters of one user's orders by `delta` per
+    order (+1 when placed, -1 when cancelled). Three queries whatever the
+    number of orders or promotions.
+    """
+    from ..models import Promotion, PromotionProgress
+
+    orders = [order for order in orders if order.delivery_date]
+    if not orders:
+        return
+    user_type, user_id = orders[0].user_type, orders[0].user_id
+    dates = [order.delivery_date for order in orders]
+
+    changes = {}
+    for promotion in Promotion.objects.filter(is_active=True, start_date__lte=max(dates), end_date__gte=min(dates)):
+        counted = sum(1 for order in orders if _counts_towards(order, promotion))
+        if counted:
+            changes[promotion.id] = counted * delta
+    if not changes:
+        return
+
+    PromotionProgress.objects.bulk_create([
+        PromotionProgress(promotion_id=promotion_id, user_type=user_type, user_id=user_id)
+        for promotion_id in changes
+    ], ignore_conflicts=True)
+    PromotionProgress.objects.filter(
+        user_type=user_type, user_id=user_id, promotion_id__in=changes
+    ).update(order_count=F('order_count') + Case(
+        *[When(promotion_id=promotion_id, then=Value(change)) for promotion_id, change in changes.items()],
+        output_field=IntegerField()
+    ))
+
+
+def rebuild_promotion_progress(promotion):
+    """
+    Recount a promotion's progress rows from the orders table.
+    Run when a promotion is created or edited (dates, exclusions and
+    activation all change which orders count).
+
+    Checkouts move the same rows with F() updates while this runs, so rows of
+    an active promotion are overwritten under a lock, never deleted: missing
+    rows are created first, then every row is locked before the orders are
+    counted. A checkout that already moved its row has committed by the time
+    the lock is granted, so its order is in the count; one that has not waits
+    for this transaction and adds its order on top.
+    """
+    from ..models import Order, PromotionProgress
+    from .checkout import UNPLACED_STATUSES
+
+    with transaction.atomic():
+        if not promotion.is_active:
+            PromotionProgress.objects.filter(promotion=promotion).delete()
+            return
+
+        orders = Order.objects.filter(
+            delivery_date__gte=promotion.start_date,
+            delivery_date__lte=promotion.end_date
+        ).exclude(status__in=UNPLACED_STATUSES)
+        if promotion.exclude_primary_orders:
+            orders = orders.filter(primary_school__isnull=True)
+
+        # Orders committed after this read come from checkouts, which create their own rows
+        PromotionProgress.objects.bulk_create([
+            PromotionProgress(promotion=promotion, user_type=user_type, user_id=user_id)
+            for user_type, user_id in orders.values_list('user_type', 'user_id').distinct().order_by()
+        ], ignore_conflicts=True, batch_size=1000)
+        rows = {
+            (row.user_type, row.user_id): row
+            for row in PromotionProgress.objects.select_for_update().filter(promotion=promotion).order_by('pk')
+        }
+        counts = {
+            (row['user_type'], row['user_id']): row['total']
+            for row in orders.values('user_type', 'user_id').annotate(total=Count('id')).order_by()
+        }
+
+        for account, row in rows.items():
+            row.order_count = counts.get(account, 0)
+        PromotionProgress.objects.bulk_update(rows.values(), ['order_count'], batch_size=1000)
+
+
+def promotion_progress(user_type, user_id, school_id=None, school_type=None):
+    """
+    Progress towards every running min_order_count promotion the user can
+    still earn: one read of PromotionProgress plus the user's redemptions.
+    """
+    from ..models import UserPromotion
+
+    promotions = [
+        p for p in get_active_promotions(school_id=school_id, school_type=school_type)
+        if p.min_order_count is not None
+    ]
+    if not promotions:
+        return []
+
+    received = set(UserPromotion.objects.filter(
+        promotion_id__in=[p.id for p in promotions],
+        user_id=user_id,
+        user_type=user_type
+    ).values_list('promotion_id', flat=True))
+    promotions = [p for p in promotions if p.id not in received]
+    counts = _progress_counts(user_type, user_id, promotions)
+    return [_pending_entry(p, counts[p.id]) for p in promotions]
+
+
+# ------------------------------
+# Post-commit evaluation
+# ------------------------------
+def _pending_cache_key(user_type, user_id):
+    return f'{PENDING_PROMOTIONS_CACHE_PREFIX}:{user_type}:{user_id}'
+
+
+def cached_pending_promotions(user_type, user_id):
+    """Pending promotions from the user's last evaluation ([] if unknown)"""
+    return cache.get(_pending_cache_key(user_type, user_id), [])
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'PROMOTION_WORKERS', 2),
+            thread_name_prefix='promotions'
+        )
+    return _executor
+
+
+def _run_in_worker(evaluation_id):
+    try:
+        run_promotion_evaluation(evaluation_id)
+    finally:
+        connections.close_all()
+
+
+def enqueue_promotion_evaluation(user, user_type, school_id=None, school_type=None, current_order_total=0):
+    """
+    Queue a promotion check for the user; it runs once the surrounding
+    transaction commits. With PROMOTIONS_ASYNC = False it runs in the request
+    thread at commit time instead of on the pool.
+    """
+    from ..models import PromotionEvaluation
+
+    evaluation = PromotionEvaluation.objects.create(
+        user_id=user.id,
+        user_type=user_type,
+        school_id=school_id,
+        school_type=school_type,
+        order_total=current_order_total
+    )
+    if getattr(settings, 'PROMOTIONS_ASYNC', True):
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_worker, evaluation.id))
+    else:
+        transaction.on_commit(lambda: run_promotion_evaluation(evaluation.id))
+    return evaluation
+
+
+def run_promotion_evaluation(evaluation_id):
+    """
+    Evaluate one queued check. The row is locked while it runs so the pool and
+    the process_promotion_evaluations sweep never award the same check twice.
+    Returns the evaluation, or None if it was already handled.
+    """
+    from ..models import PromotionEvaluation
+
+    try:
+        with transaction.atomic():
+            evaluation = PromotionEvaluation.objects.select_for_update().filter(
+                pk=evaluation_id, status='pending'
+            ).first()
+            if evaluation is None:
+                return None
+
+            user_model = _get_user_model(evaluation.user_type)
+            user = user_model.objects.filter(id=evaluation.user_id).first() if user_model else None
+            if user is not None:
+                rewards, pending = check_and_apply_promotions(
+                    user, evaluation.user_type,
+                    school_id=evaluation.school_id,
+                    school_type=evaluation.school_type,
+                    current_order_total=evaluation.order_total
+                )
+            else:
+                rewards, pending = [], []
+
+            evaluation.status = 'done'
+            evaluation.rewards = rewards
+            evaluation.pending_promotions = pending
+            evaluation.attempts += 1
+            evaluation.completed_at = timezone.now()
+            evaluation.save(update_fields=['status', 'rewards', 'pending_promotions', 'attempts', 'completed_at'])
+    except Exception:
+        logger.exception("Promotion evaluation %s failed", evaluation_id)
+        PromotionEvaluation.objects.filter(pk=evaluation_id, status='pending').update(attempts=F('attempts') + 1)
+        PromotionEvaluation.objects.filter(
+            pk=evaluation_id, status='pending', attempts__gte=MAX_EVALUATION_ATTEMPTS
+        ).update(status='failed', completed_at=timezone.now())
+        return None
+
+    cache.set(_pending_cache_key(evaluation.user_type, evaluation.user_id), pending, PENDING_PROMOTIONS_CACHE_TIMEOUT)
+    return evaluation
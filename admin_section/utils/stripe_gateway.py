@@ -0,0 +1,204 @@
+"""
+Stripe Gateway
+Single access point for the Stripe API.
+
+settings.STRIPE_BACKEND selects the implementation:
+  - "stripe" (default): the real `stripe` library
+  - "local": an in-process stand-in with the same call shapes, for offline
+    development and tests. Payment method "pm_card_chargeDeclined" is declined,
+    every other payment method succeeds.
+"""
+
+import itertools
+import re
+import threading
+from collections import OrderedDict
+
+import stripe
+from django.conf import settings
+
+
+class _Record(dict):
+    """Dict with attribute access, like stripe's StripeObject"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class _ListResult:
+    def __init__(self, data):
+        self.data = data
+
+
+class LocalStripe:
+    """In-memory replacement for the parts of the stripe API this app uses"""
+
+    error = stripe.error
+    DECLINED_PAYMENT_METHOD = 'pm_card_chargeDeclined'
+
+    _lock = threading.Lock()
+    _ids = itertools.count(1)
+    customers = {}
+    payment_intents = {}
+    idempotency_keys = {}
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls.customers.clear()
+            cls.payment_intents.clear()
+            cls.idempotency_keys.clear()
+
+    @classmethod
+    def _new_id(cls, prefix):
+        return f"{prefix}_local_{next(cls._ids)}"
+
+    class Customer:
+        @staticmethod
+        def list(email=None, **kwargs):
+            return _ListResult([c for c in LocalStripe.customers.values() if c.email == email])
+
+        @staticmethod
+        def create(email=None, name=None, **kwargs):
+            with LocalStripe._lock:
+                customer = _Record(id=LocalStripe._new_id('cus'), email=email, name=name, invoice_settings={})
+                LocalStripe.customers[customer.id] = customer
+            return customer
+
+        @staticmethod
+        def retrieve(customer_id, **kwargs):
+            return LocalStripe.customers[customer_id]
+
+        @staticmethod
+        def modify(customer_id, **kwargs):
+            customer = LocalStripe.customers[customer_id]
+            customer.update(kwargs)
+            return customer
+
+    class PaymentMethod:
+        @staticmethod
+        def attach(payment_method_id, customer=None, **kwargs):
+            return _Record(id=payment_method_id, customer=customer)
+
+    class PaymentIntent:
+        @staticmethod
+        def create(amount=None, currency=None, customer=None, payment_method=None, metadata=None,
+                   idempotency_key=None, **kwargs):
+            with LocalStripe._lock:
+                if idempotency_key and idempotency_key in LocalStripe.idempotency_keys:
+                    return LocalStripe.idempotency_keys[idempotency_key]
+
+                if payment_method == LocalStripe.DECLINED_PAYMENT_METHOD:
+                    raise stripe.error.CardError(
+                        'Your card was declined.', param=None, code='card_declined'
+                    )
+
+                intent_id = LocalStripe._new_id('pi')
+                intent = _Record(
+                    id=intent_id,
+                    amount=amount,
+                    currency=currency,
+                    customer=customer,
+                    payment_method=payment_method,
+                    metadata=dict(metadata or {}),
+                    status='succeeded',
+                    client_secret=f"{intent_id}_secret_local",
+                )
+                LocalStripe.payment_intents[intent_id] = intent
+                if idempotency_key:
+                    LocalStripe.idempotency_keys[idempotency_key] = intent
+            return intent
+
+        @staticmethod
+        def retrieve(intent_id, **kwargs):
+            return LocalStripe.payment_intents[intent_id]
+
+        @staticmethod
+        def search(query='', **kwargs):
+            # Supports the `metadata['key']:'value'` form used by reconciliation
+            match = re.fullmatch(r"metadata\['(\w+)'\]:'([^']*)'", query.strip())
+            if not match:
+                return _ListResult([])
+            key, value = match.groups()
+            return _ListResult([
+                intent for intent in LocalStripe.payment_intents.values()
+                if intent.metadata.get(key) == value
+            ])
+
+
+def get_stripe():
+    """Return the configured Stripe implementation"""
+    if getattr(settings, 'STRIPE_BACKEND', 'stripe') == 'local':
+        return LocalStripe
+    return stripe
+
+
+# ------------------------------
+# Customer resolution
+# ------------------------------
+CUSTOMER_CACHE_SIZE = 1024
+_customer_cache = OrderedDict()
+_customer_cache_lock = threading.Lock()
+
+
+def _cache_get(key):
+    with _customer_cache_lock:
+        customer_id = _customer_cache.get(key)
+        if customer_id:
+            _customer_cache.move_to_end(key)
+        return customer_id
+
+
+def _cache_put(key, customer_id):
+    with _customer_cache_lock:
+        _customer_cache[key] = customer_id
+        _customer_cache.move_to_end(key)
+        while len(_customer_cache) > CUSTOMER_CACHE_SIZE:
+            _customer_cache.popitem(last=False)
+
+
+def clear_customer_cache():
+    with _customer_cache_lock:
+        _customer_cache.clear()
+
+
+def resolve_stripe_customer_id(user, gateway=None):
+    """
+    Stripe customer id for a parent, staff or student.
+
+    Order of lookup: the stored stripe_customer_id, a process-level LRU, then
+    (once per user) Customer.list by email / Customer.create. The result is
+    persisted so later payments skip the Stripe lookup entirely.
+    """
+    key = (user._meta.label_lower, user.pk)
+
+    if user.stripe_customer_id:
+        _cache_put(key, user.stripe_customer_id)
+        return user.stripe_customer_id
+
+    customer_id = _cache_get(key)
+    if customer_id:
+        user.stripe_customer_id = customer_id
+        return customer_id
+
+    gateway = gateway or get_stripe()
+    customers = gateway.Customer.list(email=user.email).data
+    if customers:
+        customer_id = customers[0].id
+    else:
+        customer_id = gateway.Customer.create(
+            email=user.email,
+            name=f"{getattr(user, 'first_name', '')} {getattr(user, 'last_name', '')}".strip()
+        ).id
+
+    # Conditional update: if a concurrent request stored an id first, keep that one
+    model = type(user)
+    if not model.objects.filter(pk=user.pk, stripe_customer_id__isnull=True).update(stripe_customer_id=customer_id):
+        customer_id = model.objects.filter(pk=user.pk).values_list('stripe_customer_id', flat=True).first() or customer_id
+
+    user.stripe_customer_id = customer_id
+    _cache_put(key, customer_id)
+    return customer_id
@@ -0,0 +1,81 @@
+"""
+User Name Helper Functions
+Cache-aware display-name resolution for orders.
+
+Order.user_name is denormalized at creation time; these helpers only fill
+the gaps (legacy rows, orders created without a name) and do so with at most
+one query per user type, backed by the default cache.
+"""
+
+from django.core.cache import cache
+
+
+USER_NAME_CACHE_TIMEOUT = 60 * 5
+USER_NAME_CACHE_PREFIX = 'user_name'
+
+
+def _get_user_model(user_type):
+    from ..models import ParentRegisteration, SecondaryStudent, StaffRegisteration
+
+    return {
+        'student': SecondaryStudent,
+        'parent': ParentRegisteration,
+        'staff': StaffRegisteration,
+    }.get(user_type)
+
+
+def _cache_key(user_type, user_id):
+    return f'{USER_NAME_CACHE_PREFIX}:{user_type}:{user_id}'
+
+
+def display_name_for(user):
+    """Display name stored on an order for a user object already in hand"""
+    return user.username or ""
+
+
+def resolve_user_names(pairs):
+    """
+    Resolve display names for many (user_type, user_id) pairs.
+    Cached names are reused; the rest are loaded with one query per user type.
+    Returns a dict keyed by (user_type, user_id); unknown users map to "".
+    """
+    pairs = {(user_type, user_id) for user_type, user_id in pairs if user_id is not None}
+    if not pairs:
+        return {}
+
+    keys = {pair: _cache_key(*pair) for pair in pairs}
+    cached = cache.get_many(keys.values())
+    names = {pair: cached[key] for pair, key in keys.items() if key in cached}
+
+    missing = {}
+    for user_type, user_id in pairs:
+        if (user_type, user_id) not in names:
+            missing.setdefault(user_type, []).append(user_id)
+
+    to_cache = {}
+    for user_type, user_ids in missing.items():
+        model = _get_user_model(user_type)
+        found = dict(model.objects.filter(id__in=user_ids).values_list('id', 'username')) if model else {}
+        for user_id in user_ids:
+            name = found.get(user_id) or ""
+            names[(user_type, user_id)] = name
+            if user_id in found:
+                to_cache[keys[(user_type, user_id)]] = name
+
+    if to_cache:
+        cache.set_many(to_cache, USER_NAME_CACHE_TIMEOUT)
+    return names
+
+
+def resolve_user_name(user_type, user_id):
+    """Resolve a single display name (cache first, then one query)"""
+    return resolve_user_names([(user_type, user_id)]).get((user_type, user_id), "")
+
+
+def fill_order_user_names(orders):
+    """Set user_name in memory on orders that have none, in one batch"""
+    orders = [order for order in orders if order.user_name is None]
+    if orders:
+        names = resolve_user_names((order.user_type, order.user_id) for order in orders)
+        for order in orders:
+            order.user_name = names.get((order.user_type, order.user_id), "")
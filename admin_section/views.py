@@ -22,9 +22,9 @@ from django.core.signing import TimestampSigner, BadSignature, SignatureExpired
 from django.core.mail import send_mail
 from django.core.files.storage import FileSystemStorage, default_storage
 from django.core.files.base import ContentFile
-from django.http import HttpResponse, JsonResponse, FileResponse, Http404
+from django.http import HttpResponse, JsonResponse, FileResponse, Http404, StreamingHttpResponse
 from django.views.decorators.clickjacking import xframe_options_exempt
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.db.models import Count
 from django.utils.timezone import now, localtime, make_aware
 from django.utils import timezone
@@ -49,131 +49,38 @@ from jwt.algorithms import RSAAlgorithm
 from .serializers import *
 from .models import *
 from .custom_tokens import CustomPasswordResetTokenGenerator
+from .utils.checkout import (
+    AWAITING_PAYMENT, UNPLACED_STATUSES, CheckoutError, group_items_by_day, plan_orders, save_planned_orders,
+    create_order_transactions, pay_orders_with_credits, find_child_day_conflict, is_child_day_conflict,
+    new_checkout_ref, confirm_checkout_payment, rollback_checkout
+)
+from .utils.stripe_gateway import get_stripe, resolve_stripe_customer_id
+from .utils.idempotency import idempotent
+from .utils.ledger import credit_account
+from .utils.pagination import decode_cursor, encode_cursor, parse_page_size
+from .utils.cycles import (
+    CycleError, create_cycle_menus, duplicate_cycle_menus, list_cycles_with_menus, parse_cycle_rows,
+    save_cycle_edit
+)
+from .utils.menus import (
+    activate_cycle_for_schools, get_menu_snapshot, invalidate_active_menus, invalidate_school_menus, linked_schools,
+    publish_menu_snapshot, resolve_menu_items, snapshot_response
+)
+from .utils.order_export import EXPORT_FORMATS, export_filters, export_lines
+from .utils.orders import (
+    approximate_order_total, list_orders, load_manager_orders, manager_order_data, manager_order_queryset,
+    order_changes, order_data, order_filters, order_queryset, order_sync_scope
+)
+from .utils.promotions import (
+    cached_pending_promotions, enqueue_promotion_evaluation, invalidate_active_promotions,
+    promotion_progress, rebuild_promotion_progress, record_order_progress, sync_promotion_schools
+)
 
 logger = logging.getLogger(__name__)
 stripe.api_key = settings.STRIPE_SECRET_KEY
 ALLOWED_FILE_EXTENSIONS = ['png', 'jpg', 'jpeg', 'gif']
 
 
-def check_and_apply_promotions(user, user_type, school_id=None, school_type=None, current_order_total=0):
-    """
-    Check if user qualifies for any active promotions.
-    - min_order_count is checked against orders placed within the promotion's date range.
-    - spending_threshold is checked against the current order total only.
-    Returns:
-      - rewards: list of awarded promotions
-      - pending: list of promotions user hasn't qualified for yet, with orders_remaining
-    """
-    from django.db.models import Sum
-    today = date.today()
-    active_promotions = Promotion.objects.filter(
-        is_active=True,
-        start_date__lte=today,
-        end_date__gte=today
-    )
-
-    rewards = []
-    pending_promotions = []
-
-    print(f"[PROMO] user_id={user.id}, user_type={user_type}, active_promotions={active_promotions.count()}")
-
-    for promotion in active_promotions:
-        print(f"[PROMO] Checking promotion: '{promotion.name}' (id={promotion.id})")
-
-        # ── Already received? ──
-        already_received = UserPromotion.objects.filter(
-            promotion=promotion,
-            user_id=user.id,
-            user_type=user_type
-        ).exists()
-        if already_received:
-            print(f"[PROMO] SKIP '{promotion.name}' — already received")
-            continue
-
-        # ── Max redemptions across all users ──
-        if promotion.max_redemptions is not None:
-            total_redeemed = UserPromotion.objects.filter(promotion=promotion).count()
-            if total_redeemed >= promotion.max_redemptions:
-                print(f"[PROMO] SKIP '{promotion.name}' — max redemptions reached ({total_redeemed}/{promotion.max_redemptions})")
-                continue
-
-        # ── School restriction ──
-        if promotion.schools:  # empty list / None = all schools
-            if school_id is None or school_type is None:
-                print(f"[PROMO] SKIP '{promotion.name}' — school restriction but no school_id/school_type provided")
-                continue
-            school_match = any(
-                s.get('id') == school_id and s.get('type') == school_type
-                for s in promotion.schools
-            )
-            if not school_match:
-                print(f"[PROMO] SKIP '{promotion.name}' — school {school_id} ({school_type}) not in promotion schools")
-                continue
-
-        # ── Build base order queryset within promotion date range (non-cancelled) ──
-        orders_qs = Order.objects.filter(
-            user_id=user.id,
-            user_type=user_type,
-            order_date__date__gte=promotion.start_date,
-            order_date__date__lte=promotion.end_date,
-        ).exclude(status='cancelled')
-
-        if promotion.exclude_primary_orders:
-            orders_qs = orders_qs.filter(primary_school__isnull=True)
-
-        print(f"[PROMO] '{promotion.name}' — orders in range ({promotion.start_date} to {promotion.end_date}): {orders_qs.count()}, min_order_count={promotion.min_order_count}")
-
-        # ── Min order count within promotion date range ──
-        if promotion.min_order_count is not None:
-            orders_in_range = orders_qs.count()
-            if orders_in_range < promotion.min_order_count:
-                orders_remaining = promotion.min_order_count - orders_in_range
-                print(f"[PROMO] PENDING '{promotion.name}' — {orders_in_range}/{promotion.min_order_count} orders, {orders_remaining} remaining")
-                pending_promotions.append({
-                    'promotion_name': promotion.name,
-                    'credit_reward': float(promotion.credit_reward),
-                    'orders_remaining': orders_remaining,
-                    'orders_placed': orders_in_range,
-                    'min_order_count': promotion.min_order_count,
-                    'promotion_ends': str(promotion.end_date),
-                })
-                continue
-
-        # ── Spending threshold — checked against current order total only ──
-        if promotion.spending_threshold is not None:
-            if float(current_order_total) < float(promotion.spending_threshold):
-                print(f"[PROMO] SKIP '{promotion.name}' — current order €{current_order_total} < min spending €{promotion.spending_threshold}")
-                continue
-
-        # ── All conditions passed — award credits ──
-        user.credits += float(promotion.credit_reward)
-        user.save()
-
-        UserPromotion.objects.create(
-            promotion=promotion,
-            user_id=user.id,
-            user_type=user_type
-        )
-
-        Transaction.objects.create(
-            user_id=user.id,
-            user_type=user_type,
-            transaction_type='credit',
-            payment_method='credits',
-            amount=float(promotion.credit_reward),
-            description=f"Promotion reward: {promotion.name}",
-            parent=user if user_type == 'parent' else None,
-            staff=user if user_type == 'staff' else None,
-            student=user if user_type == 'student' else None
-        )
-
-        rewards.append({
-            'promotion_name': promotion.name,
-            'credit_reward': float(promotion.credit_reward),
-        })
-
-    return rewards, pending_promotions
-
 APPLE_KEYS_URL = "https://appleid.apple.com/auth/keys"
 APPLE_AUDIENCE = "app.raftersfoodservices.ie"
 
@@ -1544,50 +1451,31 @@ def activate_cycle(request):
         return Response({'error': f'{school_type.capitalize()} School not found'}, status=status.HTTP_404_NOT_FOUND)
 
     # Get menus of this cycle
-    menus = Menu.objects.filter(cycle_name=cycle_name)
-    if not menus.exists():
+    if not Menu.objects.filter(cycle_name=cycle_name).exists():
         return Response({'error': f'No menus found for cycle "{cycle_name}".'}, status=status.HTTP_404_NOT_FOUND)
 
-    # 🔴 First deactivate all existing menus linked with this school
-    if school_type == 'primary':
-        previous_menus = Menu.objects.filter(primary_schools=school, is_active=True)
-        for menu in previous_menus:
-            menu.primary_schools.remove(school)
-            # If menu is not linked to any school, deactivate it globally
-            if not menu.primary_schools.exists() and not menu.secondary_schools.exists():
-                menu.is_active = False
-            menu.save()
-    else:
-        previous_menus = Menu.objects.filter(secondary_schools=school, is_active=True)
-        for menu in previous_menus:
-            menu.secondary_schools.remove(school)
-            if not menu.primary_schools.exists() and not menu.secondary_schools.exists():
-                menu.is_active = False
-            menu.save()
-
-    # ✅ Now activate the new cycle menus
-    updated_menus = []
-    for menu in menus:
-        menu.is_active = True
-        menu.save()
-
-        if school_type == 'primary':
-            menu.primary_schools.add(school)
-        else:
-            menu.secondary_schools.add(school)
-
-        updated_menus.append({
-            'id': menu.id,
-            'name': menu.name,
-            'price': str(menu.price),
-            'menu_day': menu.menu_day,
-            'cycle_name': menu.cycle_name,
-            'is_active': menu.is_active,
-            'schools': {
-                'primary': [s.school_name for s in menu.primary_schools.all()],
-                'secondary': [s.secondary_school_name for s in menu.secondary_schools.all()]
-            }
-        })
+    menu_ids = activate_cycle_for_schools(cycle_name, school_type, [school.id], publish=True)
+
+    # School names per menu, one query per school type
+    schools = {menu_id: {'primary': [], 'secondary': []} for menu_id in menu_ids}
+    for menu_id, name in Menu.primary_schools.through.objects.filter(
+        menu_id__in=menu_ids
+    ).order_by('id').values_list('menu_id', 'primaryschool__school_name'):
+        schools[menu_id]['primary'].append(name)
+    for menu_id, name in Menu.secondary_schools.through.objects.filter(
+        menu_id__in=menu_ids
+    ).order_by('id').values_list('menu_id', 'secondaryschool__secondary_school_name'):
+        schools[menu_id]['secondary'].append(name)
+
+    updated_menus = [{
+        'id': menu.id,
+        'name': menu.name,
+        'price': str(menu.price),
+        'menu_day': menu.menu_day,
+        'cycle_name': menu.cycle_name,
+        'is_active': menu.is_active,
+        'schools': schools[menu.id]
+    } for menu in Menu.objects.filter(id__in=menu_ids).order_by('id')]
 
     return Response({
         'message': f'Cycle "{cycle_name}" activated successfully for {school.school_name if school_type == "primary" else school.secondary_school_name}!',
@@ -1595,6 +1483,56 @@ def activate_cycle(request):
     }, status=status.HTTP_200_OK)
 
 
+@api_view(['POST'])
+def activate_cycle_bulk(request):
+    """
+    Activate one cycle for many schools at once (Monday rollout).
+    Payload: { cycle_name, schools: [{id, type}] } with type primary|secondary
+    """
+    cycle_name = request.data.get('cycle_name')
+    schools = request.data.get('schools')
+
+    if not cycle_name or not schools or not isinstance(schools, list):
+        return Response({'error': 'cycle_name and a list of schools are required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    school_ids = {'primary': set(), 'secondary': set()}
+    for school in schools:
+        try:
+            school_type, school_id = school.get('type'), int(school.get('id'))
+        except (AttributeError, TypeError, ValueError):
+            return Response({'error': 'Each school needs an id and a type.'}, status=status.HTTP_400_BAD_REQUEST)
+        if school_type not in school_ids:
+            return Response({'error': 'Invalid school type. Use primary or secondary.'}, status=status.HTTP_400_BAD_REQUEST)
+        school_ids[school_type].add(school_id)
+
+    missing = (
+        [('primary', i) for i in school_ids['primary'] - set(PrimarySchool.objects.filter(id__in=school_ids['primary']).values_list('id', flat=True))] +
+        [('secondary', i) for i in school_ids['secondary'] - set(SecondarySchool.objects.filter(id__in=school_ids['secondary']).values_list('id', flat=True))]
+    )
+    if missing:
+        return Response({
+            'error': 'Schools not found.',
+            'schools': [{'id': school_id, 'type': school_type} for school_type, school_id in missing]
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    if not Menu.objects.filter(cycle_name=cycle_name).exists():
+        return Response({'error': f'No menus found for cycle "{cycle_name}".'}, status=status.HTTP_404_NOT_FOUND)
+
+    menu_ids = []
+    with transaction.atomic():
+        for school_type, ids in school_ids.items():
+            if ids:
+                menu_ids = activate_cycle_for_schools(
+                    cycle_name, school_type, sorted(ids), publish=True
+                )
+
+    return Response({
+        'message': f'Cycle "{cycle_name}" activated for {len(school_ids["primary"]) + len(school_ids["secondary"])} school(s).',
+        'menu_ids': menu_ids,
+        'schools': {school_type: sorted(ids) for school_type, ids in school_ids.items()}
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['POST', 'GET', 'DELETE'])
 def get_complete_menu(request):
     if request.method == 'POST':
@@ -1695,92 +1633,23 @@ def get_complete_menu(request):
     return Response({'error': 'Invalid request method.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-@api_view(["POST"])
+@api_view(["GET", "POST"])
 def get_active_menu(request):
-    school_type = request.data.get('school_type')
-    school_id = request.data.get('school_id')
+    params = request.query_params if request.method == 'GET' else request.data
+    school_type = params.get('school_type')
+    school_id = params.get('school_id')
 
     if not school_type or not school_id:
         return Response({"detail": "Both 'school_type' and 'school_id' must be provided."},
                         status=status.HTTP_400_BAD_REQUEST)
 
-    try:
-        if school_type == 'primary':
-            menus = Menu.objects.filter(
-                primary_schools__id=school_id   # ✅ updated for M2M
-            ).select_related('category')
-            
-            subquery = Menu.objects.filter(
-                primary_schools__id=school_id   # ✅ updated for M2M
-            ).values('cycle_name').distinct()
-
-        elif school_type == 'secondary':
-            menus = Menu.objects.filter(
-                secondary_schools__id=school_id   # ✅ updated for M2M
-            ).select_related('category')
-            
-            subquery = Menu.objects.filter(
-                secondary_schools__id=school_id   # ✅ updated for M2M
-            ).values('cycle_name').distinct()
-
-        else:
-            return Response({"detail": "Invalid school type. Please provide either 'primary' or 'secondary'."},
-                            status=status.HTTP_400_BAD_REQUEST)
-
-        # filter only active
-        active_menus = [menu for menu in menus if menu.is_active]
-
-        # collect active cycles
-        active_cycles = [
-            {"cycle": cycle['cycle_name']} 
-            for cycle in subquery 
-            if any(menu.cycle_name == cycle['cycle_name'] for menu in active_menus)
-        ]
-
-        menus_data = MenuSerializer(active_menus, many=True).data
-
-        weekly_menu = {
-            "Monday": [],
-            "Tuesday": [],
-            "Wednesday": [],
-            "Thursday": [],
-            "Friday": [],
-            "Saturday": [],
-            "Sunday": []
-        }
-
-        for menu in menus_data:
-            day_of_week = menu['menu_day']
-            if day_of_week in weekly_menu:
-                menu_items = MenuItems.objects.filter(item_name=menu['name'])
-                menu_items_data = []
-
-                for item in menu_items:
-                    menu_items_data.append({
-                        "item_name": item.item_name,
-                        "item_description": item.item_description,
-                        "ingredients": item.ingredients,
-                        "nutrients": item.nutrients,
-                        "allergies": [allergy.allergy for allergy in item.allergies.all()],
-                        "image_url": request.build_absolute_uri(item.image.url) if item.image else None
-                    })
-
-                category_name = menu.get('category', None)  
-                weekly_menu[day_of_week].append({
-                    'id': menu['id'],
-                    "name": menu['name'],
-                    "price": menu['price'],
-                    "menu_date": menu['menu_date'],
-                    "cycle_name": menu['cycle_name'],
-                    "category": category_name,  
-                    "is_active": menu['is_active'],
-                    "menu_items": menu_items_data
-                })
+    if school_type not in ('primary', 'secondary'):
+        return Response({"detail": "Invalid school type. Please provide either 'primary' or 'secondary'."},
+                        status=status.HTTP_400_BAD_REQUEST)
 
-        return Response({
-            "menus": weekly_menu,
-            "cycles": active_cycles
-        }, status=status.HTTP_200_OK)
+    try:
+        snapshot = get_menu_snapshot(school_type, int(school_id))
+        return snapshot_response(request, snapshot.menu_body, snapshot.menu_etag)
 
     except Exception as e:
         return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1827,11 +1696,13 @@ def edit_menu(request, id):
 
         if menu_name:
             menu_item.name = menu_name
+            menu_item.menu_item = resolve_menu_items([menu_name]).get(menu_name.strip().lower())
         
         if price is not None:
             menu_item.price = price
 
         menu_item.save()
+        invalidate_active_menus([menu_item.id])
 
         serializer = MenuSerializer(menu_item)
         return Response({'message': 'Menu updated successfully!', 'menu': serializer.data}, status=status.HTTP_200_OK)
@@ -1888,7 +1759,10 @@ def add_menu_item(request):
     if request.method == 'POST':
         serializer = MenuItemsSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
-            serializer.save()
+            item = serializer.save()
+            # Link menus created before their item existed
+            if Menu.objects.filter(menu_item__isnull=True, name__iexact=item.item_name).update(menu_item=item):
+                invalidate_active_menus(item.menus.values('id'))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
             return Response({"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
@@ -1920,13 +1794,17 @@ def update_menu_items(request, pk):
 
         if serializer.is_valid():
             serializer.save()  
+            invalidate_active_menus(menu_item.menus.values('id'))
             return Response(serializer.data, status=status.HTTP_200_OK)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     elif request.method == 'DELETE':
        
+        # Deleting the item unlinks its menus, so find them first
+        menu_ids = list(menu_item.menus.values_list('id', flat=True))
         menu_item.delete()
+        invalidate_active_menus(menu_ids)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -2021,6 +1899,7 @@ def edit_student(request, student_id):
 
 @csrf_exempt
 @api_view(['POST'])
+@transaction.atomic
 def create_order(request):
     if request.method == 'POST':
         
@@ -2164,6 +2043,7 @@ def create_order(request):
             
             order_instance.total_price = order_total_price
             order_instance.save()
+            record_order_progress([order_instance])
 
             
             order_details = {
@@ -2219,6 +2099,9 @@ def complete_order(request):
         
         order = Order.objects.get(id=order_id)
 
+        if order.status == AWAITING_PAYMENT:
+            return Response({'error': 'Payment for this order is still being processed.'}, status=status.HTTP_400_BAD_REQUEST)
+
         order.is_delivered = True
         order.status = 'collected'
         order.save()
@@ -2245,15 +2128,9 @@ def cancel_order(request):
     try:
         order = Order.objects.get(id=order_id)
 
-       
-        order.status = 'cancelled'
-        order.is_delivered = False
-        order.save()
-
         credit_message = None
         user = None
 
-        
         if order.user_type == 'student':
             user = SecondaryStudent.objects.get(id=order.user_id)
         elif order.user_type == 'parent':
@@ -2261,24 +2138,28 @@ def cancel_order(request):
         elif order.user_type == 'staff':
             user = StaffRegisteration.objects.get(id=order.user_id)
 
-        if user:
-            user.credits += order.total_price
-            user.save()
-            credit_message = f"Credits of {order.total_price} have been added to your account."
-
-            # Create transaction record for credit refund
-            Transaction.objects.create(
-                user_id=order.user_id,
-                user_type=order.user_type,
-                transaction_type='refund',
-                payment_method='credits',
-                amount=order.total_price,  # Positive because credits added back
-                order=order,
-                description=f"Refund for cancelled order #{order.id}",
-                parent=user if order.user_type == 'parent' else None,
-                staff=user if order.user_type == 'staff' else None,
-                student=user if order.user_type == 'student' else None
-            )
+        if order.status == AWAITING_PAYMENT:
+            return Response({'error': 'Payment for this order is still being processed.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            # Conditional update: a repeated or concurrent cancel must not refund twice
+            if not Order.objects.filter(id=order.id).exclude(status__in=UNPLACED_STATUSES).update(
+                status='cancelled', is_delivered=False, updated_at=timezone.now()
+            ):
+                return Response({'error': 'Order is already cancelled.'}, status=status.HTTP_400_BAD_REQUEST)
+            order.status = 'cancelled'
+            order.is_delivered = False
+            record_order_progress([order], -1)
+
+            if user:
+                credit_account(
+                    user, order.user_type, order.total_price,
+                    kind='refund',
+                    transaction_type='refund',
+                    order=order,
+                    description=f"Refund for cancelled order #{order.id}"
+                )
+                credit_message = f"Credits of {order.total_price} have been added to your account."
 
         order_info = {
             'order_id': order.id,
@@ -2314,124 +2195,29 @@ def add_order_item(request):
         else:
             return Response({ "error" : serializer.errors},status = status.HTTP_400_BAD_REQUEST)
         
-def safe_localtime(dt):
-    """Ensure datetime is timezone-aware before converting to localtime."""
-    if isinstance(dt, date) and not isinstance(dt, datetime):
-        dt = make_aware(datetime.combine(dt, datetime.min.time()))
-    return localtime(dt)
 
 @api_view(['GET'])
 def get_all_orders(request):
-    from django.db.models import Prefetch
-
-    order_details = []
-
-    # Optimize regular orders with select_related and prefetch_related
-    orders = Order.objects.select_related(
-        'primary_school',
-        'secondary_school'
-    ).prefetch_related(
-        Prefetch('order_items', queryset=OrderItem.objects.select_related('menu'))
-    ).order_by('-order_date')
-
-    for order in orders:
-        # Access prefetched order items (no additional query)
-        order_items = order.order_items.all()
-        items_details = []
-        for item in order_items:
-            item_name = item._menu_name if item._menu_name else (item.menu.name if item.menu else "Deleted Menu")
-            item_price = item._menu_price if item._menu_price else (item.menu.price if item.menu else 0)
-            items_details.append({
-                'item_name': item_name,
-                'item_price': item_price,
-                'quantity': item.quantity
-            })
-
-        local_order_date = safe_localtime(order.order_date)
-        formatted_order_date = local_order_date.strftime('%d %B, %Y')
-
-        order_data = {
-            'order_id': order.id,
-            'selected_day': order.selected_day,
-            'total_price': order.total_price,
-            'order_date': formatted_order_date,
-            'status': order.status,
-            'week_number': order.week_number,
-            'year': order.year,
-            'items': items_details,
-            'user_name': order.user_name,
-            'user_type': order.user_type,
-            'payment_id': order.payment_id,
-        }
-
-        # Add school info (already loaded via select_related)
-        if order.primary_school:
-            order_data['school_id'] = order.primary_school.id
-            order_data['school_name'] = order.primary_school.school_name
-            order_data['school_type'] = 'primary'
-        elif order.secondary_school:
-            order_data['school_id'] = order.secondary_school.id
-            order_data['school_name'] = order.secondary_school.secondary_school_name
-            order_data['school_type'] = 'secondary'
-
-        if order.user_type in ['parent', 'staff']:
-            order_data['child_id'] = order.child_id
-
-        order_details.append(order_data)
-
-    # Optimize manager orders with select_related and prefetch_related
-    manager_orders = ManagerOrder.objects.select_related(
-        'manager'
-    ).prefetch_related(
-        'items'
-    ).order_by('-order_date')
-
-    for m_order in manager_orders:
-        # Access prefetched manager order items (no additional query)
-        m_items = m_order.items.all()
-        items_details = [
-            {
-                'day': item.day,
-                'item': item.item,
-                'quantity': item.quantity,
-                'production_price': item.production_price or 0
-            }
-            for item in m_items
-        ]
-
-        local_order_date = safe_localtime(m_order.order_date)
-        formatted_order_date = local_order_date.strftime('%d %B, %Y')
-
-        order_data = {
-            'order_id': f"m_{m_order.id}",
-            'selected_day': m_order.selected_day,
-            'total_production_price': m_order.total_production_price,
-            'order_date': formatted_order_date,
-            'status': m_order.status,
-            'week_number': m_order.week_number,
-            'year': m_order.year,
-            'is_delivered': m_order.is_delivered,
-            'user_name': m_order.manager.username if hasattr(m_order.manager, 'username') else str(m_order.manager),
-            'user_type': 'manager',
-            'items': items_details,
-        }
-
-        # Add school info for manager orders if they have a school
-        if hasattr(m_order.manager, 'primary_school') and m_order.manager.primary_school:
-            order_data['school_id'] = m_order.manager.primary_school.id
-            order_data['school_name'] = m_order.manager.primary_school.school_name
-            order_data['school_type'] = 'primary'
-        elif hasattr(m_order.manager, 'secondary_school') and m_order.manager.secondary_school:
-            order_data['school_id'] = m_order.manager.secondary_school.id
-            order_data['school_name'] = m_order.manager.secondary_school.secondary_school_name
-            order_data['school_type'] = 'secondary'
-
-        order_details.append(order_data)
+    """
+    Orders and manager orders, newest first, one page at a time.
+    Query params: cursor, limit (default 20, max 100), school_id + school_type,
+    status, week, year, user_type, day, include_total (cached approximate count)
+    """
+    try:
+        filters = order_filters(request.query_params)
+        limit = parse_page_size(request.query_params.get('limit'))
+        order_details, next_cursor = list_orders(filters, cursor=request.query_params.get('cursor'), limit=limit)
+    except ValueError:
+        return Response({'error': 'Invalid filters, cursor or limit.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    return Response({
+    response_data = {
         'message': 'Orders retrieved successfully!',
-        'orders': order_details
-    }, status=status.HTTP_200_OK)
+        'orders': order_details,
+        'next_cursor': next_cursor
+    }
+    if request.query_params.get('include_total', 'false').lower() in ('true', '1'):
+        response_data['approximate_total'] = approximate_order_total(filters)
+    return Response(response_data, status=status.HTTP_200_OK)
 
 
 
@@ -2440,91 +2226,23 @@ def get_all_orders(request):
 def get_order_by_id(request, order_id):
     if str(order_id).startswith('m_'):
         manager_order_id = str(order_id).replace('m_', '')
-        try:
-            order = ManagerOrder.objects.get(id=manager_order_id)
-            order_items = ManagerOrderItem.objects.filter(order=order)
-
-            items_details = [
-                {
-                    'day': item.day,
-                    'item': item.item,
-                    'quantity': item.quantity,
-                    'production_price': item.production_price or 0
-                }
-                for item in order_items
-            ]
-
-            local_order_date = safe_localtime(order.order_date)
-            formatted_order_date = local_order_date.strftime('%d %B, %Y')
-
-            order_data = {
-                'order_id': f"m_{order.id}",
-                'selected_day': order.selected_day,
-                'total_production_price': order.total_production_price,
-                'order_date': formatted_order_date,
-                'status': order.status,
-                'week_number': order.week_number,
-                'year': order.year,
-                'is_delivered': order.is_delivered,
-                'manager_name': order.manager.username if hasattr(order.manager, 'username') else str(order.manager),
-                'items': items_details,
-                'user_type': 'manager'
-            }
-
-            return Response(
-                {'message': 'Manager order retrieved successfully!', 'order': order_data},
-                status=status.HTTP_200_OK
-            )
-
-        except ManagerOrder.DoesNotExist:
+        manager_orders = load_manager_orders(manager_order_queryset().filter(id=manager_order_id))
+        if not manager_orders:
             return Response({'error': 'Manager order not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-    # ---------------- NORMAL ORDER ----------------
-    try:
-        order = Order.objects.get(id=order_id)
-        order_items = OrderItem.objects.filter(order=order)
-
-        items_details = []
-        for item in order_items:
-            item_name = item._menu_name if item._menu_name else (item.menu.name if item.menu else "Deleted Menu")
-            item_price = item._menu_price if item._menu_price else (item.menu.price if item.menu else 0)
-            items_details.append({
-                'item_name': item_name,
-                'item_price': item_price,
-                'quantity': item.quantity
-            })
-
-        local_order_date = safe_localtime(order.order_date)
-        formatted_order_date = local_order_date.strftime('%d %B, %Y')
-
-        order_data = {
-            'order_id': order.id,
-            'selected_day': order.selected_day,
-            'total_price': order.total_price,
-            'order_date': formatted_order_date,
-            'status': order.status,
-            'week_number': order.week_number,
-            'year': order.year,
-            'items': items_details,
-            'user_name': order.user_name,
-        }
-
-        if order.user_type in ['parent', 'staff']:
-            order_data['child_id'] = order.child_id
-
-        if order.primary_school:
-            order_data['school_id'] = order.primary_school.id
-            order_data['school_type'] = 'primary'
-        elif order.secondary_school:
-            order_data['school_id'] = order.secondary_school.id
-            order_data['school_type'] = 'secondary'
-
-        return Response({'message': 'Order retrieved successfully!', 'order': order_data},
-                        status=status.HTTP_200_OK)
+        return Response(
+            {'message': 'Manager order retrieved successfully!', 'order': manager_order_data(manager_orders[0])},
+            status=status.HTTP_200_OK
+        )
 
-    except Order.DoesNotExist:
+    # ---------------- NORMAL ORDER ----------------
+    order = order_queryset().filter(id=order_id).first()
+    if order is None:
         return Response({'error': 'Order not found.'}, status=status.HTTP_404_NOT_FOUND)
 
+    return Response({'message': 'Order retrieved successfully!', 'order': order_data(order)},
+                    status=status.HTTP_200_OK)
+
 
 
 @api_view(['POST'])
@@ -2540,102 +2258,43 @@ def get_orders_by_school(request):
                         status=status.HTTP_400_BAD_REQUEST)
 
     if school_type == 'primary':
-        orders = Order.objects.filter(primary_school_id=school_id).order_by('-order_date')
-    else:
-        orders = Order.objects.filter(secondary_school_id=school_id).order_by('-order_date')
-
-    if school_type == 'primary':
-        manager_orders = ManagerOrder.objects.filter(
-            manager__school_type='primary',
-            manager__primary_school_id=school_id
-        ).order_by('-order_date')
+        orders = order_queryset().filter(primary_school_id=school_id)
     else:
-        manager_orders = ManagerOrder.objects.filter(
-            manager__school_type='secondary',
-            manager__secondary_school_id=school_id
-        ).order_by('-order_date')
+        orders = order_queryset().filter(secondary_school_id=school_id)
+    orders = list(orders.exclude(status=AWAITING_PAYMENT).order_by('-order_date'))
 
+    manager_orders = load_manager_orders(
+        manager_order_queryset().filter(school_type=school_type, school_id=school_id).order_by('-order_date')
+    )
 
-    if not orders.exists() and not manager_orders.exists():
+    if not orders and not manager_orders:
         return Response({'error': 'No orders found for the given school.'}, status=status.HTTP_404_NOT_FOUND)
 
     order_details = []
 
     # Normal Orders
     for order in orders:
-        order_items = order.order_items.all()
-        items_details = []
-        for item in order_items:
-            item_name = item._menu_name if item._menu_name else (item.menu.name if item.menu else "Deleted Menu")
-            item_price = item._menu_price if item._menu_price else (item.menu.price if item.menu else 0)
-            items_details.append({
-                'item_name': item_name,
-                'item_price': item_price,
-                'quantity': item.quantity
-            })
-
-        local_order_date = safe_localtime(order.order_date)
-        formatted_order_date = local_order_date.strftime('%d %B, %Y')
-
-        order_data = {
-            'order_id': order.id,
-            'selected_day': order.selected_day,
-            'total_price': order.total_price,
+        data = order_data(order)
+        data.update({
             'total_amount': order.total_price,
-            'order_date': formatted_order_date,
-            'status': order.status,
-            'week_number': order.week_number,
-            'year': order.year,
-            'items': items_details,
-            'user_name': order.user_name,
             'child_name': order.user_name,
-            'user_type': order.user_type,
             'school_id': school_id,
             'school_type': school_type,
-            'created_at': order.created_at.isoformat() if hasattr(order, 'created_at') and order.created_at else None
-        }
-
-        if order.user_type in ['parent', 'staff']:
-            order_data['child_id'] = order.child_id
-
-        order_details.append(order_data)
+            'created_at': order.created_at.isoformat() if order.created_at else None
+        })
+        order_details.append(data)
 
     # Manager Orders
     for m_order in manager_orders:
-        order_items = ManagerOrderItem.objects.filter(order=m_order)
-        items_details = [
-            {
-                'day': item.day,
-                'item': item.item,
-                'quantity': item.quantity,
-                'production_price': item.production_price or 0
-            }
-            for item in order_items
-        ]
-
-        local_order_date = safe_localtime(m_order.order_date)
-        formatted_order_date = local_order_date.strftime('%d %B, %Y')
-
-        order_data = {
-            'order_id': f"m_{m_order.id}",
-            'selected_day': m_order.selected_day,
-            'total_production_price': m_order.total_production_price,
-            'total_amount': m_order.total_production_price,
-            'order_date': formatted_order_date,
-            'status': m_order.status,
-            'week_number': m_order.week_number,
-            'year': m_order.year,
-            'is_delivered': m_order.is_delivered,
-            'manager_name': m_order.manager.username if hasattr(m_order.manager, 'username') else str(m_order.manager),
-            'child_name': m_order.manager.username if hasattr(m_order.manager, 'username') else str(m_order.manager),
-            'items': items_details,
-            'user_type': 'manager',
+        data = manager_order_data(m_order)
+        data.update({
+            'total_amount': data['total_production_price'],
+            'child_name': data['manager_name'],
             'school_id': school_id,
             'school_type': school_type,
             'created_at': m_order.order_date.isoformat() if m_order.order_date else None
-        }
-
-        order_details.append(order_data)
+        })
+        order_details.append(data)
 
     return Response({'message': 'Orders retrieved successfully!', 'orders': order_details},
                     status=status.HTTP_200_OK)
@@ -2655,107 +2314,74 @@ def get_orders_by_user(request):
         return Response({'error': 'Invalid user_type.'}, status=status.HTTP_400_BAD_REQUEST)
 
     order_details = []
-    orders = Order.objects.none()
 
     # Normal user logic
+    orders = None
     if user_type == 'staff' and child_id:
-        orders = Order.objects.filter(child_id=child_id).order_by('-order_date')
-    elif user_type == 'staff' and user_id:
-        orders = Order.objects.filter(user_id=user_id, user_type='staff').order_by('-order_date')
-    elif user_type == 'parent':
-        orders = Order.objects.filter(user_id=user_id, user_type='parent').order_by('-order_date')
-    elif user_type == 'student':
-        orders = Order.objects.filter(user_id=user_id, user_type='student').order_by('-order_date')
-
-    for order in orders:
-        order_items = order.order_items.all()
-        items_details = []
-        for item in order_items:
-            item_name = item._menu_name if item._menu_name else (item.menu.name if item.menu else "Deleted Menu")
-            item_price = item._menu_price if item._menu_price else (item.menu.price if item.menu else 0)
-            items_details.append({
-                'item_name': item_name,
-                'item_price': item_price,
-                'quantity': item.quantity
-            })
+        orders = order_queryset().filter(child_id=child_id)
+    elif user_type in ['staff', 'parent', 'student'] and user_id:
+        orders = order_queryset().filter(user_id=user_id, user_type=user_type)
 
-        local_date = safe_localtime(order.order_date).date()
-        formatted_order_date = local_date.strftime('%d %B, %Y')
-
-        order_data = {
-            'order_id': order.id,
-            'selected_day': order.selected_day,
-            'total_price': order.total_price,
-            'order_date': formatted_order_date,
-            'order_date_raw': str(local_date),
-            'status': order.status,
-            'week_number': order.week_number,
-            'year': order.year,
-            'items': items_details,
-            'user_name': order.user_name,
-            'user_type': order.user_type,
-        }
-
-        if order.user_type in ['parent', 'staff']:
-            order_data['child_id'] = order.child_id
-
-        if order.primary_school:
-            order_data['school_id'] = order.primary_school.id
-            order_data['school_type'] = 'primary'
-        elif order.secondary_school:
-            order_data['school_id'] = order.secondary_school.id
-            order_data['school_type'] = 'secondary'
-
-        order_details.append(order_data)
+    if orders is not None:
+        order_details += [order_data(order) for order in orders.exclude(status=AWAITING_PAYMENT).order_by('-order_date')]
 
     # Manager Orders
     if user_type == 'manager' and user_id:
-        manager_orders = ManagerOrder.objects.filter(manager_id=user_id).order_by('-order_date')
+        manager_orders = load_manager_orders(
+            manager_order_queryset().filter(manager_id=user_id).order_by('-order_date')
+        )
+        order_details += [manager_order_data(m_order) for m_order in manager_orders]
 
-        for m_order in manager_orders:
-            order_items = ManagerOrderItem.objects.filter(order=m_order)
-            items_details = [
-                {
-                    'day': item.day,
-                    'item': item.item,
-                    'quantity': item.quantity,
-                    'production_price': item.production_price or 0
-                }
-                for item in order_items
-            ]
+    if not order_details:
+        return Response({'error': 'No orders found for the given user.'}, status=status.HTTP_404_NOT_FOUND)
 
-            local_order_date = safe_localtime(m_order.order_date)
-            formatted_order_date = local_order_date.strftime('%d %B, %Y')
+    return Response({'message': 'Orders retrieved successfully!', 'orders': order_details},
+                    status=status.HTTP_200_OK)
 
-            order_data = {
-                'order_id': f"m_{m_order.id}",
-                'selected_day': m_order.selected_day,
-                'total_production_price': m_order.total_production_price,
-                'order_date': formatted_order_date,
-                'order_date_raw': str(local_order_date.date()),
-                'status': m_order.status,
-                'week_number': m_order.week_number,
-                'year': m_order.year,
-                'is_delivered': m_order.is_delivered,
-                'manager_name': m_order.manager.username,
-                'items': items_details,
-                'user_type': 'manager',
-            }
 
-            if m_order.manager.school_type == 'primary' and m_order.manager.primary_school:
-                order_data['school_id'] = m_order.manager.primary_school.id
-                order_data['school_type'] = 'primary'
-            elif m_order.manager.school_type == 'secondary' and m_order.manager.secondary_school:
-                order_data['school_id'] = m_order.manager.secondary_school.id
-                order_data['school_type'] = 'secondary'
+@api_view(['GET'])
+def sync_orders(request):
+    """
+    Orders of a user changed since the client's last sync, for the apps' order history.
+    Query params: user_type (student, parent or staff), user_id, child_id (staff),
+    since (the sync_token of the previous response; omit for a full sync).
+    full_resync is true when `orders` is the complete list and the client
+    should drop any order it holds that is not in it.
+    """
+    try:
+        scope = order_sync_scope(request.query_params)
+        changed, deleted, sync_token, full_resync = order_changes(scope, since=request.query_params.get('since'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            order_details.append(order_data)
+    return Response({
+        'message': 'Orders synced successfully!',
+        'orders': changed,
+        'deleted': deleted,
+        'sync_token': sync_token,
+        'full_resync': full_resync
+    }, status=status.HTTP_200_OK)
 
-    if not order_details:
-        return Response({'error': 'No orders found for the given user.'}, status=status.HTTP_404_NOT_FOUND)
 
-    return Response({'message': 'Orders retrieved successfully!', 'orders': order_details},
-                    status=status.HTTP_200_OK)
+@api_view(['GET'])
+def export_orders(request):
+    """
+    Orders with their items, streamed as NDJSON (default) or CSV.
+    Query params: export_format (ndjson or csv; DRF reserves `format`), date_from,
+    date_to (YYYY-MM-DD, on the delivery date), school_id + school_type
+    """
+    export_format = request.query_params.get('export_format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return Response({'error': 'export_format must be ndjson or csv.'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        filters = export_filters(request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    content_type = 'application/x-ndjson' if export_format == 'ndjson' else 'text/csv'
+    response = StreamingHttpResponse(export_lines(filters, export_format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="orders.{export_format}"'
+    return response
 
 
 @api_view(['POST'])
@@ -2876,15 +2502,10 @@ def get_current_week_and_year():
     return current_week, current_year
 
 
-def get_or_create_customer(email, name):
-    """Find or create a Stripe customer"""
-    customers = stripe.Customer.list(email=email).data
-    if customers:
-        return customers[0]  # return existing
-    return stripe.Customer.create(email=email, name=name)
-
 class CreateOrderAndPaymentAPIView(APIView):
+    @idempotent
     def post(self, request, *args, **kwargs):
+        plan = []
         try:
             data = request.data
             user_type = data.get('user_type')
@@ -2934,287 +2555,154 @@ class CreateOrderAndPaymentAPIView(APIView):
             # PRIMARY SCHOOL: 1 order per day per child per week
             # A child can order once for each day (Mon, Tue, etc.) in a week.
             # If cancelled, they can re-order for that same day.
+            # Enforced by the order_child_day_unique index, see the
+            # IntegrityError handler below.
             # ============================================================
-            if school_type == "primary" and child_id is not None:
-                today = datetime.now()
-                current_weekday = today.weekday()
-                days_map = {
-                    'monday': 0, 'tuesday': 1, 'wednesday': 2,
-                    'thursday': 3, 'friday': 4, 'saturday': 5, 'sunday': 6
-                }
-
-                for day in selected_days:
-                    target_day_num = days_map.get(day.lower(), 0)
-                    days_ahead = (target_day_num - current_weekday + 7) % 7
-                    if days_ahead == 0:
-                        days_ahead = 7
-                    order_date_check = today + timedelta(days=days_ahead)
-                    target_week = order_date_check.isocalendar()[1]
-                    target_year = order_date_check.year
-
-                    print(f"[ORDER CHECK] child_id={child_id}, day={day}, "
-                          f"today={today.strftime('%A %Y-%m-%d')}, "
-                          f"target_week={target_week}, target_year={target_year}")
-
-                    # Check if child already has a non-cancelled order for this specific day
-                    active_order = Order.objects.filter(
-                        child_id=child_id,
-                        week_number=target_week,
-                        year=target_year,
-                        selected_day__iexact=day,
-                        primary_school_id=school_id
-                    ).exclude(status__iexact='cancelled').first()
-
-                    if active_order:
-                        print(f"  [BLOCKED] by order id={active_order.id}, "
-                              f"day={active_order.selected_day}, status='{active_order.status}'")
-                        return Response({
-                            'error': f'This child already has an order for {day} in week {target_week}. Cancel the existing order to place a new one.',
-                        }, status=status.HTTP_400_BAD_REQUEST)
-                    else:
-                        print(f"  [ALLOWED] No active order for {day} in week {target_week}")
-
-            # Transaction for atomicity
-            with transaction.atomic():
-                created_orders = []
-                calculated_total_price = 0
-
-                # Group items by day
-                daily_orders = {}
-                for i, day in enumerate(selected_days):
-                    item_for_day = order_items_data[i]
-                    daily_orders.setdefault(day, []).append(item_for_day)
-
-                # Create orders
-                for day, items_list in daily_orders.items():
-                    today = datetime.now()
-                    current_weekday = today.weekday()
-
-                    days_map = {
-                        'monday': 0, 'tuesday': 1, 'wednesday': 2,
-                        'thursday': 3, 'friday': 4, 'saturday': 5, 'sunday': 6
-                    }
 
-                    target_day_num = days_map[day.lower()]
-
-                    # Calculate next occurrence of the target day
-                    days_ahead = (target_day_num - current_weekday + 7) % 7
-
-                    # No same-day ordering → push to next week
-                    if days_ahead == 0:
-                        days_ahead = 7
-
-                    order_date = today + timedelta(days=days_ahead)
-                    order_date = order_date.replace(hour=0, minute=0, second=0, microsecond=0)
-
-                    week_number = order_date.isocalendar()[1]
-
-
-                    order_date = today + timedelta(days=days_ahead)
-
-                    week_number = order_date.isocalendar()[1]
-                    order_date = order_date.replace(hour=0, minute=0, second=0, microsecond=0)
+            # Validate the whole cart and compute totals before the first insert
+            daily_orders = group_items_by_day(selected_days, order_items_data)
+            plan, calculated_total_price = plan_orders(
+                user, user_type, daily_orders,
+                is_primary_free=is_primary_free,
+                payment_id=payment_id,
+                child_id=child_id,
+                school_id=school_id,
+                school_type=school_type
+            )
 
-                    order_instance = Order.objects.create(
-                        user_id=user.id,
-                        user_type=user_type,
-                        total_price=0,
-                        week_number=week_number,
-                        year=order_date.year,
-                        order_date=order_date,
-                        selected_day=day,
-                        is_delivered=False,
-                        status='pending',
-                        payment_id=payment_id,
-                        child_id=child_id if user_type in ['parent', 'staff'] and child_id else None,
-                        primary_school_id=school_id if school_type == 'primary' else None,
-                        secondary_school_id=school_id if school_type == 'secondary' else None
+            if not plan:
+                return Response({
+                    'error': 'No orders were created. Please check your order data.'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            # ---------------------------
+            # Handle primary (free meals) - only for children with child_id
+            # ---------------------------
+            if is_primary_free:
+                with transaction.atomic():
+                    created_orders = save_planned_orders(plan)
+
+                    # Record transaction for free meals (amount = 0)
+                    create_order_transactions(
+                        user, user_type, created_orders, 'credits',
+                        "Free meal order #{order_id} for primary school child",
+                        amount=0
                     )
 
-                    daily_total_price = 0
-
-                    # Create OrderItems
-                    for item in items_list:
-                        item_name = item.get('item_name')
-                        quantity = item.get('quantity')
+                    evaluation = enqueue_promotion_evaluation(user, user_type, school_id=school_id, school_type=school_type, current_order_total=calculated_total_price)
 
-                        if not item_name or not quantity:
-                            return Response({'error': 'Each item must have item_name and quantity.'},
-                                            status=status.HTTP_400_BAD_REQUEST)
+                response_data = {
+                    'message': 'Orders created successfully with free meal for child.',
+                    'orders': OrderSerializer(created_orders, many=True).data,
+                    'total_orders': len(created_orders)
+                }
+                response_data['promotion_evaluation_id'] = evaluation.id
+                response_data['pending_promotions'] = cached_pending_promotions(user_type, user.id)
+                return Response(response_data, status=status.HTTP_201_CREATED)
 
-                        menu_item = Menu.objects.filter(menu_day__iexact=day, name__iexact=item_name).first()
-                        if not menu_item:
-                            return Response({'error': f'Menu item with name "{item_name}" not found for {day}.'},
-                                            status=status.HTTP_404_NOT_FOUND)
+            # ---------------------------
+            # Handle credits (secondary without payment_id)
+            # ---------------------------
+            if not payment_id:
+                with transaction.atomic():
+                    created_orders = save_planned_orders(plan)
 
-                    
-                        item_price = 0 if is_primary_free else float(item.get('price', menu_item.price))
+                    # Conditional balance update + one transaction/ledger entry per order
+                    pay_orders_with_credits(user, user_type, created_orders)
 
-                        OrderItem.objects.create(
-                            order=order_instance,
-                            menu=menu_item,
-                            quantity=quantity,
-                            _menu_name=menu_item.name,
-                            _menu_price=item_price
-                        )
+                    evaluation = enqueue_promotion_evaluation(user, user_type, school_id=school_id, school_type=school_type, current_order_total=calculated_total_price)
 
-                        daily_total_price += item_price * quantity
-
-                    order_instance.total_price = daily_total_price
-                    order_instance.save()
-
-                    calculated_total_price += daily_total_price
-                    created_orders.append(order_instance)
-
-                # ---------------------------
-                # Handle primary (free meals) - only for children with child_id
-                # ---------------------------
-                if is_primary_free:
-                    for order in created_orders:
-                        order.status = 'pending'
-                        order.save()
-
-                        # Record transaction for free meals (amount = 0)
-                        Transaction.objects.create(
-                            user_id=user.id,
-                            user_type=user_type,
-                            transaction_type='payment',
-                            payment_method='credits',
-                            amount=0,  # Free meal, no charge
-                            order=order,
-                            description=f"Free meal order #{order.id} for primary school child",
-                            parent=user if user_type == 'parent' else None,
-                            staff=user if user_type == 'staff' else None,
-                            student=user if user_type == 'student' else None
-                        )
+                response_data = {
+                    'message': 'Orders created and credits deducted successfully!',
+                    'orders': OrderSerializer(created_orders, many=True).data,
+                    'total_orders': len(created_orders),
+                    'credits_deducted': calculated_total_price,
+                    'remaining_credits': user.credits
+                }
+                response_data['promotion_evaluation_id'] = evaluation.id
+                response_data['pending_promotions'] = cached_pending_promotions(user_type, user.id)
+                return Response(response_data, status=status.HTTP_201_CREATED)
 
-                    promotion_rewards, pending_promotions = check_and_apply_promotions(user, user_type, school_id=school_id, school_type=school_type, current_order_total=calculated_total_price)
-                    response_data = {
-                        'message': 'Orders created successfully with free meal for child.',
-                        'orders': OrderSerializer(created_orders, many=True).data,
-                        'total_orders': len(created_orders)
-                    }
-                    if promotion_rewards:
-                        response_data['promotion_rewards'] = promotion_rewards
-                    response_data['pending_promotions'] = pending_promotions
-                    return Response(response_data, status=status.HTTP_201_CREATED)
-
-                # ---------------------------
-                # Handle credits (secondary without payment_id)
-                # ---------------------------
-                if not payment_id:
-                    if user.credits < calculated_total_price:
-                        raise ValueError("Insufficient credits to complete the order.")
-
-                    # Check if orders were actually created
-                    if not created_orders:
-                        return Response({
-                            'error': 'No orders were created. Please check your order data.'
-                        }, status=status.HTTP_400_BAD_REQUEST)
-
-                    user.credits -= calculated_total_price
-                    user.save()
-
-                    # Create transaction record for credit payment
-                    for order in created_orders:
-                        order.status = 'pending'
-                        order.save()
-
-                        # Record transaction for each order
-                        Transaction.objects.create(
-                            user_id=user.id,
-                            user_type=user_type,
-                            transaction_type='payment',
-                            payment_method='credits',
-                            amount=-order.total_price,  # Negative because credits deducted
-                            order=order,
-                            description=f"Payment for order #{order.id} using credits",
-                            parent=user if user_type == 'parent' else None,
-                            staff=user if user_type == 'staff' else None,
-                            student=user if user_type == 'student' else None
-                        )
+            # ---------------------------
+            # Handle Stripe payment (secondary with payment_id)
+            # Phase 1 commits the orders as awaiting payment, Stripe is called
+            # with no transaction open, phase 2 confirms them. Checkouts
+            # interrupted in between are settled by `reconcile_checkout_payments`.
+            # ---------------------------
+            checkout_ref = new_checkout_ref()
+            for order, _ in plan:
+                order.payment_id = checkout_ref
+                order.status = AWAITING_PAYMENT
 
-                    promotion_rewards, pending_promotions = check_and_apply_promotions(user, user_type, school_id=school_id, school_type=school_type, current_order_total=calculated_total_price)
-                    response_data = {
-                        'message': 'Orders created and credits deducted successfully!',
-                        'orders': OrderSerializer(created_orders, many=True).data,
-                        'total_orders': len(created_orders),
-                        'credits_deducted': calculated_total_price,
-                        'remaining_credits': user.credits
-                    }
-                    if promotion_rewards:
-                        response_data['promotion_rewards'] = promotion_rewards
-                    response_data['pending_promotions'] = pending_promotions
-                    return Response(response_data, status=status.HTTP_201_CREATED)
-
-                # ---------------------------
-                # Handle Stripe payment (secondary with payment_id)
-                # ---------------------------
-                # Check if orders were actually created
-                if not created_orders:
-                    return Response({
-                        'error': 'No orders were created. Please check your order data.'
-                    }, status=status.HTTP_400_BAD_REQUEST)
+            with transaction.atomic():
+                created_orders = save_planned_orders(plan)
 
-                total_price_in_cents = int(calculated_total_price * 100)
+            gateway = get_stripe()
+            total_price_in_cents = int(calculated_total_price * 100)
 
-                customers = stripe.Customer.list(email=user.email).data
-                if customers:
-                    customer = customers[0]
-                else:
-                    customer = stripe.Customer.create(
-                        email=user.email,
-                        name=f"{getattr(user, 'first_name', '')} {getattr(user, 'last_name', '')}".strip()
-                    )
+            intent_requested = False
+            try:
+                customer_id = resolve_stripe_customer_id(user, gateway)
 
-                stripe.PaymentMethod.attach(payment_id, customer=customer.id)
-                stripe.Customer.modify(customer.id, invoice_settings={"default_payment_method": payment_id})
+                gateway.PaymentMethod.attach(payment_id, customer=customer_id)
+                gateway.Customer.modify(customer_id, invoice_settings={"default_payment_method": payment_id})
 
-                payment_intent = stripe.PaymentIntent.create(
+                intent_requested = True
+                payment_intent = gateway.PaymentIntent.create(
                     amount=total_price_in_cents,
                     currency="eur",
-                    customer=customer.id,
+                    customer=customer_id,
                     payment_method=payment_id,
                     confirmation_method="manual",
                     confirm=True,
                     receipt_email=user.email,
                     return_url=f"{request.scheme}://{request.get_host()}/payment-success/",
+                    metadata={'checkout_ref': checkout_ref},
+                    idempotency_key=checkout_ref,
                 )
-
-                # Create transaction record for Stripe payment
-                for order in created_orders:
-                    order.payment_id = payment_intent.id
-                    order.status = 'pending'
-                    order.save()
-
-                    # Record transaction for each order
-                    Transaction.objects.create(
-                        user_id=user.id,
-                        user_type=user_type,
-                        transaction_type='payment',
-                        payment_method='stripe',
-                        amount=-order.total_price,  # Negative because payment made
-                        order=order,
-                        payment_intent_id=payment_intent.id,
-                        description=f"Payment for order #{order.id} via Stripe",
-                        parent=user if user_type == 'parent' else None,
-                        staff=user if user_type == 'staff' else None,
-                        student=user if user_type == 'student' else None
-                    )
-
-                promotion_rewards, pending_promotions = check_and_apply_promotions(user, user_type, school_id=school_id, school_type=school_type, current_order_total=calculated_total_price)
-                response_data = {
-                    'message': 'Orders and payment intent created successfully!',
+            except (stripe.error.CardError, stripe.error.InvalidRequestError):
+                # Stripe answered and nothing was charged
+                rollback_checkout(checkout_ref)
+                raise
+            except Exception:
+                if not intent_requested:
+                    rollback_checkout(checkout_ref)
+                    raise
+                # Timeout, connection error or 5xx: the intent may exist and be
+                # charged, so the orders stay awaiting payment until
+                # reconcile_checkout_payments finds it by its checkout_ref metadata
+                logger.warning("Checkout %s left awaiting payment after a Stripe error", checkout_ref, exc_info=True)
+                return Response({
+                    'message': 'Payment is being confirmed. Your orders will be confirmed or cancelled shortly.',
                     'orders': OrderSerializer(created_orders, many=True).data,
-                    'payment_intent': payment_intent.client_secret,
+                    'checkout_ref': checkout_ref,
                     'total_orders': len(created_orders),
-                    'total_paid': calculated_total_price
-                }
-                if promotion_rewards:
-                    response_data['promotion_rewards'] = promotion_rewards
-                response_data['pending_promotions'] = pending_promotions
-                return Response(response_data, status=status.HTTP_201_CREATED)
+                }, status=status.HTTP_202_ACCEPTED)
 
+            with transaction.atomic():
+                confirm_checkout_payment(user, user_type, created_orders, payment_intent.id)
+                evaluation = enqueue_promotion_evaluation(user, user_type, school_id=school_id, school_type=school_type, current_order_total=calculated_total_price)
+
+            response_data = {
+                'message': 'Orders and payment intent created successfully!',
+                'orders': OrderSerializer(created_orders, many=True).data,
+                'payment_intent': payment_intent.client_secret,
+                'total_orders': len(created_orders),
+                'total_paid': calculated_total_price
+            }
+            response_data['promotion_evaluation_id'] = evaluation.id
+            response_data['pending_promotions'] = cached_pending_promotions(user_type, user.id)
+            return Response(response_data, status=status.HTTP_201_CREATED)
+
+        except CheckoutError as e:
+            return Response({'error': str(e)}, status=e.status_code)
+        except IntegrityError as e:
+            active_order = find_child_day_conflict(child_id, plan) if is_child_day_conflict(e) else None
+            if not active_order:
+                return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return Response({
+                'error': f'This child already has an order for {active_order.selected_day} in week {active_order.week_number}. Cancel the existing order to place a new one.',
+            }, status=status.HTTP_400_BAD_REQUEST)
         except stripe.error.CardError as e:
             return Response({"error": f"Card Error: {e.user_message}"}, status=status.HTTP_400_BAD_REQUEST)
         except ValueError as e:
@@ -3226,6 +2714,7 @@ class CreateOrderAndPaymentAPIView(APIView):
 
 
 @api_view(['POST'])
+@idempotent
 def top_up_payment(request):
     """
     API to process top-up credits for a parent, staff, or student.
@@ -3259,28 +2748,23 @@ def top_up_payment(request):
             return Response({"error": "Invalid amount."}, status=status.HTTP_400_BAD_REQUEST)
 
         # ✅ Ensure customer exists
-        if not getattr(user, "stripe_customer_id", None):
-            customer = stripe.Customer.create(
-                name=f"{user.first_name} {user.last_name}",
-                email=user.email,
-            )
-            user.stripe_customer_id = customer.id
-            user.save()
+        gateway = get_stripe()
+        resolve_stripe_customer_id(user, gateway)
 
         # ✅ Attach payment method
-        stripe.PaymentMethod.attach(
+        gateway.PaymentMethod.attach(
             payment_method_id,
             customer=user.stripe_customer_id,
         )
 
         # ✅ Update default payment method
-        stripe.Customer.modify(
+        gateway.Customer.modify(
             user.stripe_customer_id,
             invoice_settings={"default_payment_method": payment_method_id}
         )
 
         # ✅ Create PaymentIntent (card only, no redirects)
-        payment_intent = stripe.PaymentIntent.create(
+        payment_intent = gateway.PaymentIntent.create(
             amount=amount_in_cents,
             currency="eur",
             customer=user.stripe_customer_id,
@@ -3293,20 +2777,12 @@ def top_up_payment(request):
 
         # ✅ On success → top up credits
         if payment_intent.status == 'succeeded':
-            user.top_up_credits(float(amount))
-
-            # Create transaction record for credit top-up
-            Transaction.objects.create(
-                user_id=user.id,
-                user_type=user_type,
-                transaction_type='credit',
+            credit_account(
+                user, user_type, float(amount),
+                kind='top_up',
                 payment_method='stripe',
-                amount=float(amount),  # Positive because credits added
                 payment_intent_id=payment_intent.id,
-                description=f"Credit top-up of €{amount} via Stripe",
-                parent=user if user_type == 'parent' else None,
-                staff=user if user_type == 'staff' else None,
-                student=user if user_type == 'student' else None
+                description=f"Credit top-up of €{amount} via Stripe"
             )
 
             return Response({
@@ -3585,7 +3061,7 @@ def fetch_orders(school_id, school_type, target_day=None):
     orders = (
         Order.objects
         .filter(**filter_kwargs)
-        .exclude(status__iexact="cancelled") 
+        .exclude(status__in=UNPLACED_STATUSES)
         .order_by("selected_day")
     )
     
@@ -4781,6 +4257,9 @@ def deactivate_menus(request):
             menu.is_active = False
             menu.save()
 
+    # Menus left without a school were deactivated, so no other school's menu changed
+    invalidate_school_menus([(school_type, school.id)])
+    transaction.on_commit(lambda: publish_menu_snapshot(school_type, school.id))
     return Response({'message': f'Cycle "{cycle_name}" deactivated for {school.school_name if school_type == "primary" else school.secondary_school_name}.'}, status=status.HTTP_200_OK)
 
 
@@ -4790,6 +4269,9 @@ def create_cycle(request):
     cycle_name = request.data.get('cycle_name')
     menu_date = datetime.now().date()
 
+    if not cycle_name:
+        return Response({'error': 'Cycle name is required'}, status=status.HTTP_400_BAD_REQUEST)
+
     # Validate cycle name
     if not cycle_name.isalnum() and " " not in cycle_name:
         return Response({'error': 'Cycle Name cannot contain special characters!'}, status=status.HTTP_400_BAD_REQUEST)
@@ -4798,62 +4280,16 @@ def create_cycle(request):
     if Menu.objects.filter(cycle_name=cycle_name).exists():
         return Response({'error': 'A menu with the same cycle name already exists.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Define the days
-    days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
-    created_menus = []
-
-    # Iterate through each day
-    for day in days:
-        categories = request.data.get(f'category_{day}')
-        item_names = request.data.get(f'item_names_{day}')
-        prices = request.data.get(f'price_{day}')
-
-        # Skip processing for this day if any of the required fields are None, empty list, or filled with only null or empty values
-        if not categories or not item_names or not prices or \
-           all(val is None or val == "" for val in categories + item_names + prices):
-            continue
-
-        # Check if the data for the day is in the correct format (list of values)
-        if not isinstance(categories, list) or not isinstance(item_names, list) or not isinstance(prices, list):
-            return Response({'error': f'Invalid data format for {day}. Expecting lists of categories, item names, and prices.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Ensure the lengths of the lists are consistent
-        if len(categories) != len(item_names) or len(item_names) != len(prices):
-            return Response({'error': f'Inconsistent data length for {day}. Categories, item names, and prices must have the same number of items.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Process each menu item for the day
-        for category_id, menu_name, price in zip(categories, item_names, prices):
-            # Skip invalid or incomplete data (empty or null values)
-            if category_id is None or not menu_name or price is None or price == "":
-                continue
-
-            try:
-                price = float(price)
-                if price < 0:
-                    return Response({'error': f'Price for {menu_name} on {day} must be positive.'}, status=status.HTTP_400_BAD_REQUEST)
-            except ValueError:
-                return Response({'error': f'Invalid price format for {menu_name} on {day}.'}, status=status.HTTP_400_BAD_REQUEST)
+    # Validate every day before inserting anything
+    try:
+        rows = parse_cycle_rows(request.data)
+    except CycleError as e:
+        return Response({'error': str(e)}, status=e.status_code)
 
-            # Check if the category exists
-            try:
-                category = Categories.objects.get(id=category_id)
-            except Categories.DoesNotExist:
-                return Response({'error': f'Category {category_id} not found for {menu_name} on {day}.'}, status=status.HTTP_404_NOT_FOUND)
-
-            # Create and save the menu item
-            menu = Menu(
-                name=menu_name,
-                price=price,
-                menu_day=day,
-                cycle_name=cycle_name,
-                menu_date=menu_date,
-                category=category
-            )
-            menu.save()
-            created_menus.append(MenuSerializer(menu).data)
+    created_menus = create_cycle_menus(cycle_name, rows, menu_date)
 
     # Return a success response with the created menus
-    return Response({'message': 'Menus created successfully!', 'menus': created_menus}, status=status.HTTP_201_CREATED)
+    return Response({'message': 'Menus created successfully!', 'menus': MenuSerializer(created_menus, many=True).data}, status=status.HTTP_201_CREATED)
 
 
 @api_view(['POST', 'PUT', 'DELETE'])
@@ -4865,84 +4301,22 @@ def get_cycle_menus(request):
 
     # ✅ Fetch Menus
     if request.method == 'POST':
-        menus = Menu.objects.filter(cycle_name=cycle_name)
+        menus = Menu.objects.filter(cycle_name=cycle_name, is_deleted=False).select_related('category')
         if not menus.exists():
             return Response({'error': f'No menus found for cycle name: {cycle_name}'}, status=status.HTTP_404_NOT_FOUND)
 
         serialized_menus = MenuSerializer(menus, many=True)
         return Response({'message': 'Menus fetched successfully!', 'menus': serialized_menus.data}, status=status.HTTP_200_OK)
 
-    # ✅ Update/Replace Menus - SAME FORMAT AS create_cycle
+    # ✅ Update Menus - SAME FORMAT AS create_cycle, matched to the existing rows by (day, name)
     elif request.method == 'PUT':
-        menu_date = datetime.now().date()
-
-        # Delete old menus for this cycle
-        Menu.objects.filter(cycle_name=cycle_name).delete()
-
-        # Define the days
-        days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
-        created_menus = []
-
-        # Iterate through each day
-        for day in days:
-            categories = request.data.get(f'category_{day}')
-            item_names = request.data.get(f'item_names_{day}')
-            prices = request.data.get(f'price_{day}')
-
-            # Skip processing for this day if any of the required fields are None, empty list, or filled with only null or empty values
-            if not categories or not item_names or not prices or \
-               all(val is None or val == "" for val in categories + item_names + prices):
-                continue
-
-            # Check if the data for the day is in the correct format (list of values)
-            if not isinstance(categories, list) or not isinstance(item_names, list) or not isinstance(prices, list):
-                return Response({'error': f'Invalid data format for {day}. Expecting lists of categories, item names, and prices.'}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Ensure the lengths of the lists are consistent
-            if len(categories) != len(item_names) or len(item_names) != len(prices):
-                return Response({'error': f'Inconsistent data length for {day}. Categories, item names, and prices must have the same number of items.'}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Process each menu item for the day
-            for category_data, menu_name, price in zip(categories, item_names, prices):
-                # Skip invalid or incomplete data (empty or null values)
-                if category_data is None or not menu_name or price is None or price == "":
-                    continue
-
-                try:
-                    price = float(price)
-                    if price < 0:
-                        return Response({'error': f'Price for {menu_name} on {day} must be positive.'}, status=status.HTTP_400_BAD_REQUEST)
-                except ValueError:
-                    return Response({'error': f'Invalid price format for {menu_name} on {day}.'}, status=status.HTTP_400_BAD_REQUEST)
-
-                # Handle category - it could be ID (integer) or name (string)
-                if isinstance(category_data, str):
-                    # Try to find category by name
-                    try:
-                        category = Categories.objects.get(name_category=category_data)
-                    except Categories.DoesNotExist:
-                        return Response({'error': f'Category "{category_data}" not found for {menu_name} on {day}.'}, status=status.HTTP_404_NOT_FOUND)
-                else:
-                    # Assume it's a category ID
-                    try:
-                        category = Categories.objects.get(id=category_data)
-                    except Categories.DoesNotExist:
-                        return Response({'error': f'Category ID {category_data} not found for {menu_name} on {day}.'}, status=status.HTTP_404_NOT_FOUND)
-
-                # Create and save the menu item
-                menu = Menu(
-                    name=menu_name,
-                    price=price,
-                    menu_day=day,
-                    cycle_name=cycle_name,
-                    menu_date=menu_date,
-                    category=category
-                )
-                menu.save()
-                created_menus.append(MenuSerializer(menu).data)
+        try:
+            rows = parse_cycle_rows(request.data)
+        except CycleError as e:
+            return Response({'error': str(e)}, status=e.status_code)
 
-        # Return a success response with the created menus
-        return Response({'message': 'Menus updated successfully!', 'menus': created_menus}, status=status.HTTP_200_OK)
+        menus = save_cycle_edit(cycle_name, rows, datetime.now().date())
+        return Response({'message': 'Menus updated successfully!', 'menus': MenuSerializer(menus, many=True).data}, status=status.HTTP_200_OK)
 
     # ✅ Delete Menus
     elif request.method == 'DELETE':
@@ -4950,44 +4324,41 @@ def get_cycle_menus(request):
         if not menus.exists():
             return Response({'error': f'No menus found for cycle name: {cycle_name}'}, status=status.HTTP_404_NOT_FOUND)
 
-        deleted_count, _ = menus.delete()
+        with transaction.atomic():
+            # The menus' school links go with them, so collect the schools first
+            schools = linked_schools(menus.values('id'))
+            deleted_count, _ = menus.delete()
+        invalidate_school_menus(schools)
         return Response({'message': f'{deleted_count} menus deleted successfully.'}, status=status.HTTP_200_OK)
 @api_view(['GET'])
 def get_all_cycles_with_menus(request):
-    # Fetch all menus in a single query, then group in Python
-    all_menus = list(
-        Menu.objects.order_by('cycle_name', 'id')
-        .values(
-            'id',
-            'cycle_name',
-            'name',
-            'category',
-            'menu_date',
-            'menu_day',
-            'price',
-            'primary_schools__id',
-            'primary_schools__school_name',
-            'secondary_schools__id',
-            'secondary_schools__secondary_school_name',
-        )
-    )
+    """
+    Cycles with their menus, one page at a time (ordered by cycle name).
+    Query params: cursor, limit (default 20, max 100), active_only (default false),
+    exclude_deleted (default true)
+    """
+    cursor = request.query_params.get('cursor')
+    try:
+        limit = parse_page_size(request.query_params.get('limit'))
+        after = decode_cursor(cursor, 1)[0] if cursor else None
+    except ValueError:
+        return Response({'error': 'Invalid cursor or limit.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    if not all_menus:
-        return Response({'error': 'No cycle names found'}, status=status.HTTP_404_NOT_FOUND)
+    active_only = request.query_params.get('active_only', 'false').lower() in ('true', '1')
+    exclude_deleted = request.query_params.get('exclude_deleted', 'true').lower() in ('true', '1')
 
-    cycles_map = defaultdict(list)
-    for menu in all_menus:
-        cycles_map[menu['cycle_name']].append(menu)
+    cycles_with_menus, has_more = list_cycles_with_menus(
+        after=after, limit=limit, active_only=active_only, exclude_deleted=exclude_deleted
+    )
 
-    cycles_with_menus = [
-        {'cycle_name': name, 'menus': menus}
-        for name, menus in cycles_map.items()
-    ]
+    if not cycles_with_menus and not cursor:
+        return Response({'error': 'No cycle names found'}, status=status.HTTP_404_NOT_FOUND)
 
     return Response(
         {
             'message': 'Cycles and their menus fetched successfully!',
-            'cycles': cycles_with_menus
+            'cycles': cycles_with_menus,
+            'next_cursor': encode_cursor([cycles_with_menus[-1]['cycle_name']]) if has_more else None
         },
         status=status.HTTP_200_OK
     )
@@ -5006,8 +4377,7 @@ def duplicate_cycle(request):
         )
 
     # Check if original cycle exists
-    menus = Menu.objects.filter(cycle_name=original_cycle_name)
-    if not menus.exists():
+    if not Menu.objects.filter(cycle_name=original_cycle_name, is_deleted=False).exists():
         return Response(
             {"error": f"No menus found for cycle '{original_cycle_name}'"},
             status=status.HTTP_404_NOT_FOUND
@@ -5020,17 +4390,23 @@ def duplicate_cycle(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    # The copy is never assigned to schools here; with include_source_schools
+    # the response lists the original's schools for activate_cycle_bulk
+    include_source_schools = str(request.data.get("include_source_schools", "")).lower() in ("true", "1")
+
     try:
-        with transaction.atomic():
-            new_menus = []
-            for menu in menus:
-                menu.pk = None  # Reset PK so Django creates a new record
-                menu.cycle_name = new_cycle_name
-                new_menus.append(menu)
-            Menu.objects.bulk_create(new_menus)
+        new_menus, schools = duplicate_cycle_menus(
+            original_cycle_name, new_cycle_name, include_source_schools=include_source_schools
+        )
 
+        data = {
+            "message": f"Cycle '{original_cycle_name}' duplicated as '{new_cycle_name}' successfully!",
+            "menus": MenuSerializer(new_menus, many=True).data
+        }
+        if include_source_schools:
+            data["source_schools"] = schools
         return Response(
-            {"message": f"Cycle '{original_cycle_name}' duplicated as '{new_cycle_name}' successfully!"},
+            data,
             status=status.HTTP_201_CREATED
         )
     except Exception as e:
@@ -5317,6 +4693,7 @@ def make_menu_available(request):
 
     menu_item.is_available = True
     menu_item.save()
+    invalidate_active_menus(menu_item.menus.values('id'))
 
     return Response({
         'message': f'Menu item "{menu_item.item_name}" is now available.',
@@ -5339,6 +4716,7 @@ def make_menu_unavailable(request):
 
     menu_item.is_available = False
     menu_item.save()
+    invalidate_active_menus(menu_item.menus.values('id'))
 
     return Response({
         'message': f'Menu item "{menu_item.item_name}" is now unavailable.',
@@ -5406,6 +4784,7 @@ class CreateManagerOrderAPIView(APIView):
     Applies same ordering window as secondary schools (Friday 2pm cutoff; 2pm per-day cutoff).
     """
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         try:
             import pytz
@@ -5461,6 +4840,9 @@ class CreateManagerOrderAPIView(APIView):
                     return Response({"error": "Each item must include a day."}, status=status.HTTP_400_BAD_REQUEST)
                 grouped_items.setdefault(day.lower(), []).append(item)
 
+            # Match cart names to MenuItems records in one query (custom names are allowed)
+            menu_items = resolve_menu_items(str(item.get("item") or "") for item in cart_items)
+
             created_orders = []
             with transaction.atomic():
                 for day, items in grouped_items.items():
@@ -5515,8 +4897,7 @@ class CreateManagerOrderAPIView(APIView):
                         if not item_name:
                             return Response({"error": "Item name is required for each cart item."}, status=status.HTTP_400_BAD_REQUEST)
 
-                        # Try to match to a MenuItems record (optional — custom names are allowed)
-                        menu_item = MenuItems.objects.filter(item_name__iexact=item_name).first()
+                        menu_item = menu_items.get(item_name.lower())
 
                         ManagerOrderItem.objects.create(
                             order=order,
@@ -5831,11 +5212,11 @@ def get_dashboard_analytics(request):
         start_date = request.GET.get('start_date')
         end_date = request.GET.get('end_date')
 
-        orders_query = Order.objects.all()
+        orders_query = Order.objects.exclude(status=AWAITING_PAYMENT)
         if start_date:
-            orders_query = orders_query.filter(order_date__date__gte=start_date)
+            orders_query = orders_query.filter(delivery_date__gte=start_date)
         if end_date:
-            orders_query = orders_query.filter(order_date__date__lte=end_date)
+            orders_query = orders_query.filter(delivery_date__lte=end_date)
 
         # Calculate totals
         total_orders = orders_query.count()
@@ -5906,11 +5287,11 @@ def get_school_analytics(request):
         filter_end = request.GET.get('end_date')
 
         # Build order date filter Q objects
-        order_date_q = Q()
+        order_date_q = ~Q(order__status=AWAITING_PAYMENT)
         if filter_start:
-            order_date_q &= Q(order__order_date__date__gte=filter_start)
+            order_date_q &= Q(order__delivery_date__gte=filter_start)
         if filter_end:
-            order_date_q &= Q(order__order_date__date__lte=filter_end)
+            order_date_q &= Q(order__delivery_date__lte=filter_end)
 
         # Calculate week dates FIRST so they can be used in annotations below
         today = datetime.now().date()
@@ -5932,7 +5313,7 @@ def get_school_analytics(request):
         week_4_start = week_3_end + timedelta(days=1)
         week_4_end = week_4_start + timedelta(days=6)
 
-        not_cancelled = ~Q(order__status='cancelled')
+        placed = ~Q(order__status__in=UNPLACED_STATUSES)
 
         schools_data = []
 
@@ -5951,10 +5332,10 @@ def get_school_analytics(request):
             cancelled_orders_count=Count('order', filter=Q(order__status='cancelled') & order_date_q, distinct=True),
             student_count_total=Count('student', distinct=True),
             children_count_total=Count('student', filter=Q(student__parent__isnull=False), distinct=True),
-            week_1_orders=Count('order', filter=Q(order__order_date__date__gte=week_1_start, order__order_date__date__lte=week_1_end) & not_cancelled, distinct=True),
-            week_2_orders=Count('order', filter=Q(order__order_date__date__gte=week_2_start, order__order_date__date__lte=week_2_end) & not_cancelled, distinct=True),
-            week_3_orders=Count('order', filter=Q(order__order_date__date__gte=week_3_start, order__order_date__date__lte=week_3_end) & not_cancelled, distinct=True),
-            week_4_orders=Count('order', filter=Q(order__order_date__date__gte=week_4_start, order__order_date__date__lte=week_4_end) & not_cancelled, distinct=True),
+            week_1_orders=Count('order', filter=Q(order__delivery_date__gte=week_1_start, order__delivery_date__lte=week_1_end) & placed, distinct=True),
+            week_2_orders=Count('order', filter=Q(order__delivery_date__gte=week_2_start, order__delivery_date__lte=week_2_end) & placed, distinct=True),
+            week_3_orders=Count('order', filter=Q(order__delivery_date__gte=week_3_start, order__delivery_date__lte=week_3_end) & placed, distinct=True),
+            week_4_orders=Count('order', filter=Q(order__delivery_date__gte=week_4_start, order__delivery_date__lte=week_4_end) & placed, distinct=True),
         ).prefetch_related(
             Prefetch('menus', queryset=Menu.objects.filter(is_active=True))
         )
@@ -5963,16 +5344,16 @@ def get_school_analytics(request):
         primary_orders_grouped = (
             Order.objects.filter(
                 primary_school__isnull=False,
-                order_date__date__gte=start_date,
-                order_date__date__lte=end_date,
+                delivery_date__gte=start_date,
+                delivery_date__lte=end_date,
             )
-            .exclude(status='cancelled')
-            .values('primary_school_id', 'order_date__date')
+            .exclude(status__in=UNPLACED_STATUSES)
+            .values('primary_school_id', 'delivery_date')
             .annotate(count=Count('id'))
         )
         primary_orders_map = defaultdict(dict)
         for row in primary_orders_grouped:
-            date_str = row['order_date__date'].strftime('%Y-%m-%d')
+            date_str = row['delivery_date'].strftime('%Y-%m-%d')
             primary_orders_map[row['primary_school_id']][date_str] = row['count']
 
         for school in primary_schools:
@@ -6009,10 +5390,10 @@ def get_school_analytics(request):
             collected_orders_count=Count('order', filter=Q(order__status='collected') & order_date_q, distinct=True),
             cancelled_orders_count=Count('order', filter=Q(order__status='cancelled') & order_date_q, distinct=True),
             student_count_total=Count('student', distinct=True),
-            week_1_orders=Count('order', filter=Q(order__order_date__date__gte=week_1_start, order__order_date__date__lte=week_1_end) & not_cancelled, distinct=True),
-            week_2_orders=Count('order', filter=Q(order__order_date__date__gte=week_2_start, order__order_date__date__lte=week_2_end) & not_cancelled, distinct=True),
-            week_3_orders=Count('order', filter=Q(order__order_date__date__gte=week_3_start, order__order_date__date__lte=week_3_end) & not_cancelled, distinct=True),
-            week_4_orders=Count('order', filter=Q(order__order_date__date__gte=week_4_start, order__order_date__date__lte=week_4_end) & not_cancelled, distinct=True),
+            week_1_orders=Count('order', filter=Q(order__delivery_date__gte=week_1_start, order__delivery_date__lte=week_1_end) & placed, distinct=True),
+            week_2_orders=Count('order', filter=Q(order__delivery_date__gte=week_2_start, order__delivery_date__lte=week_2_end) & placed, distinct=True),
+            week_3_orders=Count('order', filter=Q(order__delivery_date__gte=week_3_start, order__delivery_date__lte=week_3_end) & placed, distinct=True),
+            week_4_orders=Count('order', filter=Q(order__delivery_date__gte=week_4_start, order__delivery_date__lte=week_4_end) & placed, distinct=True),
         ).prefetch_related(
             Prefetch('menus', queryset=Menu.objects.filter(is_active=True))
         )
@@ -6021,16 +5402,16 @@ def get_school_analytics(request):
         secondary_orders_grouped = (
             Order.objects.filter(
                 secondary_school__isnull=False,
-                order_date__date__gte=start_date,
-                order_date__date__lte=end_date,
+                delivery_date__gte=start_date,
+                delivery_date__lte=end_date,
             )
-            .exclude(status='cancelled')
-            .values('secondary_school_id', 'order_date__date')
+            .exclude(status__in=UNPLACED_STATUSES)
+            .values('secondary_school_id', 'delivery_date')
             .annotate(count=Count('id'))
         )
         secondary_orders_map = defaultdict(dict)
         for row in secondary_orders_grouped:
-            date_str = row['order_date__date'].strftime('%Y-%m-%d')
+            date_str = row['delivery_date'].strftime('%Y-%m-%d')
             secondary_orders_map[row['secondary_school_id']][date_str] = row['count']
 
         for school in secondary_schools:
@@ -6084,11 +5465,11 @@ def stream_school_analytics(request):
         filter_start = request.GET.get('start_date')
         filter_end = request.GET.get('end_date')
 
-        order_date_q = Q()
+        order_date_q = ~Q(order__status=AWAITING_PAYMENT)
         if filter_start:
-            order_date_q &= Q(order__order_date__date__gte=filter_start)
+            order_date_q &= Q(order__delivery_date__gte=filter_start)
         if filter_end:
-            order_date_q &= Q(order__order_date__date__lte=filter_end)
+            order_date_q &= Q(order__delivery_date__lte=filter_end)
 
         today = datetime.now().date()
         start_of_current_week = today - timedelta(days=today.weekday())
@@ -6109,7 +5490,7 @@ def stream_school_analytics(request):
         week_4_start = week_3_end + timedelta(days=1)
         week_4_end = week_4_start + timedelta(days=6)
 
-        not_cancelled = ~Q(order__status='cancelled')
+        placed = ~Q(order__status__in=UNPLACED_STATUSES)
 
         date_range = []
         current = start_date
@@ -6125,23 +5506,23 @@ def stream_school_analytics(request):
             cancelled_orders_count=Count('order', filter=Q(order__status='cancelled') & order_date_q, distinct=True),
             student_count_total=Count('student', distinct=True),
             children_count_total=Count('student', filter=Q(student__parent__isnull=False), distinct=True),
-            week_1_orders=Count('order', filter=Q(order__order_date__date__gte=week_1_start, order__order_date__date__lte=week_1_end) & not_cancelled, distinct=True),
-            week_2_orders=Count('order', filter=Q(order__order_date__date__gte=week_2_start, order__order_date__date__lte=week_2_end) & not_cancelled, distinct=True),
-            week_3_orders=Count('order', filter=Q(order__order_date__date__gte=week_3_start, order__order_date__date__lte=week_3_end) & not_cancelled, distinct=True),
-            week_4_orders=Count('order', filter=Q(order__order_date__date__gte=week_4_start, order__order_date__date__lte=week_4_end) & not_cancelled, distinct=True),
+            week_1_orders=Count('order', filter=Q(order__delivery_date__gte=week_1_start, order__delivery_date__lte=week_1_end) & placed, distinct=True),
+            week_2_orders=Count('order', filter=Q(order__delivery_date__gte=week_2_start, order__delivery_date__lte=week_2_end) & placed, distinct=True),
+            week_3_orders=Count('order', filter=Q(order__delivery_date__gte=week_3_start, order__delivery_date__lte=week_3_end) & placed, distinct=True),
+            week_4_orders=Count('order', filter=Q(order__delivery_date__gte=week_4_start, order__delivery_date__lte=week_4_end) & placed, distinct=True),
         ).prefetch_related(
             Prefetch('menus', queryset=Menu.objects.filter(is_active=True))
         )
 
         primary_orders_grouped = (
-            Order.objects.filter(primary_school__isnull=False, order_date__date__gte=start_date, order_date__date__lte=end_date)
-            .exclude(status='cancelled')
-            .values('primary_school_id', 'order_date__date')
+            Order.objects.filter(primary_school__isnull=False, delivery_date__gte=start_date, delivery_date__lte=end_date)
+            .exclude(status__in=UNPLACED_STATUSES)
+            .values('primary_school_id', 'delivery_date')
             .annotate(count=Count('id'))
         )
         primary_orders_map = defaultdict(dict)
         for row in primary_orders_grouped:
-            primary_orders_map[row['primary_school_id']][row['order_date__date'].strftime('%Y-%m-%d')] = row['count']
+            primary_orders_map[row['primary_school_id']][row['delivery_date'].strftime('%Y-%m-%d')] = row['count']
 
         for school in primary_schools:
             counts = primary_orders_map.get(school.id, {})
@@ -6154,23 +5535,23 @@ def stream_school_analytics(request):
             collected_orders_count=Count('order', filter=Q(order__status='collected') & order_date_q, distinct=True),
             cancelled_orders_count=Count('order', filter=Q(order__status='cancelled') & order_date_q, distinct=True),
             student_count_total=Count('student', distinct=True),
-            week_1_orders=Count('order', filter=Q(order__order_date__date__gte=week_1_start, order__order_date__date__lte=week_1_end) & not_cancelled, distinct=True),
-            week_2_orders=Count('order', filter=Q(order__order_date__date__gte=week_2_start, order__order_date__date__lte=week_2_end) & not_cancelled, distinct=True),
-            week_3_orders=Count('order', filter=Q(order__order_date__date__gte=week_3_start, order__order_date__date__lte=week_3_end) & not_cancelled, distinct=True),
-            week_4_orders=Count('order', filter=Q(order__order_date__date__gte=week_4_start, order__order_date__date__lte=week_4_end) & not_cancelled, distinct=True),
+            week_1_orders=Count('order', filter=Q(order__delivery_date__gte=week_1_start, order__delivery_date__lte=week_1_end) & placed, distinct=True),
+            week_2_orders=Count('order', filter=Q(order__delivery_date__gte=week_2_start, order__delivery_date__lte=week_2_end) & placed, distinct=True),
+            week_3_orders=Count('order', filter=Q(order__delivery_date__gte=week_3_start, order__delivery_date__lte=week_3_end) & placed, distinct=True),
+            week_4_orders=Count('order', filter=Q(order__delivery_date__gte=week_4_start, order__delivery_date__lte=week_4_end) & placed, distinct=True),
         ).prefetch_related(
             Prefetch('menus', queryset=Menu.objects.filter(is_active=True))
         )
 
         secondary_orders_grouped = (
-            Order.objects.filter(secondary_school__isnull=False, order_date__date__gte=start_date, order_date__date__lte=end_date)
-            .exclude(status='cancelled')
-            .values('secondary_school_id', 'order_date__date')
+            Order.objects.filter(secondary_school__isnull=False, delivery_date__gte=start_date, delivery_date__lte=end_date)
+            .exclude(status__in=UNPLACED_STATUSES)
+            .values('secondary_school_id', 'delivery_date')
             .annotate(count=Count('id'))
         )
         secondary_orders_map = defaultdict(dict)
         for row in secondary_orders_grouped:
-            secondary_orders_map[row['secondary_school_id']][row['order_date__date'].strftime('%Y-%m-%d')] = row['count']
+            secondary_orders_map[row['secondary_school_id']][row['delivery_date'].strftime('%Y-%m-%d')] = row['count']
 
         for school in secondary_schools:
             counts = secondary_orders_map.get(school.id, {})
@@ -6203,12 +5584,12 @@ def get_top_items(request):
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
         
         # Get orders with filtering
-        orders = Order.objects.all()
+        orders = Order.objects.exclude(status=AWAITING_PAYMENT)
 
         if start_date and end_date:
             orders = orders.filter(
-                order_date__date__gte=start_date,
-                order_date__date__lte=end_date
+                delivery_date__gte=start_date,
+                delivery_date__lte=end_date
             )
 
         if school_id and school_type:
@@ -6261,12 +5642,12 @@ def get_least_favorite_items(request):
         if end_date:
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
         
-        orders = Order.objects.all()
+        orders = Order.objects.exclude(status=AWAITING_PAYMENT)
 
         if start_date and end_date:
             orders = orders.filter(
-                order_date__date__gte=start_date,
-                order_date__date__lte=end_date
+                delivery_date__gte=start_date,
+                delivery_date__lte=end_date
             )
 
         if school_id and school_type:
@@ -6325,9 +5706,9 @@ def get_orders_over_time(request):
 
         # Get orders with order_date field
         orders = Order.objects.filter(
-            order_date__date__gte=start_date,
-            order_date__date__lte=end_date
-        ).exclude(status__iexact="cancelled")
+            delivery_date__gte=start_date,
+            delivery_date__lte=end_date
+        ).exclude(status__in=UNPLACED_STATUSES)
 
         if school_id and school_type:
             if school_type == 'primary':
@@ -6378,6 +5759,7 @@ def _serialize_promotion(promotion):
         'min_order_count': promotion.min_order_count,
         'exclude_primary_orders': promotion.exclude_primary_orders,
         'max_redemptions': promotion.max_redemptions,
+        'redeemed_count': promotion.redeemed_count,
     }
 
 
@@ -6415,7 +5797,10 @@ def promotions(request):
             schools=schools,
             max_redemptions=max_redemptions,
         )
+        sync_promotion_schools(promotion)
+        invalidate_active_promotions()
         promotion.refresh_from_db()
+        rebuild_promotion_progress(promotion)
         return Response(_serialize_promotion(promotion), status=status.HTTP_201_CREATED)
 
 
@@ -6447,14 +5832,61 @@ def promotion_detail(request, pk):
         if 'max_redemptions' in request.data:
             promotion.max_redemptions = request.data.get('max_redemptions') or None
         promotion.save()
+        sync_promotion_schools(promotion)
+        invalidate_active_promotions()
         promotion.refresh_from_db()
+        rebuild_promotion_progress(promotion)
         return Response(_serialize_promotion(promotion))
 
     elif request.method == 'DELETE':
         promotion.delete()
+        invalidate_active_promotions()
         return Response({'message': 'Promotion deleted successfully.'}, status=status.HTTP_200_OK)
 
 
+@api_view(['GET'])
+def promotion_progress_view(request):
+    """
+    Progress of a user towards the running order-count promotions.
+    Query params: user_id, user_type (required), school_id, school_type (optional)
+    """
+    user_id = request.GET.get('user_id')
+    user_type = request.GET.get('user_type')
+    if not user_id or user_type not in ['parent', 'staff', 'student']:
+        return Response({'error': 'user_id and a valid user_type are required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    school_id = request.GET.get('school_id')
+    try:
+        user_id = int(user_id)
+        school_id = int(school_id) if school_id else None
+    except ValueError:
+        return Response({'error': 'user_id and school_id must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'promotions': promotion_progress(user_type, user_id, school_id, request.GET.get('school_type')),
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def promotion_evaluation_detail(request, pk):
+    """
+    Outcome of the promotion check queued by a checkout (`promotion_evaluation_id`).
+    status is 'pending' until the post-commit evaluation has run.
+    """
+    try:
+        evaluation = PromotionEvaluation.objects.get(pk=pk)
+    except PromotionEvaluation.DoesNotExist:
+        return Response({'error': 'Promotion evaluation not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response({
+        'id': evaluation.id,
+        'status': evaluation.status,
+        'promotion_rewards': evaluation.rewards,
+        'pending_promotions': evaluation.pending_promotions,
+        'completed_at': str(evaluation.completed_at) if evaluation.completed_at else None,
+    }, status=status.HTTP_200_OK)
+
+
 # ------------------------------
 # Manager Dashboard Orders
 # ------------------------------
@@ -6554,12 +5986,8 @@ def manager_school_menus(request):
     except ValueError:
         return Response({'error': 'Invalid school_id.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    if school_type == 'primary':
-        menus = Menu.objects.filter(primary_schools__id=school_id, is_active=True, is_deleted=False)
-    elif school_type == 'secondary':
-        menus = Menu.objects.filter(secondary_schools__id=school_id, is_active=True, is_deleted=False)
-    else:
+    if school_type not in ('primary', 'secondary'):
         return Response({'error': 'Invalid school_type. Use primary or secondary.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    item_names = list(menus.values_list('name', flat=True).distinct())
-    return Response({'items': item_names}, status=status.HTTP_200_OK)
+    snapshot = get_menu_snapshot(school_type, school_id)
+    return snapshot_response(request, snapshot.items_body, snapshot.items_etag)
@@ -103,6 +103,7 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'accept',
     'x-requested-with',
+    'idempotency-key',
 ]
 CORS_ALLOW_METHODS = [
     'GET',
@@ -163,6 +164,18 @@ CRONJOBS = [
     # Cron format: minute hour day month day-of-week
     # 5 = Friday (0 = Sunday, 1 = Monday, ..., 5 = Friday, 6 = Saturday)
     ('00 08 * * 5', 'admin_section.cron.deactivate_menu_cycles'),
+
+    # Settle interrupted card checkouts every 15 minutes
+    ('*/15 * * * *', 'admin_section.cron.reconcile_checkout_payments'),
+
+    # Evict expired Idempotency-Key records and order tombstones every night at 3 AM
+    ('00 03 * * *', 'admin_section.cron.purge_idempotency_keys'),
+
+    # Snapshot credit ledger balances every hour
+    ('05 * * * *', 'admin_section.cron.snapshot_credit_balances'),
+
+    # Pick up promotion evaluations lost by a worker restart every 5 minutes
+    ('*/5 * * * *', 'admin_section.cron.process_promotion_evaluations'),
 ]
 
 
@@ -193,6 +206,19 @@ FRONTEND_URL = config('FRONTEND_URL')
 
 STRIPE_PUBLIC_KEY = config('STRIPE_PUBLIC_KEY')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY')
+# "stripe" for the real API, "local" for the offline stand-in (admin_section/utils/stripe_gateway.py)
+STRIPE_BACKEND = config('STRIPE_BACKEND', default='stripe')
+
+# Promotions are evaluated after the checkout commits, on a thread pool of
+# PROMOTION_WORKERS threads; PROMOTIONS_ASYNC=False runs them inline at commit.
+PROMOTIONS_ASYNC = config('PROMOTIONS_ASYNC', default=True, cast=bool)
+PROMOTION_WORKERS = config('PROMOTION_WORKERS', default=2, cast=int)
+
+# Seconds clients may reuse a published menu before revalidating it by ETag
+MENU_SNAPSHOT_MAX_AGE = config('MENU_SNAPSHOT_MAX_AGE', default=60, cast=int)
+# Absolute root URL that menu image paths are joined onto in published menus.
+# Configured rather than taken from the request, so any Host header maps to the same snapshot.
+MENU_IMAGE_BASE_URL = config('MENU_IMAGE_BASE_URL', default='http://localhost:8000/')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 